@@ -0,0 +1,177 @@
+import json
+import os
+import threading
+from datetime import datetime
+from helper_logs import logger
+from tools import DATA_DIR
+from Filament.mapping_store import mapping_store, target_filament
+
+TASKS_FILE = os.path.join(DATA_DIR, "task.txt")
+STATS_FILE = os.path.join(DATA_DIR, "usage_stats.json")
+SLICER_FILE = os.path.join(DATA_DIR, "slicer_filaments.txt")
+
+# Same format used by BambuPrinter when it stamps start/end times
+TIME_FORMAT = "%H:%M:%S-%d-%m-%Y"
+
+def _empty_stats():
+    return {
+        "total_grams": 0.0,
+        "tasks": {"complete": 0, "failed": 0, "other": 0},
+        "waste": {"grams": 0.0, "failed_tasks": 0, "lost_percent": 0.0},
+        "by_spool": {},
+        "by_filament": {},
+        "by_filament_type": {},
+        "by_day": {},
+        "by_week": {},
+        "by_month": {},
+        "last_task_end": None,
+    }
+
+def _add(bucket, key, grams):
+    key = str(key)
+    bucket[key] = round(bucket.get(key, 0.0) + grams, 3)
+
+class UsageStats:
+    """Rolling filament consumption totals, updated one task at a time."""
+
+    def __init__(self, stats_file=STATS_FILE, tasks_file=TASKS_FILE):
+        self.stats_file = stats_file
+        self.tasks_file = tasks_file
+        self.lock = threading.Lock()
+        self.stats = _empty_stats()
+        # Serialized view handed to readers, rebuilt after every update
+        self.snapshot = json.loads(json.dumps(self.stats))
+        self._types = {}
+        self._types_mtime = None
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.stats_file, "r", encoding="utf-8") as f:
+                stats = json.load(f)
+            for key, value in _empty_stats().items():
+                stats.setdefault(key, value)
+            self.stats = stats
+            self.snapshot = json.loads(json.dumps(stats))
+        except FileNotFoundError:
+            # First run with an existing history: aggregate it once
+            if os.path.exists(self.tasks_file):
+                self.Rebuild()
+        except (json.JSONDecodeError, OSError) as e:
+            logger.log_error(f"Usage stats file unreadable, rebuilding: {e}")
+            self.Rebuild()
+
+    def _save(self):
+        tmp_file = self.stats_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(self.stats, f)
+        os.replace(tmp_file, self.stats_file)
+
+    def _filament_types(self):
+        """Slicer filament id -> material, reloaded only when the file changes."""
+        try:
+            mtime = os.path.getmtime(SLICER_FILE)
+        except OSError:
+            return self._types
+        if mtime != self._types_mtime:
+            from Filament.filament import parse_filaments
+            self._types = {f["id"]: f["type"] for f in parse_filaments(SLICER_FILE).values()}
+            self._types_mtime = mtime
+        return self._types
+
+    def _load_mapping(self):
+        return mapping_store.snapshot().forward
+
+    def _apply(self, task, types, mapping):
+        stats = self.stats
+        status = task.get("status")
+        if status == "Complete":
+            stats["tasks"]["complete"] += 1
+        elif status == "Failed":
+            stats["tasks"]["failed"] += 1
+        else:
+            stats["tasks"]["other"] += 1
+
+        try:
+            end = datetime.strptime(task.get("end_time") or "", TIME_FORMAT)
+        except ValueError:
+            end = None
+
+        grams_total = 0.0
+        # A filament can feed from two trays: keep each reported entry, in order
+        reported = {}
+        for f in task.get("reported_filament") or []:
+            reported.setdefault(f.get("filamentId"), []).append(f)
+        for filament in task.get("teoric_filaments") or []:
+            try:
+                grams = float(filament.get("weight") or 0)
+            except (TypeError, ValueError):
+                continue
+            if grams <= 0:
+                continue
+            filament_id = filament.get("filamentId")
+            grams_total += grams
+            _add(stats["by_filament"], filament_id, grams)
+            _add(stats["by_filament_type"], types.get(filament_id, "Unknown"), grams)
+            # Only what was actually reported to Spoolman is charged to a spool, which
+            # after a failed final report is just the grams sent while printing
+            charged = reported.get(filament_id)
+            if charged:
+                charged = charged.pop(0)
+                spool_id = charged.get("spoolId", mapping.get(filament_id))
+                try:
+                    charged_grams = float(charged.get("weight") or 0)
+                except (TypeError, ValueError):
+                    charged_grams = 0.0
+                if spool_id is not None and target_filament(spool_id) is None and charged_grams > 0:
+                    _add(stats["by_spool"], spool_id, charged_grams)
+            if end is not None:
+                year, week, _ = end.isocalendar()
+                _add(stats["by_day"], end.strftime("%Y-%m-%d"), grams)
+                _add(stats["by_week"], f"{year}-W{week:02d}", grams)
+                _add(stats["by_month"], end.strftime("%Y-%m"), grams)
+
+        stats["total_grams"] = round(stats["total_grams"] + grams_total, 3)
+        if status == "Failed":
+            # Everything extruded before the failure went to waste
+            waste = stats["waste"]
+            waste["grams"] = round(waste["grams"] + grams_total, 3)
+            waste["failed_tasks"] += 1
+            try:
+                lost = float(task.get("percent_complete") or 0) - float(task.get("init_percent") or 0)
+            except (TypeError, ValueError):
+                lost = 0.0
+            waste["lost_percent"] = round(waste["lost_percent"] + max(lost, 0.0), 3)
+        if end is not None:
+            stats["last_task_end"] = task.get("end_time")
+
+    def AddTask(self, task):
+        """Fold one finished task (PrintTask.to_dict()) into the totals."""
+        with self.lock:
+            self._apply(task, self._filament_types(), self._load_mapping())
+            self._save()
+            self.snapshot = json.loads(json.dumps(self.stats))
+
+    def GetStats(self):
+        """Return the latest snapshot. Never recomputes anything."""
+        return self.snapshot
+
+    def Rebuild(self):
+        """Recompute every total from the task journal."""
+        try:
+            with open(self.tasks_file, "r", encoding="utf-8") as f:
+                tasks = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            tasks = []
+        with self.lock:
+            self.stats = _empty_stats()
+            types = self._filament_types()
+            mapping = self._load_mapping()
+            for task in tasks:
+                self._apply(task, types, mapping)
+            self._save()
+            self.snapshot = json.loads(json.dumps(self.stats))
+        logger.log_info(f"Usage stats rebuilt from {len(tasks)} tasks")
+        return self.snapshot
+
+usage_stats = UsageStats()
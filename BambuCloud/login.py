@@ -2,6 +2,7 @@ import requests
 import os
 from tools import *
 from helper_logs import logger
+from Metrics.metrics import track_call
 
 # API endpoint for login and sending the verification code
 LOGIN_URL = "https://api.bambulab.com/v1/user-service/user/login"
@@ -46,7 +47,10 @@ def SendVerificationCode():
         "type": "codeLogin"
     }
     try:
-        response = requests.post(SEND_CODE_URL, headers=HEADERS, json=payload)
+        with track_call("bambucloud", "send_code") as call:
+            response = requests.post(SEND_CODE_URL, headers=HEADERS, json=payload)
+            if response.status_code != 200:
+                call.fail()
         if response.status_code == 200:
             logger.log_info("Verification code sent to your email.")
             return True
@@ -78,7 +82,10 @@ def LoginAndGetToken(verification_code=None):
         }
 
     try:
-        response = requests.post(LOGIN_URL, headers=HEADERS, json=payload, timeout=15)
+        with track_call("bambucloud", "login") as call:
+            response = requests.post(LOGIN_URL, headers=HEADERS, json=payload, timeout=15)
+            if response.status_code != 200:
+                call.fail()
     except requests.exceptions.RequestException as e:
         logger.log_exception(e)
         return LOGIN_NETWORK_ERROR
@@ -116,7 +123,10 @@ def TestToken():
     HEADERS['Authorization'] = f"Bearer {ACCES_TOKEN}"
 
     try:
-        response = requests.get(TEST_URL, headers=HEADERS)
+        with track_call("bambucloud", "bind") as call:
+            response = requests.get(TEST_URL, headers=HEADERS)
+            if response.status_code != 200:
+                call.fail()
         if response.status_code == 200:
             logger.log_info("Test completed successfully")
             data = response.json()
@@ -130,6 +140,12 @@ def TestToken():
                 if dev_access_code and dev_id:
                     SaveNewToken("dev_acces_code", dev_access_code)
                     SaveNewToken("dev_id", dev_id)
+
+            # Every bound printer gets its own section; the IP is set from the GUI
+            for device in devices:
+                if device.get("dev_id") and device.get("dev_access_code"):
+                    SavePrinterSetting(device["dev_id"], "dev_acces_code", device["dev_access_code"])
+                    SavePrinterSetting(device["dev_id"], "name", device.get("name") or device["dev_id"])
             return True
         else:
             logger.log_error(f"Failed to test the access code {response.status_code}: {response.text}")
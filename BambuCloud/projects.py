@@ -2,6 +2,7 @@ import requests
 import os
 from tools import *
 from helper_logs import logger
+from Metrics.metrics import track_call
 
 BASE_URL = "https://api.bambulab.com/v1"
 
@@ -31,7 +32,10 @@ def GetJobID(taskID):
     try:
         # Concatenate the base URL with the task ID
         url = BASE_URL + "/iot-service/api/user/task/" + str(taskID)
-        response = requests.get(url, headers=HEADERS)
+        with track_call("bambucloud", "task") as call:
+            response = requests.get(url, headers=HEADERS)
+            if response.status_code != 200:
+                call.fail()
         if response.status_code == 200:
             json_data = response.json()
             if "job_id" in json_data:
@@ -56,7 +60,10 @@ def GetTaksDetail(jobID):
     
     try:
         url = BASE_URL + "/user-service/my/tasks"
-        response = requests.get(url, headers=HEADERS)
+        with track_call("bambucloud", "my_tasks") as call:
+            response = requests.get(url, headers=HEADERS)
+            if response.status_code != 200:
+                call.fail()
         if response.status_code == 200:
             json_data = response.json()
             if json_data["hits"]:
@@ -3,6 +3,7 @@ import requests
 from tools import *
 import json
 from helper_logs import logger
+from Metrics.metrics import track_call
 
 slicer_version = "1.10.0.89"
 URL = f"https://api.bambulab.com/v1/iot-service/api/slicer/setting?version={slicer_version}"
@@ -45,7 +46,10 @@ def GetSlicerFilaments():
     headers['Authorization'] = f"Bearer {access_token}"
 
     try:
-        response = requests.get(URL, headers=headers, timeout=8)
+        with track_call("bambucloud", "slicer_setting") as call:
+            response = requests.get(URL, headers=headers, timeout=8)
+            if response.status_code != 200:
+                call.fail()
 
         # Success
         if response.status_code == 200:
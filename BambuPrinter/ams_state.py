@@ -0,0 +1,127 @@
+import threading
+
+EXTERNAL_TRAY = 254  # vt_tray, the spool holder outside the AMS
+TRAYS_PER_UNIT = 4
+
+class Tray:
+  __slots__ = ("index", "unit", "slot", "filament_id", "filament_type", "color", "remain")
+
+  def __init__(self, index, filament_id, filament_type, color, remain):
+    self.index = index
+    self.unit, self.slot = divmod(index, TRAYS_PER_UNIT) if index != EXTERNAL_TRAY else (None, None)
+    self.filament_id = filament_id
+    self.filament_type = filament_type
+    self.color = color
+    self.remain = remain
+
+  def to_dict(self):
+    return {"tray": self.index, "unit": self.unit, "slot": self.slot, "filamentId": self.filament_id,
+            "type": self.filament_type, "color": self.color, "remain": self.remain}
+
+def _int(value, default=None):
+  try:
+    return int(value)
+  except (TypeError, ValueError):
+    return default
+
+def _tray_from_report(index, tray):
+  """None for an empty slot: printers report those with the id alone."""
+  filament_id = tray.get("tray_info_idx")
+  if not filament_id and not tray.get("tray_type"):
+    return None
+  return Tray(index, filament_id or None, tray.get("tray_type") or None,
+              tray.get("tray_color") or None, _int(tray.get("remain"), -1))
+
+class AMSState:
+  """Loaded filament per tray, keyed by the global tray index used in task amsDetailMapping
+  (unit * 4 + slot, 254 for the external spool)."""
+
+  def __init__(self):
+    self.trays = {}
+    self.tray_now = None
+    # Spoolman spool picked for a tray through a filament-level mapping; kept
+    # until the tray is emptied or reloaded with another filament
+    self.spools = {}
+    self.lock = threading.Lock()
+
+  def UpdateAMS(self, ams):
+    """Apply the merged `ams` report: {"ams": [{"id": unit, "tray": [{"id": slot, ...}]}], "tray_now": ...}."""
+    trays = {}
+    for unit in ams.get("ams") or ():
+      unit_id = _int(unit.get("id"))
+      if unit_id is None:
+        continue
+      for tray in unit.get("tray") or ():
+        slot = _int(tray.get("id"))
+        if slot is None:
+          continue
+        index = unit_id * TRAYS_PER_UNIT + slot
+        loaded = _tray_from_report(index, tray)
+        if loaded is not None:
+          trays[index] = loaded
+    with self.lock:
+      external = self.trays.get(EXTERNAL_TRAY)
+      if external is not None:
+        trays[EXTERNAL_TRAY] = external
+      self.trays = trays
+      self._ForgetUnloaded()
+      if "tray_now" in ams:
+        self.tray_now = _int(ams["tray_now"])
+
+  def UpdateExternal(self, vt_tray):
+    loaded = _tray_from_report(EXTERNAL_TRAY, vt_tray)
+    with self.lock:
+      trays = dict(self.trays)
+      if loaded is None:
+        trays.pop(EXTERNAL_TRAY, None)
+      else:
+        trays[EXTERNAL_TRAY] = loaded
+      self.trays = trays
+      self._ForgetUnloaded()
+
+  def _ForgetUnloaded(self):
+    """Called with the lock held."""
+    self.spools = {index: (filament_id, spool_id) for index, (filament_id, spool_id) in self.spools.items()
+                   if index in self.trays and self.trays[index].filament_id == filament_id}
+
+  def AssignSpool(self, index, spool_id):
+    tray = self.Get(index)
+    if tray is None or spool_id is None:
+      return
+    with self.lock:
+      spools = dict(self.spools)
+      spools[tray.index] = (tray.filament_id, spool_id)
+      self.spools = spools
+
+  def LoadedSpool(self, index):
+    """Spool assigned to the tray, or None."""
+    tray = self.Get(index)
+    if tray is None:
+      return None
+    assigned = self.spools.get(tray.index)
+    return assigned[1] if assigned else None
+
+  def Get(self, index):
+    """Tray for an amsDetailMapping "ams" index, or None when unknown or empty."""
+    index = _int(index)
+    if index is not None and index > EXTERNAL_TRAY:
+      # 255 is also used for "external" on some firmware
+      index = EXTERNAL_TRAY
+    return self.trays.get(index)
+
+  def Find(self, filament_id, color=None):
+    """Tray holding filament_id, preferring one of the same colour. None when not loaded."""
+    if not filament_id:
+      return None
+    wanted = (color or "").lstrip("#").upper()[:6]
+    found = None
+    for tray in self.trays.values():
+      if tray.filament_id != filament_id:
+        continue
+      if wanted and (tray.color or "").upper()[:6] == wanted:
+        return tray
+      found = found or tray
+    return found
+
+  def Snapshot(self):
+    return [tray.to_dict() for _, tray in sorted(self.trays.items())]
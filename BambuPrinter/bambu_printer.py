@@ -1,11 +1,17 @@
-import json
 import BambuCloud
 import BambuCloud.projects
 from enum import Enum
 from BambuPrinter.print_task import PrintTask
+from BambuPrinter.printer_state import PrinterState
+from BambuPrinter.ams_state import AMSState
+import BambuPrinter.local_usage as local_usage
+from BambuPrinter.checkpoint import ReadCheckpoint, RemoveCheckpoint, WriteCheckpoint
+import Spoolman.spoolman_filament as spoolman_filament
+from BambuPrinter.report_parser import ReportParser
 import time
 from datetime import datetime
 from helper_logs import logger
+from Metrics.metrics import mqtt_messages, mqtt_processing_seconds
 
 class State (Enum):
   IDLE = 0
@@ -16,81 +22,171 @@ class State (Enum):
 
 class BambuPrinter:
   
-  def __init__(self):
+  def __init__(self, dev_id=None, name=None):
+    self.dev_id = dev_id
+    self.name = name or dev_id
     self.current_state = State.UNKWON
     self.new_state = State.UNKWON
     self.current_gcode = None 
     self.current_filament = None
     self.current_percent = 0
     self.print_task = PrintTask()
+    self.print_task.printer_id = dev_id
     self.first_time = True
     self.complete_task = False
     self.externalFilamentID = 0
+    # Task that was in flight when the service stopped, picked up on the first report
+    self.checkpoint = ReadCheckpoint(dev_id)
+    self.state = PrinterState()
+    self.ams = AMSState()
+    self.change_listeners = []
+    # Fields the printer FSM reacts to, in the order they must be applied
+    self.field_handlers = (
+      ("mc_percent", self.SetPrintPercentatge),
+      ("stg_cur", self.SetCurrentState),
+      ("gcode_state", self.SetGcodeState),
+      ("task_id", self.SetWeightDetail),
+      ("ams", self.AMSFilamentParser),
+      ("vt_tray", self.ExternalFilamentParser),
+    )
+    self.handled_fields = frozenset(field for field, _ in self.field_handlers)
+    self.parser = ReportParser(self.handled_fields)
+    # Used to find the job file for local usage extraction
+    self.WatchFields(("gcode_file", "subtask_name"))
+
+  def AddChangeListener(self, callback, fields=()):
+    """callback(changed_fields, printer) runs after every report that changed something.
+
+    Only watched fields reach the state model, so pass any extra fields the listener needs.
+    """
+    self.WatchFields(fields)
+    self.change_listeners.append(callback)
+
+  def WatchFields(self, fields):
+    self.parser.AddKeys(fields)
 
   def ProccessMQTTMsg(self, msg):
-    data = msg.payload.decode()
-    parsed_data = json.loads(data)
-    if "print" in parsed_data:
-      parsed_data = parsed_data["print"]
-      if "mc_percent" in parsed_data:
-        self.SetPrintPercentatge(parsed_data["mc_percent"])
-      if "stg_cur" in  parsed_data:
-        self.SetCurrentState(parsed_data["stg_cur"])
-      if "gcode_state" in  parsed_data: 
-        self.SetGcodeState(parsed_data["gcode_state"])
-      if "task_id" in  parsed_data:
-        self.SetWeightDetail(parsed_data["task_id"])
-      if "ams" in parsed_data:
-        self.AMSFilamentParser(parsed_data["ams"])
-      if "vt_tray" in parsed_data:
-        self.ExternalFilamentParser(parsed_data["vt_tray"])
-    else:
-      pass
+    start = time.perf_counter()
+    msg_type = "unknown"
+    try:
+      msg_type = self._ProccessMQTTMsg(msg)
+    finally:
+      mqtt_messages.inc(msg_type)
+      mqtt_processing_seconds.observe(time.perf_counter() - start, msg_type)
+
+  def _ProccessMQTTMsg(self, msg):
+    fields, msg_type = self.ParseReport(msg.payload)
+    if fields:
+      self.ApplyReport(fields)
+    return msg_type
+
+  def ParseReport(self, payload):
+    """(fields, msg_type); parsed straight from the bytes, reports without watched fields give no fields."""
+    return self.parser.Parse(payload)
+
+  def ApplyReport(self, fields):
+    self.ApplyChanges(self.state.Merge(fields))
     
     
+  def ApplyChanges(self, changed):
+    """Run handlers only for fields whose merged value changed."""
+    if not changed:
+      return
+    if not changed.isdisjoint(self.handled_fields):
+      snapshot = self.state.snapshot
+      for field, handler in self.field_handlers:
+        if field in changed:
+          handler(snapshot[field])
+      # A state transition may have cleaned the task after its task_id was
+      # already known; the id will not change again, so apply it once more
+      task_id = snapshot.get("task_id")
+      if (("stg_cur" in changed or "gcode_state" in changed) and task_id is not None
+          and self.print_task.task_id is None and self.complete_task):
+        self.SetWeightDetail(task_id)
+    for listener in self.change_listeners:
+      try:
+        listener(changed, self)
+      except Exception as e:
+        logger.log_exception(e)
+
+  def Tag(self):
+    return f"[{self.name}] " if self.name else ""
+
   def AMSFilamentParser(self, msg):
-    pass
+    self.ams.UpdateAMS(msg)
 
   def ExternalFilamentParser(self, msg):
     if "tray_info_idx" in msg:
       self.externalFilamentID = msg["tray_info_idx"]
-    pass
+    self.ams.UpdateExternal(msg)
 
   def SetWeightDetail(self, task_id):
-    self.print_task.task_id = task_id
-    if task_id == "0":
-      logger.log_error("Task ID is 0. This integration just works with cloud print tasks")
+    if self.first_time and self.checkpoint:
+      # First report with a task_id after a restart, and no state change in it
+      self.ComprobateState()
+    if task_id == self.print_task.task_id and self.print_task.teoric_filaments:
+      # Resumed from a checkpoint, the cloud detail is already known
       return
-    job_id = BambuCloud.projects.GetJobID(task_id)
-    self.print_task.job_id = job_id
-    task_detail = BambuCloud.projects.GetTaksDetail(job_id)
+    self.print_task.task_id = task_id
+    task_detail = None
+    # LAN and SD card prints have no cloud task; read the job file instead
+    if task_id == "0" or local_usage.PreferLocal():
+      task_detail = self.LocalTaskDetail()
+    if task_detail is None:
+      if task_id == "0":
+        logger.log_error(f"{self.Tag()}Task ID is 0 and the job file could not be read. Usage is only known for cloud print tasks or readable job files")
+        return
+      job_id = BambuCloud.projects.GetJobID(task_id)
+      self.print_task.job_id = job_id
+      task_detail = BambuCloud.projects.GetTaksDetail(job_id)
     if task_detail is not None:
       self.print_task.total_weight = task_detail["weight"]
       self.print_task.model_name = task_detail["title"]
       self.print_task.image_cover_url = task_detail["cover"]
       
-      # ToDo: This is ams filament. If empty get filament from external spool mqtt
-      ## object►print►vt_tray►tray_info_idx is the filament ID. Weight can be getted from weight in task detail
+      # "ams" in each mapping entry is the tray the slicer assigned. What that tray
+      # holds right now (from the AMS reports) decides the filament, and the
+      # filament mapping the spool it is charged to.
       filament = []
       nonAsignedFilament = 0
       for ams in task_detail["amsDetailMapping"]:
-        if ams["filamentId"] == "":
-          logger.log_info("Filament ID empty. Asigning to external spool")
+        tray = self.ams.Get(ams.get("ams"))
+        filament_id = tray.filament_id if tray is not None and tray.filament_id else ams["filamentId"]
+        if filament_id == "":
+          logger.log_info(f"{self.Tag()}Filament ID empty. Asigning to external spool")
           nonAsignedFilament += task_detail["weight"]
           
-        logger.log_info(ams["filamentId"])
+        logger.log_info(filament_id)
         logger.log_info(ams["weight"])
-        filament.append({ "filamentId": ams["filamentId"], "weight": ams["weight"]})
+        entry = { "filamentId": filament_id, "weight": ams["weight"]}
+        if tray is not None:
+          entry["tray"] = tray.index
+          spool_id = spoolman_filament.ResolveSpool(filament_id, self.ams.LoadedSpool(tray.index))
+          if spool_id is not None:
+            entry["spoolId"] = spool_id
+            self.ams.AssignSpool(tray.index, spool_id)
+        filament.append(entry)
       if nonAsignedFilament > 0:
-        logger.log_error(f"Non asigned filament: {nonAsignedFilament}")
+        logger.log_error(f"{self.Tag()}Non asigned filament: {nonAsignedFilament}")
         filament.append({ "filamentId": self.externalFilamentID, "weight": nonAsignedFilament})
       self.print_task.teoric_filaments = filament
+      self.SaveCheckpoint()
+
+  def LocalTaskDetail(self):
+    if self.state.Get("gcode_state") not in ("PREPARE", "RUNNING", "PAUSE"):
+      return None
+    return local_usage.LocalTaskDetail(self.dev_id, self.state.Get("gcode_file"),
+                                       self.state.Get("subtask_name"), self.ams)
 
   def SetPrintPercentatge(self, percentage):
     self.current_percent = percentage
+    if self.current_state == State.PRINTING and self.complete_task:
+      if self.print_task.ReportProgress(percentage, self.SaveCheckpoint):
+        # Again for the spools resolved and the grams that could not be queued
+        self.SaveCheckpoint()
 
   def SetCurrentState(self, id):
-    logger.log_info(f"Current state {id}")
+    logger.log_info(f"{self.Tag()}Current state {id}")
     if id == 0:
       self.new_state = State.PRINTING
     elif (id == 1 or id == 8 or id == 2) and self.current_state == State.IDLE:
@@ -98,11 +194,11 @@ class BambuPrinter:
     elif id == 255:
       self.new_state = State.IDLE
     else:
-      logger.log_error(f"Undefined state id: {id}")
+      logger.log_error(f"{self.Tag()}Undefined state id: {id}")
     self.ComprobateState()
     
   def SetGcodeState(self, gcode):
-    logger.log_info(f"Gcode state {gcode}")
+    logger.log_info(f"{self.Tag()}Gcode state {gcode}")
     if gcode == "FAILED":
       self.new_state = State.FAILED
     elif gcode == "PREPARE":
@@ -111,37 +207,73 @@ class BambuPrinter:
       self.new_state = State.IDLE
     self.ComprobateState()
       
+  def SaveCheckpoint(self):
+    """Called on every transition; only an active task is worth keeping."""
+    if not self.complete_task:
+      RemoveCheckpoint(self.dev_id)
+      return
+    WriteCheckpoint(self.dev_id, {
+      "state": self.current_state.name,
+      "current_percent": self.current_percent,
+      "task": self.print_task.to_checkpoint(),
+    })
+
+  def ResumeTask(self):
+    """Restore the checkpointed task if the printer still reports the same task_id."""
+    checkpoint, self.checkpoint = self.checkpoint, None
+    if not checkpoint:
+      return False
+    task = checkpoint.get("task") or {}
+    task_id = self.state.Get("task_id")
+    if str(task_id) != str(task.get("task_id")) or checkpoint.get("state") not in State.__members__:
+      logger.log_warning(f"{self.Tag()}Discarding checkpoint of task {task.get('task_id')}, printer reports task {task_id}")
+      RemoveCheckpoint(self.dev_id)
+      return False
+    self.print_task.CleanTask()
+    self.print_task.restore(task)
+    self.current_state = State[checkpoint["state"]]
+    self.complete_task = True
+    if self.new_state == State.UNKWON:
+      self.new_state = self.current_state
+    logger.log_info(f"{self.Tag()}Resumed task {task_id} ({self.current_state.name}) from checkpoint")
+    return True
+
   def ComprobateState(self):
     # Correct sync on first time event
     if self.first_time:
+      if self.checkpoint and self.state.Get("task_id") is None:
+        # Delta reports carry no task_id; wait for one that does (the pushall
+        # answer) before deciding whether the checkpointed task is still running
+        return
       self.first_time = False
-      self.complete_task = False
-      self.current_state = self.new_state
-      self.print_task.CleanTask()
-      return
+      if not self.ResumeTask():
+        self.complete_task = False
+        self.current_state = self.new_state
+        self.print_task.CleanTask()
+        return
     
     if self.current_state != self.new_state:
       # Finished task printing. Print task is saved.
       if self.new_state == State.IDLE and self.current_state == State.PRINTING:
-        logger.log_info("Printer is idle.")
+        logger.log_info(f"{self.Tag()}Printer is idle.")
         self.print_task.percent_complete = self.current_percent
         self.print_task.status = "Complete"
         self.print_task.end_time = datetime.now().strftime("%H:%M:%S-%d-%m-%Y")
-        logger.log_info(f"Task complete {self.complete_task}")
+        logger.log_info(f"{self.Tag()}Task complete {self.complete_task}")
         if self.complete_task == True:
           self.print_task.ReportAndSaveTask()
         self.complete_task = False
         
       # Print taks is received and start preparing
       elif(self.new_state == State.PREPARING):
-        logger.log_info("Printer is preparing.")
+        logger.log_info(f"{self.Tag()}Printer is preparing.")
         self.complete_task = True
         self.print_task.CleanTask()
         self.print_task.start_time = datetime.now().strftime("%H:%M:%S-%d-%m-%Y")
         
       # Print taks is received and start printing without preparing
       elif(self.new_state == State.PRINTING and self.current_state != State.PREPARING):
-        logger.log_info("Printer is printing.")
+        logger.log_info(f"{self.Tag()}Printer is printing.")
         self.complete_task = True
         self.print_task.CleanTask()
         self.print_task.start_time = datetime.now().strftime("%H:%M:%S-%d-%m-%Y")
@@ -153,7 +285,7 @@ class BambuPrinter:
         
       # Print task is cancelled or failed. Print task is saved.
       elif self.new_state == State.FAILED and self.current_state == State.PRINTING:
-        logger.log_info("Print failed.")
+        logger.log_info(f"{self.Tag()}Print failed.")
         self.print_task.percent_complete = self.current_percent
         self.print_task.status = "Failed"
         self.print_task.end_time = datetime.now().strftime("%H:%M:%S-%d-%m-%Y")
@@ -162,7 +294,6 @@ class BambuPrinter:
         self.complete_task = False
         self.new_state = State.IDLE
         
-      logger.log_info(f"State change from {self.current_state.name} to {self.new_state.name}")
+      logger.log_info(f"{self.Tag()}State change from {self.current_state.name} to {self.new_state.name}")
       self.current_state = self.new_state
-
-bambu_printer = BambuPrinter()
\ No newline at end of file
+      self.SaveCheckpoint()
@@ -0,0 +1,43 @@
+import json
+import os
+from helper_logs import logger
+from tools import DATA_DIR
+
+CHECKPOINT_DIR = os.path.join(DATA_DIR, "checkpoints")
+VERSION = 1
+
+def CheckpointPath(dev_id):
+  return os.path.join(CHECKPOINT_DIR, f"{dev_id or 'default'}.json")
+
+def WriteCheckpoint(dev_id, data):
+  """Replace the checkpoint in one step: readers see the old file or the new one, never half of it."""
+  path = CheckpointPath(dev_id)
+  tmp = path + ".tmp"
+  try:
+    os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+    with open(tmp, "w", encoding="utf-8") as f:
+      json.dump(dict(data, version=VERSION), f, separators=(",", ":"))
+      f.flush()
+      os.fsync(f.fileno())
+    os.replace(tmp, path)
+  except OSError as e:
+    logger.log_error(f"Could not write print checkpoint {path}: {e}")
+
+def ReadCheckpoint(dev_id):
+  try:
+    with open(CheckpointPath(dev_id), "r", encoding="utf-8") as f:
+      data = json.load(f)
+  except FileNotFoundError:
+    return None
+  except (OSError, ValueError) as e:
+    logger.log_error(f"Ignoring unreadable print checkpoint: {e}")
+    return None
+  return data if data.get("version") == VERSION else None
+
+def RemoveCheckpoint(dev_id):
+  try:
+    os.remove(CheckpointPath(dev_id))
+  except FileNotFoundError:
+    pass
+  except OSError as e:
+    logger.log_error(f"Could not remove print checkpoint: {e}")
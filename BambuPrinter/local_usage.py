@@ -0,0 +1,215 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import zipfile
+import xml.etree.ElementTree as ET
+from helper_logs import logger
+from tools import DATA_DIR, ReadCredentials, ReadPrinters
+from BambuPrinter.printer_ftps import FTPS_PORT, LocalFiles, PrinterFiles
+
+CACHE_FILE = os.path.join(DATA_DIR, "job_usage_cache.json")
+CACHE_SIZE = 200
+HEAD_BYTES = 32 * 1024
+TAIL_BYTES = 256 * 1024  # Bambu Studio writes the config block, with per-filament grams, at the end
+
+PLATE_GCODE = re.compile(r"Metadata/plate_(\d+)\.gcode$")
+
+class UsageCache:
+  """Parsed usage keyed by a hash of the job file content, kept in a small JSON file."""
+
+  def __init__(self, path=CACHE_FILE):
+    self.path = path
+    self.lock = threading.Lock()
+    self.entries = None
+
+  def _load(self):
+    if self.entries is None:
+      try:
+        with open(self.path, "r", encoding="utf-8") as f:
+          self.entries = json.load(f)
+      except (OSError, ValueError):
+        self.entries = {}
+
+  def Get(self, key):
+    with self.lock:
+      self._load()
+      return self.entries.get(key)
+
+  def Put(self, key, usage):
+    with self.lock:
+      self._load()
+      self.entries[key] = usage
+      while len(self.entries) > CACHE_SIZE:
+        del self.entries[next(iter(self.entries))]
+      tmp = self.path + ".tmp"
+      with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(self.entries, f)
+      os.replace(tmp, self.path)
+
+usage_cache = UsageCache()
+
+def JobCandidates(gcode_file, subtask_name):
+  """(paths to try on the printer, plate number or None) for the current job."""
+  paths = []
+  plate = None
+  gcode_file = gcode_file or ""
+  match = PLATE_GCODE.search(gcode_file)
+  if match:
+    # Cloud prints run a plate extracted from the project; the project itself sits in /cache
+    plate = int(match.group(1))
+  elif gcode_file:
+    paths += [gcode_file, "/" + os.path.basename(gcode_file), "/cache/" + os.path.basename(gcode_file)]
+  if subtask_name:
+    for name in (f"{subtask_name}.gcode.3mf", f"{subtask_name}.3mf", f"{subtask_name}.gcode"):
+      paths += ["/cache/" + name, "/" + name]
+  return list(dict.fromkeys(paths)), plate
+
+def _split(value):
+  return [v.strip().strip('"') for v in re.split(r"[;,]", value) if v.strip()]
+
+def _number(value, default=0.0):
+  try:
+    return float(value)
+  except (TypeError, ValueError):
+    return default
+
+def ParseSliceInfo(stream, plate=None):
+  """Filaments of one plate from Metadata/slice_info.config, read as a stream."""
+  plates = []
+  for _, element in ET.iterparse(stream, events=("end",)):
+    if element.tag != "plate":
+      continue
+    metadata = {m.get("key"): m.get("value") for m in element.findall("metadata")}
+    filaments = [{
+      "slot": int(f.get("id", 0)),
+      "filamentId": f.get("tray_info_idx", ""),
+      "type": f.get("type"),
+      "color": f.get("color"),
+      "weight": _number(f.get("used_g")),
+    } for f in element.findall("filament")]
+    plates.append((int(metadata.get("index", len(plates) + 1)), metadata, filaments))
+    element.clear()
+  for index, metadata, filaments in plates:
+    if plate is None or index == plate:
+      return {"plate": index, "weight": _number(metadata.get("weight"), sum(f["weight"] for f in filaments)),
+              "filaments": filaments}
+  return None
+
+def Parse3MF(job, plate=None):
+  """(content key, usage) from a 3MF. Only the central directory and slice_info are read."""
+  with zipfile.ZipFile(job) as archive:
+    infos = archive.infolist()
+    # Member CRCs identify the content without reading it
+    digest = hashlib.sha1(repr(sorted((i.filename, i.CRC, i.file_size) for i in infos)).encode())
+    if plate is None:
+      plates = [int(m.group(1)) for m in (PLATE_GCODE.search(i.filename) for i in infos) if m]
+      plate = plates[0] if len(plates) == 1 else None
+    digest.update(str(plate).encode())
+    key = "3mf:" + digest.hexdigest()
+    cached = usage_cache.Get(key)
+    if cached is not None:
+      return key, cached
+    try:
+      with archive.open("Metadata/slice_info.config") as stream:
+        return key, ParseSliceInfo(stream, plate)
+    except KeyError:
+      return key, None
+
+def ParseGcode(job, size):
+  """(content key, usage) from the header and the trailing config block of a G-code file."""
+  job.seek(0)
+  head = job.read(HEAD_BYTES)
+  job.seek(max(0, size - TAIL_BYTES))
+  tail = job.read(TAIL_BYTES)
+  key = "gcode:" + hashlib.sha1(str(size).encode() + head + tail).hexdigest()
+  cached = usage_cache.Get(key)
+  if cached is not None:
+    return key, cached
+  values = {}
+  for line in (head + tail).decode("utf-8", "replace").splitlines():
+    match = re.match(r";\s*([^=:]+?)\s*[=:]\s*(.+)$", line)
+    if match:
+      values.setdefault(match.group(1).strip(), match.group(2).strip())
+  grams = [_number(g) for g in _split(values.get("filament used [g]", ""))]
+  if not grams:
+    total = _number(values.get("total filament weight [g]"), None)
+    if total is None:
+      return key, None
+    grams = [total]
+  ids = _split(values.get("filament_ids", ""))
+  types = _split(values.get("filament_type", ""))
+  colors = _split(values.get("filament_colour", ""))
+  filaments = [{
+    "slot": i + 1,
+    "filamentId": ids[i] if i < len(ids) else "",
+    "type": types[i] if i < len(types) else None,
+    "color": colors[i] if i < len(colors) else None,
+    "weight": grams[i],
+  } for i in range(len(grams)) if grams[i] > 0]
+  return key, {"plate": None, "weight": sum(f["weight"] for f in filaments), "filaments": filaments}
+
+def ExtractUsage(files, gcode_file, subtask_name):
+  """Usage of the current job from a PrinterFiles/LocalFiles source, or None."""
+  paths, plate = JobCandidates(gcode_file, subtask_name)
+  for path in paths:
+    job = files.Open(path)
+    if job is None:
+      continue
+    try:
+      size = job.seek(0, os.SEEK_END)
+      job.seek(0)
+      if path.endswith(".gcode"):
+        key, usage = ParseGcode(job, size)
+      else:
+        key, usage = Parse3MF(job, plate)
+    finally:
+      job.close()
+    if usage is None:
+      continue
+    usage = dict(usage, source=path)
+    usage_cache.Put(key, usage)
+    return usage
+  return None
+
+def _Source(dev_id):
+  credentials = ReadCredentials()
+  directory = credentials.get('DEFAULT', 'local_jobs_dir', fallback=None)
+  if directory:
+    return LocalFiles(directory)
+  printer = ReadPrinters().get(dev_id)
+  if not printer or not printer.get("printer_ip") or not printer.get("dev_acces_code"):
+    return None
+  try:
+    port = int(printer.get("ftps_port", FTPS_PORT))
+  except ValueError:
+    port = FTPS_PORT
+  return PrinterFiles(printer["printer_ip"], printer["dev_acces_code"], port)
+
+def PreferLocal():
+  """Read cloud prints from the job file too, and only ask the cloud when that fails."""
+  value = ReadCredentials().get('DEFAULT', 'prefer_local_usage', fallback="false")
+  return value.lower() in ("1", "true", "yes")
+
+def LocalTaskDetail(dev_id, gcode_file, subtask_name, ams):
+  """Task detail in the shape the cloud returns, built from the job file."""
+  source = _Source(dev_id)
+  if source is None:
+    return None
+  try:
+    with source as files:
+      usage = ExtractUsage(files, gcode_file, subtask_name)
+  except Exception as e:
+    logger.log_error(f"Could not read the job file from the printer: {e}")
+    return None
+  if usage is None:
+    return None
+  mapping = []
+  for filament in usage["filaments"]:
+    tray = ams.Find(filament["filamentId"], filament.get("color"))
+    mapping.append({"ams": tray.index if tray else None, "filamentId": filament["filamentId"],
+                    "weight": filament["weight"]})
+  logger.log_info(f"Usage read from {usage['source']}: {usage['weight']:.2f} g")
+  return {"title": subtask_name or os.path.basename(usage["source"]), "cover": "",
+          "weight": usage["weight"], "amsDetailMapping": mapping}
@@ -1,8 +1,25 @@
 import json
 import os
+import threading
 import Spoolman.spoolman_filament as spoolman_filament
+from Analytics.usage_stats import usage_stats
+from Spoolman.usage_outbox import usage_outbox
+from Scheduler.sync_scheduler import sync_scheduler
 from helper_logs import logger
-from tools import DATA_DIR
+from tools import DATA_DIR, ReadCredentials
+
+# Each printer reports from its own ingest worker; task.txt is shared
+journal_lock = threading.Lock()
+
+def ProgressSettings():
+  """(every_percent, every_grams) for in-print reporting to Spoolman; (0, 0) when off."""
+  credentials = ReadCredentials()
+  def number(key):
+    try:
+      return max(0.0, float(credentials.get('DEFAULT', key, fallback=0)))
+    except ValueError:
+      return 0.0
+  return number("progress_report_percent"), number("progress_report_grams")
 
 class PrintTask:
   def __init__(self):
@@ -19,6 +36,11 @@ class PrintTask:
       self.percent_complete = 0
       self.status = None
       self.image_cover_url = None
+      self.printer_id = None
+      # Grams already sent to Spoolman per teoric_filaments entry, while printing
+      self.reported_weights = {}
+      self.last_progress_percent = None
+      self.progress_settings = None
 
   def to_dict(self):
       """Convert the PrintTask object to a dictionary."""
@@ -34,7 +56,8 @@ class PrintTask:
           "init_percent": self.init_percent,
           "percent_complete": self.percent_complete,
           "status": self.status,
-          "image_cover_url": self.image_cover_url
+          "image_cover_url": self.image_cover_url,
+          "printer_id": self.printer_id
       }
       
   def CleanTask(self):
@@ -51,7 +74,88 @@ class PrintTask:
       self.percent_complete = 0
       self.status = None
       self.image_cover_url = None
-      
+      self.reported_weights = {}
+      self.last_progress_percent = None
+      self.progress_settings = None
+
+  # Everything needed to carry on with a task after a restart
+  CHECKPOINT_FIELDS = ("model_name", "task_id", "job_id", "total_weight", "start_time", "teoric_filaments",
+                       "init_percent", "image_cover_url", "last_progress_percent")
+
+  def to_checkpoint(self):
+      data = {field: getattr(self, field) for field in self.CHECKPOINT_FIELDS}
+      data["reported_weights"] = self.reported_weights
+      return data
+
+  def restore(self, data):
+      for field in self.CHECKPOINT_FIELDS:
+          setattr(self, field, data.get(field))
+      self.init_percent = self.init_percent or 0
+      self.total_weight = self.total_weight or 0
+      # JSON turns the int keys into strings
+      self.reported_weights = {int(i): w for i, w in (data.get("reported_weights") or {}).items()}
+
+  def UsedWeights(self, multiplier):
+      return [multiplier * filament["weight"] for filament in self.teoric_filaments]
+
+  def OutboxKey(self):
+      # task_id is "0" for every LAN/SD print, the start time tells them apart
+      return f"{self.printer_id or ''}/{self.task_id}/{self.start_time}"
+
+  def ChargeFilament(self, filament, weight):
+      """Queue the usage for Spoolman. True once it is safely in the outbox."""
+      # Spool resolved from the loaded AMS tray when the task started
+      spool_id = filament.get("spoolId")
+      if spool_id is None:
+          spool_id = spoolman_filament.ResolveSpool(filament["filamentId"])
+      if spool_id is None:
+          return False
+      # Later reports of this task go to the same spool, even if another becomes active
+      filament["spoolId"] = spool_id
+      return usage_outbox.Add(self.OutboxKey(), spool_id, weight)
+
+  def ReportProgress(self, percent, save_checkpoint=None):
+      """Send usage so far to Spoolman at the configured checkpoints. Only the
+      part not queued yet goes out; the outbox retries delivery on its own.
+      Returns True when a report was made.
+
+      save_checkpoint() is called before the grams are queued: the outbox sums
+      what it gets, so a restart must not find them queued and still unreported."""
+      if not self.teoric_filaments or percent is None:
+          return False
+      if self.progress_settings is None:
+          self.progress_settings = ProgressSettings()
+      every_percent, every_grams = self.progress_settings
+      if not every_percent and not every_grams:
+          return False
+      try:
+          multiplier = (percent - self.init_percent) / (100 - self.init_percent)
+      except ZeroDivisionError:
+          return False
+      if multiplier <= 0 or percent >= 100:
+          # The final report takes care of 100 %
+          return False
+      used = self.UsedWeights(multiplier)
+      pending = sum(u - self.reported_weights.get(i, 0) for i, u in enumerate(used))
+      last = self.last_progress_percent if self.last_progress_percent is not None else self.init_percent
+      if not ((every_percent and percent - last >= every_percent) or (every_grams and pending >= every_grams)):
+          return False
+      charges = []
+      for i in range(len(self.teoric_filaments)):
+          reported = self.reported_weights.get(i, 0)
+          if used[i] - reported > 0:
+              charges.append((i, reported))
+              self.reported_weights[i] = used[i]
+      self.last_progress_percent = percent
+      if save_checkpoint:
+          save_checkpoint()
+      for i, reported in charges:
+          if self.ChargeFilament(self.teoric_filaments[i], used[i] - reported) != True:
+              # Not queued: offered again at the next checkpoint or the final report
+              self.reported_weights[i] = reported
+      logger.log_info(f"Reported usage at {percent}%: {sum(self.reported_weights.values()):.2f} g so far")
+      return True
+
   def ReportAndSaveTask(self):
       """Save the task to a task.txt file as a JSON object."""
       file_name = os.path.join(DATA_DIR, "task.txt")
@@ -70,28 +174,47 @@ class PrintTask:
                     logger.log_error("Error calculating multiplier")
                 logger.log_info(f"Using multiplier: {multiplier}")
             
-            for filament in self.teoric_filaments:
+            for i, filament in enumerate(self.teoric_filaments):
                 filament["weight"] = multiplier * filament["weight"]
-                saved_filament = spoolman_filament.RegisterFilament(filament["filamentId"], filament["weight"])
+                # Whatever was reported while printing is not sent twice
+                remainder = filament["weight"] - self.reported_weights.get(i, 0)
+                if remainder > 0:
+                    saved_filament = self.ChargeFilament(filament, remainder)
+                else:
+                    saved_filament = True
                 if saved_filament == True:
+                    self.reported_weights[i] = filament["weight"]
                     self.reported_filament.append(filament)
+                elif self.reported_weights.get(i, 0) > 0:
+                    # The remainder could not be charged, but the progress reports were
+                    self.reported_filament.append(dict(filament, weight=self.reported_weights[i]))
       
-      # Load existing tasks if the file exists
-      if os.path.exists(file_name):
-          with open(file_name, "r") as file:
-              try:
-                  tasks = json.load(file)
-              except json.JSONDecodeError:
-                  # If the file is corrupted or empty, start with an empty list
-                  tasks = []
-      else:
-          tasks = []
-      
-      # Append the current task
-      tasks.append(self.to_dict())
-      
-      # Save back to the file
-      with open(file_name, "w") as file:
-          json.dump(tasks, file, indent=4)
+      with journal_lock:
+          # Load existing tasks if the file exists
+          if os.path.exists(file_name):
+              with open(file_name, "r") as file:
+                  try:
+                      tasks = json.load(file)
+                  except json.JSONDecodeError:
+                      # If the file is corrupted or empty, start with an empty list
+                      tasks = []
+          else:
+              tasks = []
+
+          # Append the current task
+          tasks.append(self.to_dict())
+
+          # Save back to the file
+          with open(file_name, "w") as file:
+              json.dump(tasks, file, indent=4)
       
-      logger.log_info(f"Task saved successfully to {file_name}.")
\ No newline at end of file
+      logger.log_info(f"Task saved successfully to {file_name}.")
+
+      # Keep the consumption totals in step with the journal
+      try:
+          usage_stats.AddTask(tasks[-1])
+      except Exception as e:
+          logger.log_exception(e)
+
+      # Spool weights changed in Spoolman, refresh the local copy
+      sync_scheduler.RequestSync("spoolman")
\ No newline at end of file
@@ -0,0 +1,161 @@
+import ftplib
+import io
+import os
+import ssl
+
+FTPS_PORT = 990  # implicit TLS
+FTPS_USER = "bblp"
+READ_AHEAD = 64 * 1024
+
+class ImplicitFTPS(ftplib.FTP_TLS):
+  """FTP over implicit TLS as served by Bambu printers (self-signed certificate,
+  data connections must reuse the control connection's TLS session)."""
+
+  def __init__(self, timeout=15):
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    super().__init__(context=context, timeout=timeout)
+    self._sock = None
+
+  @property
+  def sock(self):
+    return self._sock
+
+  @sock.setter
+  def sock(self, value):
+    if value is not None and not isinstance(value, ssl.SSLSocket):
+      value = self.context.wrap_socket(value, server_hostname=self.host)
+    self._sock = value
+
+  def ntransfercmd(self, cmd, rest=None):
+    conn, size = ftplib.FTP.ntransfercmd(self, cmd, rest)
+    if self._prot_p:
+      conn = self.context.wrap_socket(conn, server_hostname=self.host, session=self.sock.session)
+    return conn, size
+
+def Connect(host, access_code, port=FTPS_PORT, timeout=15):
+  ftp = ImplicitFTPS(timeout=timeout)
+  ftp.connect(host, port)
+  ftp.login(FTPS_USER, access_code)
+  ftp.prot_p()
+  ftp.voidcmd("TYPE I")
+  return ftp
+
+class RemoteFile(io.RawIOBase):
+  """Seekable read-only view of a file on the printer. Each read fetches just the
+  requested range (REST + RETR), so zipfile only pulls the central directory and
+  the members it opens instead of the whole job file."""
+
+  def __init__(self, ftp, path, size=None):
+    self.ftp = ftp
+    self.path = path
+    self.size = ftp.size(path) if size is None else size
+    self.pos = 0
+    self.buffer = b""
+    self.buffer_start = 0
+    self.fetched = 0  # bytes pulled over the network
+
+  def readable(self):
+    return True
+
+  def seekable(self):
+    return True
+
+  def tell(self):
+    return self.pos
+
+  def seek(self, offset, whence=io.SEEK_SET):
+    if whence == io.SEEK_CUR:
+      offset += self.pos
+    elif whence == io.SEEK_END:
+      offset += self.size
+    self.pos = max(0, offset)
+    return self.pos
+
+  def _fetch(self, start, length):
+    chunks = []
+    remaining = length
+    conn = self.ftp.transfercmd(f"RETR {self.path}", rest=start)
+    try:
+      while remaining > 0:
+        chunk = conn.recv(min(remaining, 65536))
+        if not chunk:
+          break
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    finally:
+      conn.close()
+      # Stopping early makes the server answer 426 instead of 226
+      try:
+        self.ftp.voidresp()
+      except ftplib.all_errors:
+        pass
+    data = b"".join(chunks)
+    self.fetched += len(data)
+    return data
+
+  def read(self, size=-1):
+    if size is None or size < 0:
+      size = self.size - self.pos
+    size = min(size, self.size - self.pos)
+    if size <= 0:
+      return b""
+    offset = self.pos - self.buffer_start
+    if not (0 <= offset and offset + size <= len(self.buffer)):
+      self.buffer = self._fetch(self.pos, max(size, READ_AHEAD))
+      self.buffer_start = self.pos
+      offset = 0
+    data = self.buffer[offset:offset + size]
+    self.pos += len(data)
+    return data
+
+  def readinto(self, b):
+    data = self.read(len(b))
+    b[:len(data)] = data
+    return len(data)
+
+class PrinterFiles:
+  """Job files on the printer's FTPS share."""
+
+  def __init__(self, host, access_code, port=FTPS_PORT):
+    self.host = host
+    self.access_code = access_code
+    self.port = port
+    self.ftp = None
+
+  def __enter__(self):
+    self.ftp = Connect(self.host, self.access_code, self.port)
+    return self
+
+  def __exit__(self, *exc):
+    try:
+      self.ftp.quit()
+    except ftplib.all_errors:
+      self.ftp.close()
+
+  def Open(self, path):
+    """RemoteFile for path, or None when it does not exist."""
+    try:
+      size = self.ftp.size(path)
+    except ftplib.error_perm:
+      return None
+    return RemoteFile(self.ftp, path, size)
+
+class LocalFiles:
+  """Job files in a local directory (e.g. where the slicer exports), looked up by file name."""
+
+  def __init__(self, directory):
+    self.directory = directory
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    pass
+
+  def Open(self, path):
+    candidate = os.path.join(self.directory, os.path.basename(path))
+    if os.path.isfile(candidate):
+      return open(candidate, "rb")
+    return None
@@ -0,0 +1,50 @@
+import threading
+from BambuPrinter.bambu_printer import BambuPrinter
+
+class PrinterRegistry:
+  """One BambuPrinter (state machine + PrintTask) per device, keyed by dev_id."""
+
+  def __init__(self):
+    self.printers = {}
+    self.lock = threading.Lock()
+    self.create_listeners = []
+
+  def AddCreateListener(self, callback):
+    """callback(printer) runs for every printer created from now on, and for the existing ones."""
+    with self.lock:
+      self.create_listeners.append(callback)
+      existing = list(self.printers.values())
+    for printer in existing:
+      callback(printer)
+
+  def GetOrCreate(self, dev_id, name=None):
+    with self.lock:
+      printer = self.printers.get(dev_id)
+      if printer is not None:
+        if name:
+          printer.name = name
+        return printer
+      printer = BambuPrinter(dev_id, name)
+      self.printers[dev_id] = printer
+      listeners = list(self.create_listeners)
+    for callback in listeners:
+      callback(printer)
+    return printer
+
+  def Get(self, dev_id):
+    return self.printers.get(dev_id)
+
+  def Remove(self, dev_id):
+    with self.lock:
+      return self.printers.pop(dev_id, None)
+
+  def All(self):
+    with self.lock:
+      return list(self.printers.values())
+
+  def Default(self):
+    """The only printer, or the first one configured. None when there is none."""
+    with self.lock:
+      return next(iter(self.printers.values()), None)
+
+printer_registry = PrinterRegistry()
@@ -0,0 +1,86 @@
+import threading
+
+# Keys that change on every report and say nothing about the printer itself
+VOLATILE_KEYS = {"sequence_id", "msg", "command"}
+
+_MISSING = object()
+
+def _is_keyed_list(value):
+  return isinstance(value, list) and value and all(isinstance(v, dict) and "id" in v for v in value)
+
+def _merge_value(old, new):
+  """Return (merged, changed). Dicts merge recursively, lists of {"id": ...} merge by id."""
+  # Equality runs in C and settles the common case (nothing changed) at once
+  if old == new:
+    return old, False
+  if isinstance(old, dict) and isinstance(new, dict):
+    changed = False
+    for key, value in new.items():
+      current = old.get(key, _MISSING)
+      if current is _MISSING:
+        old[key] = value
+        changed = True
+        continue
+      merged, sub_changed = _merge_value(current, value)
+      if sub_changed:
+        old[key] = merged
+        changed = True
+    return old, changed
+  if _is_keyed_list(old) and _is_keyed_list(new):
+    by_id = {item["id"]: item for item in old}
+    changed = False
+    for item in new:
+      current = by_id.get(item["id"])
+      if current is None:
+        old.append(item)
+        by_id[item["id"]] = item
+        changed = True
+      elif len(item) == 1:
+        # A bare {"id": ...} entry means the slot was emptied (AMS trays)
+        if len(current) != 1:
+          current.clear()
+          current.update(item)
+          changed = True
+      elif _merge_value(current, item)[1]:
+        changed = True
+    return old, changed
+  return new, True
+
+class PrinterState:
+  """Single snapshot of the printer's `print` report, assembled from the deltas it sends."""
+
+  def __init__(self):
+    self.snapshot = {}
+    self.lock = threading.Lock()
+    self.updates = 0
+
+  def Merge(self, delta):
+    """Merge one `print` delta and return the set of top-level fields whose value changed."""
+    with self.lock:
+      snapshot = self.snapshot
+      # Comparison runs in C; most fields of a report are unchanged
+      candidates = [key for key, value in delta.items() if snapshot.get(key, _MISSING) != value]
+      changed = set()
+      for key in candidates:
+        value = delta[key]
+        current = snapshot.get(key, _MISSING)
+        if isinstance(current, (dict, list)):
+          value, field_changed = _merge_value(current, value)
+          if not field_changed:
+            continue
+        snapshot[key] = value
+        if key not in VOLATILE_KEYS:
+          changed.add(key)
+      self.updates += 1
+    return changed
+
+  def Get(self, key, default=None):
+    return self.snapshot.get(key, default)
+
+  def Subset(self, keys):
+    with self.lock:
+      return {key: self.snapshot[key] for key in keys if key in self.snapshot}
+
+  def Reset(self):
+    with self.lock:
+      self.snapshot = {}
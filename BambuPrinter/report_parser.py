@@ -0,0 +1,69 @@
+import json
+import os
+import re
+import threading
+
+# Faster JSON libraries are optional and parse the raw bytes payload directly
+def _load_backends():
+  backends = {}
+  try:
+    import orjson
+    backends["orjson"] = orjson.loads
+  except ImportError:
+    pass
+  try:
+    import ujson
+    backends["ujson"] = ujson.loads
+  except ImportError:
+    pass
+  # The standard library decodes bytes internally anyway, and guessing the
+  # encoding first is slower than a plain UTF-8 decode
+  backends["json"] = lambda payload: json.loads(payload.decode())
+  return backends
+
+BACKENDS = _load_backends()
+PREFERRED = ("orjson", "ujson", "json")
+
+def pick_backend(name=None):
+  name = name or os.environ.get("BAMBU_JSON_BACKEND")
+  if name:
+    if name not in BACKENDS:
+      raise ValueError(f"JSON backend '{name}' is not installed (available: {', '.join(BACKENDS)})")
+    return name
+  return next(n for n in PREFERRED if n in BACKENDS)
+
+class ReportParser:
+  """Turns a report payload into the `print` fields we care about, or None.
+
+  Reports that mention none of the watched keys are dropped with a single
+  regex scan of the bytes, before any JSON parsing happens.
+  """
+
+  def __init__(self, keys=(), backend=None):
+    self.backend = pick_backend(backend)
+    self.loads = BACKENDS[self.backend]
+    self.keys = frozenset()
+    self.lock = threading.Lock()
+    self.AddKeys(keys)
+
+  def AddKeys(self, keys):
+    with self.lock:
+      self.keys = self.keys | frozenset(keys)
+      pattern = b"|".join(re.escape(k.encode()) for k in sorted(self.keys))
+      self.prefilter = re.compile(b'"(?:' + pattern + b')"')
+
+  def Parse(self, payload):
+    """Return (fields, command) for a relevant `print` report, or (None, reason) otherwise."""
+    if isinstance(payload, str):
+      payload = payload.encode()
+    if not self.prefilter.search(payload):
+      return None, "filtered"
+    data = self.loads(payload)
+    report = data.get("print") if isinstance(data, dict) else None
+    if not isinstance(report, dict):
+      if isinstance(data, dict):
+        return None, next(iter(data), "empty")
+      return None, "invalid"
+    # Reports carry ~70 fields; walk the short watched list instead
+    fields = {key: report[key] for key in self.keys if key in report}
+    return fields, str(report.get("command", "print"))
@@ -0,0 +1,158 @@
+"""Read job usage from a printer's FTPS share: the local FTPS stand-in serves a
+generated 3MF and G-code, and printer_ftps/local_usage read them as they would
+from a printer. Reports time and bytes transferred per file, and checks the
+grams against what was written (exit status 1 on a mismatch).
+
+"KB read" is what the reader fetched over the data connections; the stand-in's
+own count is higher because it fills the socket buffers before a read is cut off.
+
+Run from the repository root:
+    python -m Benchmarks.bench_local_usage
+    python -m Benchmarks.bench_local_usage --size-mb 50 --repeat 5
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+import zipfile
+
+# Certificates, job files and the usage cache go to a scratch directory
+os.environ.setdefault("BAMBU_DATA_DIR", tempfile.mkdtemp(prefix="bambu-ftps-"))
+
+from Benchmarks.standins import FTPSStandIn, make_certificate
+
+ACCESS_CODE = "stand-in"
+SUBTASK = "bench_part"
+# (slot, filament id, type, colour, grams)
+FILAMENTS = [(1, "GFA00", "PLA", "#FF0000", 41.25), (3, "GFG02", "PETG", "#00AE42", 7.5)]
+
+def padding_lines(size, seed=0):
+    """Roughly `size` bytes of plausible G-code moves."""
+    rng = random.Random(seed)
+    lines, total = [], 0
+    while total < size:
+        line = f"G1 X{rng.uniform(0, 256):.3f} Y{rng.uniform(0, 256):.3f} E{rng.uniform(0, 2):.5f}\n"
+        lines.append(line)
+        total += len(line)
+    return "".join(lines)
+
+def slice_info():
+    filaments = "".join(
+        f'    <filament id="{slot}" tray_info_idx="{fid}" type="{ftype}" color="{color}" used_m="1.0" used_g="{grams}" />\n'
+        for slot, fid, ftype, color, grams in FILAMENTS)
+    total = sum(f[4] for f in FILAMENTS)
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n<config>\n  <plate>\n'
+            '    <metadata key="index" value="1"/>\n'
+            f'    <metadata key="weight" value="{total:.2f}"/>\n'
+            f'{filaments}  </plate>\n</config>\n')
+
+def write_3mf(path, size):
+    # Stored, not deflated: the plate G-code makes up the file size as on a printer
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_STORED) as archive:
+        archive.writestr("3D/3dmodel.model", "<model/>")
+        archive.writestr("Metadata/plate_1.gcode", padding_lines(size))
+        archive.writestr("Metadata/slice_info.config", slice_info())
+
+def write_gcode(path, size):
+    grams = [f[4] for f in FILAMENTS]
+    with open(path, "w") as f:
+        f.write("; HEADER_BLOCK_START\n")
+        f.write(f"; total filament weight [g] : {sum(grams):.2f}\n")
+        f.write("; HEADER_BLOCK_END\n")
+        f.write(padding_lines(size, seed=1))
+        f.write("; CONFIG_BLOCK_START\n")
+        f.write(f"; filament used [g] = {', '.join(str(g) for g in grams)}\n")
+        f.write(f"; filament_ids = {';'.join(f[1] for f in FILAMENTS)}\n")
+        f.write(f"; filament_type = {';'.join(f[2] for f in FILAMENTS)}\n")
+        f.write(f"; filament_colour = {';'.join(f[3] for f in FILAMENTS)}\n")
+        f.write("; CONFIG_BLOCK_END\n")
+
+def check(usage):
+    """Differences between the usage read and FILAMENTS, empty when they match."""
+    if usage is None:
+        return ["no usage found"]
+    got = sorted((f["filamentId"], round(f["weight"], 2)) for f in usage["filaments"])
+    expected = sorted((fid, round(grams, 2)) for _, fid, _, _, grams in FILAMENTS)
+    return [] if got == expected else [f"expected {expected}, got {got}"]
+
+def timed_read(ftps, gcode_file, subtask_name, cached):
+    from BambuPrinter import local_usage
+    from BambuPrinter.printer_ftps import PrinterFiles
+
+    class CountingFiles(PrinterFiles):
+        def __enter__(self):
+            self.opened = []
+            return super().__enter__()
+
+        def Open(self, path):
+            job = super().Open(path)
+            if job is not None:
+                self.opened.append(job)
+            return job
+
+    if not cached:
+        local_usage.usage_cache.entries = {}
+    start = time.perf_counter()
+    with CountingFiles(ftps.host, ACCESS_CODE, ftps.port) as files:
+        usage = local_usage.ExtractUsage(files, gcode_file, subtask_name)
+    return time.perf_counter() - start, sum(job.fetched for job in files.opened), usage
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=float, default=5, help="size of each generated job file")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    data_dir = os.environ["BAMBU_DATA_DIR"]
+    share = os.path.join(data_dir, "share")
+    os.makedirs(os.path.join(share, "cache"), exist_ok=True)
+    size = int(args.size_mb * 1024 * 1024)
+    write_3mf(os.path.join(share, "cache", f"{SUBTASK}.gcode.3mf"), size)
+    write_gcode(os.path.join(share, f"{SUBTASK}_lan.gcode"), size)
+
+    cert, key = make_certificate(data_dir)
+    ftps = FTPSStandIn(share, cert, key, ACCESS_CODE).start()
+    # (label, gcode_file as the printer reports it, subtask_name)
+    jobs = [("3mf (cloud plate)", "/data/Metadata/plate_1.gcode", SUBTASK),
+            ("gcode (LAN upload)", f"/{SUBTASK}_lan.gcode", None)]
+
+    failures = []
+    print(f"job files of {args.size_mb:.1f} MB served over FTPS on port {ftps.port}")
+    print(f"{'job':<22}{'cold ms':>10}{'cached ms':>11}{'KB read':>10}{'of file':>9}")
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = []
+        for label, gcode_file, subtask_name in jobs:
+            cold, fetched, usage = zip(*(timed_read(ftps, gcode_file, subtask_name, False) for _ in range(args.repeat)))
+            cached, _, cached_usage = zip(*(timed_read(ftps, gcode_file, subtask_name, True) for _ in range(args.repeat)))
+            results.append((label, min(cold), min(cached), max(fetched)))
+            failures += [f"{label}: {p}" for u in usage + cached_usage for p in check(u)]
+    for label, cold, cached, fetched in results:
+        print(f"{label:<22}{cold * 1000:>10.1f}{cached * 1000:>11.1f}{fetched / 1024:>10.0f}{fetched / size:>9.1%}")
+
+    # The path a print takes: printer settings -> PrinterFiles -> task detail
+    from BambuPrinter.ams_state import AMSState
+    from BambuPrinter.local_usage import LocalTaskDetail
+    from tools import SavePrinterSetting
+    SavePrinterSetting("FTPSBENCH", "printer_ip", ftps.host)
+    SavePrinterSetting("FTPSBENCH", "dev_acces_code", ACCESS_CODE)
+    SavePrinterSetting("FTPSBENCH", "ftps_port", ftps.port)
+    with contextlib.redirect_stdout(io.StringIO()):
+        detail = LocalTaskDetail("FTPSBENCH", "/data/Metadata/plate_1.gcode", SUBTASK, AMSState())
+    if detail is None:
+        failures.append("LocalTaskDetail: no task detail")
+    else:
+        failures += [f"LocalTaskDetail: {p}" for p in check({"filaments": detail["amsDetailMapping"]})]
+        print(f"LocalTaskDetail: {detail['weight']:.2f} g in {len(detail['amsDetailMapping'])} filaments")
+    ftps.stop()
+
+    print(f"{ftps.retrievals} retrievals from the stand-in")
+    for failure in failures:
+        print(f"MISMATCH {failure}")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,98 @@
+"""Compare MQTT report handling: full walk of every report vs. the delta-merged state model.
+
+Run from the repository root:
+    python -m Benchmarks.bench_mqtt_state [--payloads reports.jsonl] [--full-every N]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+# Keep logs and task files away from the real data directory
+os.environ.setdefault("BAMBU_DATA_DIR", tempfile.mkdtemp(prefix="bambu-bench-"))
+
+import BambuCloud.projects
+from BambuPrinter.bambu_printer import BambuPrinter
+from Benchmarks.report_payloads import Message, encode, load_payloads, print_session
+
+class LegacyBambuPrinter(BambuPrinter):
+    """Previous behaviour: parse everything, call every handler for every key present."""
+
+    def _ProccessMQTTMsg(self, msg):
+        parsed_data = json.loads(msg.payload.decode())
+        if "print" in parsed_data:
+            parsed_data = parsed_data["print"]
+            if "mc_percent" in parsed_data:
+                self.SetPrintPercentatge(parsed_data["mc_percent"])
+            if "stg_cur" in parsed_data:
+                self.SetCurrentState(parsed_data["stg_cur"])
+            if "gcode_state" in parsed_data:
+                self.SetGcodeState(parsed_data["gcode_state"])
+            if "task_id" in parsed_data:
+                self.SetWeightDetail(parsed_data["task_id"])
+            if "ams" in parsed_data:
+                self.AMSFilamentParser(parsed_data["ams"])
+            if "vt_tray" in parsed_data:
+                self.ExternalFilamentParser(parsed_data["vt_tray"])
+        return "print"
+
+cloud_calls = 0
+
+def fake_job_id(task_id):
+    global cloud_calls
+    cloud_calls += 1
+    return 1
+
+def fake_task_detail(job_id):
+    global cloud_calls
+    cloud_calls += 1
+    return {"weight": 10.0, "title": "bench", "cover": "",
+            "amsDetailMapping": [{"ams": 0, "filamentId": "GFA00", "weight": 10.0}]}
+
+def run(printer_cls, payloads, repeat):
+    global cloud_calls
+    best_wall = best_cpu = float("inf")
+    calls = 0
+    for _ in range(repeat):
+        printer = printer_cls()
+        # Nothing is reported in the benchmark
+        printer.print_task.ReportAndSaveTask = lambda: None
+        messages = [Message(p) for p in payloads]
+        cloud_calls = 0
+        with contextlib.redirect_stdout(io.StringIO()):
+            wall, cpu = time.perf_counter(), time.process_time()
+            for message in messages:
+                printer.ProccessMQTTMsg(message)
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        best_wall, best_cpu = min(best_wall, wall), min(best_cpu, cpu)
+        calls = cloud_calls
+    return best_wall, best_cpu, calls
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--payloads", help="JSON-lines file with recorded report payloads")
+    parser.add_argument("--full-every", type=int, default=10,
+                        help="every Nth synthetic report is a full pushall (0 = deltas only)")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    BambuCloud.projects.GetJobID = fake_job_id
+    BambuCloud.projects.GetTaksDetail = fake_task_detail
+
+    if args.payloads:
+        payloads = load_payloads(args.payloads)
+    else:
+        payloads = encode(print_session(full_every=args.full_every))
+    size = sum(len(p) for p in payloads)
+    print(f"{len(payloads)} reports, {size / 1024:.1f} KiB")
+    print(f"{'implementation':<16}{'wall ms':>10}{'cpu ms':>10}{'us/msg':>10}{'cloud calls':>13}")
+    for name, cls in (("legacy", LegacyBambuPrinter), ("state model", BambuPrinter)):
+        wall, cpu, calls = run(cls, payloads, args.repeat)
+        print(f"{name:<16}{wall * 1000:>10.2f}{cpu * 1000:>10.2f}{cpu * 1e6 / len(payloads):>10.2f}{calls:>13}")
+
+if __name__ == "__main__":
+    sys.exit(main())
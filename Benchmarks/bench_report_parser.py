@@ -0,0 +1,61 @@
+"""Micro-benchmark for report parsing: decode + json.loads vs. ReportParser backends.
+
+Run from the repository root:
+    python -m Benchmarks.bench_report_parser [--payloads reports.jsonl] [--full-every N]
+"""
+import argparse
+import json
+import sys
+import time
+
+from BambuPrinter.report_parser import BACKENDS, ReportParser
+from Benchmarks.report_payloads import encode, load_payloads, print_session
+
+WATCHED = ("mc_percent", "stg_cur", "gcode_state", "task_id", "ams", "vt_tray")
+
+def legacy_parse(payload):
+    data = json.loads(payload.decode())
+    return data.get("print")
+
+def measure(func, payloads, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.process_time()
+        for payload in payloads:
+            func(payload)
+        best = min(best, time.process_time() - start)
+    return best
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--payloads", help="JSON-lines file with recorded report payloads")
+    parser.add_argument("--full-every", type=int, default=10,
+                        help="every Nth synthetic report is a full pushall (0 = deltas only)")
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args(argv)
+
+    if args.payloads:
+        payloads = load_payloads(args.payloads)
+    else:
+        payloads = encode(print_session(full_every=args.full_every))
+        # Periodic reports that carry only temperatures and fan speeds
+        payloads += encode([{"print": {"nozzle_temper": 220.1, "bed_temper": 60.0, "wifi_signal": "-44dBm",
+                                       "command": "push_status", "sequence_id": str(i)}} for i in range(len(payloads))])
+
+    probe = ReportParser(WATCHED, "json")
+    skipped = sum(1 for p in payloads if probe.Parse(p)[0] is None)
+    print(f"{len(payloads)} reports, {skipped} skipped by the prefilter")
+    baseline = measure(legacy_parse, payloads, args.repeat)
+    print(f"{'path':<28}{'cpu ms':>10}{'us/msg':>10}{'speedup':>10}")
+    print(f"{'decode + json.loads':<28}{baseline * 1000:>10.2f}{baseline * 1e6 / len(payloads):>10.2f}{1:>10.2f}")
+    for backend in BACKENDS:
+        for prefilter in (False, True):
+            report_parser = ReportParser(WATCHED, backend)
+            if not prefilter:
+                report_parser.prefilter = type("AlwaysMatch", (), {"search": staticmethod(lambda payload: True)})
+            cpu = measure(report_parser.Parse, payloads, args.repeat)
+            name = f"{backend}{' + prefilter' if prefilter else ''}"
+            print(f"{name:<28}{cpu * 1000:>10.2f}{cpu * 1e6 / len(payloads):>10.2f}{baseline / cpu:>10.2f}")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+"""Spoolman change feed against the local Spoolman stand-in.
+
+Subscribes spoolman_feed to the stand-in's websocket, then adds, edits,
+archives and deletes spools, renames a filament and cuts the connection,
+checking each change reaches spool_inventory (and spoolman_filaments.txt).
+Reports how long events take to land; exit status 1 if a check fails.
+
+Run from the repository root:
+    python -m Benchmarks.bench_spoolman_feed
+    python -m Benchmarks.bench_spoolman_feed --spools 5000 --events 500
+"""
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+# Credentials and spoolman_filaments.txt go to a scratch directory
+os.environ.setdefault("BAMBU_DATA_DIR", tempfile.mkdtemp(prefix="bambu-feed-"))
+
+from Benchmarks.standins import start_standins
+
+def wait_until(predicate, timeout):
+    """Seconds until predicate() held, or None on timeout."""
+    start = time.perf_counter()
+    while not predicate():
+        if time.perf_counter() - start > timeout:
+            return None
+        time.sleep(0.001)
+    return time.perf_counter() - start
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--spools", type=int, default=200)
+    parser.add_argument("--filaments", type=int, default=20)
+    parser.add_argument("--events", type=int, default=100, help="spool updates timed one by one")
+    parser.add_argument("--timeout", type=float, default=15.0, help="seconds a change may take to arrive")
+    args = parser.parse_args(argv)
+
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        _, spoolman = start_standins(spool_count=args.spools, filament_count=args.filaments)
+        from Spoolman.spoolman_feed import spoolman_feed
+        from Spoolman.spoolman_filament import SPOOLMAN_FILE, spool_inventory
+        notified = []
+        spool_inventory.AddChangeListener(lambda updated, removed: notified.append((updated, removed)))
+        spoolman_feed.Start()
+        # Live first, then the catch-up sync fills the index
+        connected = wait_until(lambda: spoolman_feed.IsLive() and spool_inventory.last_sync is not None,
+                               args.timeout)
+
+    failures = []
+    results = []
+
+    def remaining(spool_id):
+        spool = spool_inventory.Get(spool_id)
+        return None if spool is None else spool.remaining_weight
+
+    def check(name, change, predicate, timeout=args.timeout):
+        with contextlib.redirect_stdout(output):
+            change()
+            seconds = wait_until(predicate, timeout)
+        if seconds is None:
+            failures.append(name)
+        results.append((name, seconds))
+
+    if connected is None:
+        print(f"feed did not connect: {spoolman_feed.Status()}")
+        return 1
+    print(f"subscribed in {connected * 1000:.1f} ms, {spool_inventory.Status()['spools']} spools indexed")
+
+    added = {}
+    check("add spool", lambda: added.setdefault("id", spoolman.add_spool("Feed Check Silk", "PLA", "Checkers")),
+          lambda: spool_inventory.Get(added.get("id")) is not None)
+    check("use spool", lambda: spoolman.update_spool(1, remaining_weight=12.5, used_weight=987.5),
+          lambda: remaining(1) == 12.5)
+    filament_id = spoolman.spools[5]["filament"]["id"]
+    check("rename filament", lambda: spoolman.update_filament(filament_id, name="Renamed by check"),
+          lambda: all(s.filament_name == "Renamed by check"
+                      for s in spool_inventory.All() if s.filament_id == filament_id))
+    check("archive spool", lambda: spoolman.update_spool(2, archived=True),
+          lambda: spool_inventory.Get(2) is None)
+    check("delete spool", lambda: spoolman.delete_spool(3),
+          lambda: spool_inventory.Get(3) is None)
+
+    def quiet_edit():
+        # Changed while nobody listens: only the catch-up sync after reconnecting sees it
+        spoolman.drop_subscribers()
+        wait_until(lambda: not spoolman_feed.IsLive(), args.timeout)
+        with spoolman.lock:
+            spoolman.spools[4]["remaining_weight"] = 1.5
+
+    check("reconnect and catch up", quiet_edit,
+          lambda: spoolman_feed.IsLive() and remaining(4) == 1.5)
+
+    def saved():
+        try:
+            with open(SPOOLMAN_FILE, encoding="utf-8") as f:
+                text = f.read()
+        except FileNotFoundError:
+            return False
+        return "Renamed by check" in text and "Feed Check Silk" in text
+    check("spoolman_filaments.txt rewritten", lambda: None, saved)
+
+    # Event latency, one update at a time
+    latencies = []
+    spool_ids = sorted(spool_id for spool_id, spool in spoolman.spools.items() if not spool["archived"])
+    with contextlib.redirect_stdout(output):
+        for i in range(args.events):
+            spool_id = spool_ids[i % len(spool_ids)]
+            weight = 500.0 + i
+            spoolman.update_spool(spool_id, remaining_weight=weight)
+            seconds = wait_until(lambda: remaining(spool_id) == weight, args.timeout)
+            if seconds is None:
+                failures.append(f"update {i} of spool {spool_id}")
+                break
+            latencies.append(seconds)
+        spoolman_feed.Stop()
+
+    for name, seconds in results:
+        print(f"{name:<34}{'FAILED' if seconds is None else f'{seconds * 1000:9.2f} ms'}")
+    if latencies:
+        latencies.sort()
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        print(f"{'event -> index':<34}median {statistics.median(latencies) * 1000:.2f} ms   "
+              f"p95 {p95 * 1000:.2f} ms   (n={len(latencies)})")
+    print(f"listener calls: {len(notified)}, feed: {spoolman_feed.Status()}")
+    print(f"spoolman requests: {dict(spoolman.server.requests)}")
+    for failure in failures:
+        print(f"FAILED {failure}")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+"""End-to-end benchmark against the local Bambu Cloud and Spoolman stand-ins.
+
+Measures login, filament sync (cold, unchanged and incremental), matching in
+get_filaments, and per print the cloud task lookup and the time from the
+FINISH report until Spoolman has the usage. Nothing leaves the machine.
+
+Run from the repository root:
+    python -m Benchmarks.e2e_benchmark
+    python -m Benchmarks.e2e_benchmark --spools 10000 --filaments 2000 --tasks 50000 --latency 0.005
+    python -m Benchmarks.e2e_benchmark --error-rate 0.05 --prints 20
+"""
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+# Logs, tasks and credentials go to a scratch directory
+os.environ.setdefault("BAMBU_DATA_DIR", tempfile.mkdtemp(prefix="bambu-e2e-"))
+
+from Benchmarks.report_payloads import Message, encode, print_session
+from Benchmarks.standins import start_standins
+
+PRINT_FILAMENTS = ("GFA00", "GFA01")
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+def summary(samples):
+    if not samples:
+        return "no samples"
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    return (f"median {statistics.median(samples) * 1000:9.1f} ms   p95 {p95 * 1000:9.1f} ms   "
+            f"max {samples[-1] * 1000:9.1f} ms   (n={len(samples)})")
+
+def bench_login():
+    from tools import SaveNewToken
+    from BambuCloud.login import LoginAndGetToken, TestToken
+    SaveNewToken("email", "bench@example.com")
+    SaveNewToken("password", "stand-in")
+    login, result = timed(LoginAndGetToken)
+    test, ok = timed(TestToken)
+    return login, result, test, ok
+
+def bench_sync(spoolman, repeat, changed_fraction):
+    from Scheduler.sync_scheduler import SyncBambuFilaments
+    from Spoolman.spoolman_filament import spool_inventory
+    results = {"bambu": [], "spoolman unchanged": [], "spoolman incremental": []}
+    failures = 0
+    requests_before = spoolman.server.requests["list_spools"]
+    cold, ok = timed(spool_inventory.Sync)
+    failures += not ok
+    results["spoolman cold"] = [cold]
+    cold_pages = spoolman.server.requests["list_spools"] - requests_before
+    spool_ids = sorted(spoolman.spools)
+    step = max(1, int(1 / changed_fraction)) if changed_fraction > 0 else None
+    for round_ in range(repeat):
+        results["bambu"].append(timed(SyncBambuFilaments)[0])
+        seconds, ok = timed(spool_inventory.Sync)
+        failures += not ok
+        results["spoolman unchanged"].append(seconds)
+        if step:
+            for spool_id in spool_ids[round_ % step::step]:
+                spool = spoolman.spools[spool_id]
+                spoolman.update_spool(spool_id, remaining_weight=spool["remaining_weight"] - 1,
+                                      used_weight=spool["used_weight"] + 1)
+            seconds, ok = timed(spool_inventory.Sync)
+            failures += not ok
+            results["spoolman incremental"].append(seconds)
+    return results, cold_pages, failures
+
+def bench_matching(repeat):
+    from Gui.WebServer import websockets_service
+    from Metrics.metrics import matching_seconds
+    totals, matching = [], []
+    for _ in range(repeat):
+        series = matching_seconds.series.get(())
+        before = series[1] if series else 0.0
+        seconds, data = timed(websockets_service.get_filaments_data)
+        totals.append(seconds)
+        matching.append(matching_seconds.series[()][1] - before)
+    payload = data["payload"]
+    return totals, matching, len(payload["bambuFilaments"]), len(payload["spoolmanFilaments"])
+
+def bench_prints(spoolman, count, full_every):
+    from BambuPrinter.bambu_printer import BambuPrinter
+    from Spoolman.usage_outbox import usage_outbox
+    lookups, reports = [], []
+    charged = 0
+    for i in range(count):
+        task_id = str(900000000 + i)
+        printer = BambuPrinter(f"E2E{i:04d}", f"bench {i}")
+        messages = [Message(payload, printer.dev_id)
+                    for payload in encode(print_session(full_every=full_every, task_id=task_id))]
+        uses_before = len(spoolman.uses)
+        for message in messages[:-1]:
+            start = time.perf_counter()
+            printer.ProccessMQTTMsg(message)
+            if b'"task_id"' in message.payload and b'"PREPARE"' in message.payload:
+                # The cloud lookups (GetJobID + GetTaksDetail) run on this report
+                lookups.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        printer.ProccessMQTTMsg(messages[-1])
+        if usage_outbox.Flush(timeout=120) and len(spoolman.uses) > uses_before:
+            reports.append(time.perf_counter() - start)
+            charged += 1
+    return lookups, reports, charged
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--spools", type=int, default=2000, help="spools in the Spoolman stand-in")
+    parser.add_argument("--filaments", type=int, default=400, help="distinct Spoolman filaments")
+    parser.add_argument("--slicer-filaments", type=int, default=200, help="custom filaments in the cloud stand-in")
+    parser.add_argument("--tasks", type=int, default=5000, help="past tasks in the cloud stand-in")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every stand-in request (+-50%%)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument("--changed", type=float, default=0.01, help="fraction of spools changed before incremental syncs")
+    parser.add_argument("--prints", type=int, default=5, help="print sessions to replay")
+    parser.add_argument("--full-every", type=int, default=0, help="every Nth report of a print is a pushall")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="show the service log")
+    args = parser.parse_args(argv)
+
+    setup, (cloud, spoolman) = timed(lambda: start_standins(
+        PRINT_FILAMENTS, 10.0, args.spools, args.filaments, args.tasks, args.slicer_filaments,
+        args.latency, args.error_rate, args.seed))
+    print(f"stand-ins: {args.spools} spools / {args.filaments} filaments, {args.tasks} cloud tasks, "
+          f"{args.slicer_filaments} slicer filaments, latency {args.latency * 1000:.1f} ms, "
+          f"error rate {args.error_rate:.1%} (ready in {setup:.1f}s)")
+
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    with output:
+        login = bench_login()
+        sync, cold_pages, sync_failures = bench_sync(spoolman, args.repeat, args.changed)
+        totals, matching, bambu_count, spoolman_count = bench_matching(args.repeat)
+        lookups, reports, charged = bench_prints(spoolman, args.prints, args.full_every)
+
+    print()
+    print(f"login            {login[0] * 1000:9.1f} ms ({login[1]}), token test {login[2] * 1000:.1f} ms ({login[3]})")
+    for name in ("bambu", "spoolman cold", "spoolman unchanged", "spoolman incremental"):
+        print(f"sync {name:<21}{summary(sync[name])}")
+    print(f"  cold Spoolman sync fetched {cold_pages} page(s); {sync_failures} sync(s) failed")
+    print(f"get_filaments    {summary(totals)}")
+    print(f"  matching       {summary(matching)}   ({bambu_count} slicer x {spoolman_count} Spoolman)")
+    print(f"task lookup      {summary(lookups)}")
+    print(f"FINISH->Spoolman {summary(reports)}   ({charged}/{args.prints} prints charged)")
+    print()
+    print(f"cloud requests: {dict(cloud.server.requests)}")
+    print(f"spoolman requests: {dict(spoolman.server.requests)}")
+
+if __name__ == "__main__":
+    sys.exit(main())
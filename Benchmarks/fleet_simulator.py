@@ -0,0 +1,351 @@
+"""Load test: N virtual printers behind a local TLS MQTT broker stand-in.
+
+The service side (Local_MQTT.StartMQTT, the ingest workers and the printer state
+machines) runs in this process exactly as in production; the broker and the
+virtual printers run in separate processes so their CPU is not counted.
+Bambu Cloud and Spoolman are local stand-ins.
+
+Run from the repository root:
+    python -m Benchmarks.fleet_simulator --printers 50 --duration 120
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import queue
+import random
+import resource
+import ssl
+import struct
+import sys
+import tempfile
+import time
+
+# Logs, tasks and credentials go to a scratch directory
+os.environ.setdefault("BAMBU_DATA_DIR", tempfile.mkdtemp(prefix="bambu-fleet-"))
+
+from Benchmarks.report_payloads import pushall
+
+# ---------- MQTT 3.1.1, just the packets Bambu printers exchange ----------
+
+CONNECT, CONNACK, PUBLISH, SUBSCRIBE, SUBACK, PINGREQ, PINGRESP, DISCONNECT = 1, 2, 3, 8, 9, 12, 13, 14
+
+def encode_length(n):
+    out = bytearray()
+    while True:
+        byte, n = n % 128, n // 128
+        out.append(byte | 0x80 if n else byte)
+        if not n:
+            return bytes(out)
+
+def publish_packet(topic, payload):
+    topic = topic.encode()
+    body = struct.pack(">H", len(topic)) + topic + payload
+    return bytes([PUBLISH << 4]) + encode_length(len(body)) + body
+
+async def read_packet(reader):
+    header = (await reader.readexactly(1))[0]
+    length, multiplier = 0, 1
+    while True:
+        byte = (await reader.readexactly(1))[0]
+        length += (byte & 0x7F) * multiplier
+        multiplier *= 128
+        if not byte & 0x80:
+            break
+    return header, await reader.readexactly(length)
+
+# ---------- Virtual printers ----------
+
+class VirtualPrinter:
+    """Idle → prepare → print → finish or fail, with AMS changes on the way."""
+
+    def __init__(self, dev_id, broker, args, rng):
+        self.dev_id = dev_id
+        self.broker = broker
+        self.args = args
+        self.rng = rng
+        self.topic = f"device/{dev_id}/report"
+        self.sequence = 0
+        self.state = "IDLE"
+        self.stg_cur = 255
+        self.percent = 0.0
+        self.task_id = "0"
+        self.fail_at = None
+        self.ticks_left = rng.randint(1, max(1, int(args.idle_seconds * args.rate)))
+        self.remain = [90, 80, 70, 60]
+        self.tray_now = 0
+
+    def full_report(self):
+        report = pushall(self.sequence, self.state, self.stg_cur, int(self.percent), self.task_id)
+        trays = report["print"]["ams"]["ams"][0]["tray"]
+        for i, remain in enumerate(self.remain):
+            trays[i]["remain"] = remain
+        report["print"]["ams"]["tray_now"] = str(self.tray_now)
+        return report
+
+    def send(self, report):
+        self.sequence += 1
+        report["print"]["sequence_id"] = str(self.sequence)
+        self.broker.publish(self.dev_id, publish_packet(self.topic, json.dumps(report, separators=(",", ":")).encode()))
+
+    def tick(self):
+        rng = self.rng
+        self.ticks_left -= 1
+        if self.state in ("IDLE", "FINISH", "FAILED"):
+            if self.ticks_left <= 0:
+                self.task_id = str(rng.randint(10**8, 10**9))
+                self.state, self.stg_cur, self.percent = "PREPARE", 2, 0.0
+                self.ticks_left = max(1, int(self.args.prepare_seconds * self.args.rate))
+                self.fail_at = rng.uniform(5, 95) if rng.random() < self.args.fail_rate else None
+                self.send({"print": {"gcode_state": "PREPARE", "stg_cur": 2, "task_id": self.task_id,
+                                     "subtask_name": f"part-{self.task_id}", "mc_percent": 0, "command": "push_status"}})
+            elif rng.random() < 0.2:
+                self.send({"print": {"wifi_signal": f"-{rng.randint(40, 50)}dBm", "command": "push_status"}})
+        elif self.state == "PREPARE":
+            if self.ticks_left <= 0:
+                self.state, self.stg_cur = "RUNNING", 0
+                self.send({"print": {"gcode_state": "RUNNING", "stg_cur": 0, "command": "push_status"}})
+        elif self.state == "RUNNING":
+            self.percent = min(100.0, self.percent + 100.0 / (self.args.print_seconds * self.args.rate))
+            delta = {
+                "mc_percent": int(self.percent),
+                "mc_remaining_time": int((100 - self.percent) * self.args.print_seconds / 6000),
+                "layer_num": int(self.percent * 2),
+                "nozzle_temper": round(220 + rng.uniform(-1, 1), 1),
+                "bed_temper": round(60 + rng.uniform(-0.5, 0.5), 1),
+                "command": "push_status",
+            }
+            if rng.random() < self.args.ams_rate:
+                # Filament change or remaining estimate update on one tray
+                self.tray_now = rng.randrange(4)
+                self.remain[self.tray_now] = max(0, self.remain[self.tray_now] - 1)
+                delta["ams"] = {"ams": [{"id": "0", "tray": [{"id": str(self.tray_now), "remain": self.remain[self.tray_now]}]}],
+                                "tray_now": str(self.tray_now)}
+            if self.fail_at is not None and self.percent >= self.fail_at:
+                self.state, self.stg_cur = "FAILED", 255
+                self.send({"print": {"gcode_state": "FAILED", "mc_percent": int(self.percent), "command": "push_status"}})
+                self.broker.events.put(("end", self.dev_id, self.task_id, "FAILED", time.time()))
+                self.send({"print": {"stg_cur": 255, "command": "push_status"}})
+                self.ticks_left = rng.randint(1, max(1, int(self.args.idle_seconds * self.args.rate)))
+            elif self.percent >= 100:
+                self.state, self.stg_cur = "FINISH", 255
+                self.send({"print": {"gcode_state": "FINISH", "stg_cur": 255, "mc_percent": 100, "command": "push_status"}})
+                self.broker.events.put(("end", self.dev_id, self.task_id, "FINISH", time.time()))
+                self.ticks_left = rng.randint(1, max(1, int(self.args.idle_seconds * self.args.rate)))
+            else:
+                self.send({"print": delta})
+
+class Broker:
+    """Routes device/<id>/report to whoever subscribed and answers pushall requests."""
+
+    def __init__(self, events):
+        self.events = events
+        self.subscribers = {}  # dev_id -> set of writers
+        self.printers = {}
+        self.published = 0
+
+    def publish(self, dev_id, packet):
+        for writer in self.subscribers.get(dev_id, ()):
+            writer.write(packet)
+            self.published += 1
+
+    async def handle(self, reader, writer):
+        subscribed = []
+        try:
+            while True:
+                header, body = await read_packet(reader)
+                kind = header >> 4
+                if kind == CONNECT:
+                    writer.write(b"\x20\x02\x00\x00")
+                elif kind == SUBSCRIBE:
+                    packet_id, pos, granted = body[:2], 2, b""
+                    while pos < len(body):
+                        (size,) = struct.unpack(">H", body[pos:pos + 2])
+                        topic = body[pos + 2:pos + 2 + size].decode()
+                        pos += 3 + size
+                        dev_id = topic.split("/")[1]
+                        self.subscribers.setdefault(dev_id, set()).add(writer)
+                        subscribed.append(dev_id)
+                        granted += b"\x00"
+                    writer.write(bytes([SUBACK << 4]) + encode_length(2 + len(granted)) + packet_id + granted)
+                elif kind == PUBLISH:
+                    (size,) = struct.unpack(">H", body[:2])
+                    topic = body[2:2 + size].decode()
+                    offset = 2 + size + (2 if header & 0x06 else 0)
+                    printer = self.printers.get(topic.split("/")[1])
+                    if printer and b"pushall" in body[offset:]:
+                        printer.send(printer.full_report())
+                elif kind == PINGREQ:
+                    writer.write(bytes([PINGRESP << 4, 0]))
+                elif kind == DISCONNECT:
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ssl.SSLError):
+            pass
+        finally:
+            for dev_id in subscribed:
+                self.subscribers.get(dev_id, set()).discard(writer)
+            writer.close()
+
+    async def tick_printers(self, rate):
+        interval = 1.0 / rate
+        next_tick = time.monotonic()
+        printers = list(self.printers.values())
+        while True:
+            for printer in printers:
+                printer.tick()
+            next_tick += interval
+            await asyncio.sleep(max(0, next_tick - time.monotonic()))
+
+async def serve_fleet(dev_ids, args, cert, key, ports, events):
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    broker = Broker(events)
+    rng = random.Random(dev_ids[0] if dev_ids else 0)
+    for dev_id in dev_ids:
+        broker.printers[dev_id] = VirtualPrinter(dev_id, broker, args, rng)
+    server = await asyncio.start_server(broker.handle, "127.0.0.1", 0, ssl=context)
+    ports.put(server.sockets[0].getsockname()[1])
+    await broker.tick_printers(args.rate)
+
+def run_fleet(dev_ids, args, cert, key, ports, events):
+    asyncio.run(serve_fleet(dev_ids, args, cert, key, ports, events))
+
+# ---------- Service side ----------
+
+def rss_mib():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--printers", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=120, help="measured seconds, after all printers connected")
+    parser.add_argument("--rate", type=float, default=1.0, help="reports per second per printer")
+    parser.add_argument("--print-seconds", type=float, default=60, help="length of one simulated print")
+    parser.add_argument("--prepare-seconds", type=float, default=5)
+    parser.add_argument("--idle-seconds", type=float, default=10, help="max idle time between prints")
+    parser.add_argument("--fail-rate", type=float, default=0.1, help="share of prints that fail")
+    parser.add_argument("--ams-rate", type=float, default=0.02, help="chance of an AMS change per report")
+    parser.add_argument("--sim-processes", type=int, default=max(1, min(4, (os.cpu_count() or 2) // 2)),
+                        help="processes running the broker and virtual printers")
+    parser.add_argument("--cert")
+    parser.add_argument("--key")
+    args = parser.parse_args(argv)
+
+    from Benchmarks.standins import make_certificate
+    cert, key = (args.cert, args.key) if args.cert else make_certificate(os.environ["BAMBU_DATA_DIR"])
+    dev_ids = [f"SIM{i:04d}" for i in range(args.printers)]
+
+    # Printers are sharded over simulator processes, each with its own broker port
+    context = multiprocessing.get_context("spawn")
+    events = context.Queue()
+    shards = [dev_ids[i::args.sim_processes] for i in range(args.sim_processes)]
+    processes, port_of = [], {}
+    for shard in shards:
+        if not shard:
+            continue
+        ports = context.Queue()
+        process = context.Process(target=run_fleet, args=(shard, args, cert, key, ports, events), daemon=True)
+        process.start()
+        processes.append(process)
+        port = ports.get(timeout=30)
+        port_of.update({dev_id: port for dev_id in shard})
+
+    from Benchmarks.standins import start_standins
+    from tools import SavePrinterSetting
+    cloud, spoolman = start_standins([f"GFA0{i}" for i in range(4)])
+    for dev_id in dev_ids:
+        SavePrinterSetting(dev_id, "printer_ip", "127.0.0.1")
+        SavePrinterSetting(dev_id, "dev_acces_code", "fleet")
+        SavePrinterSetting(dev_id, "mqtt_port", port_of[dev_id])
+        SavePrinterSetting(dev_id, "name", dev_id)
+
+    saved = {}  # (dev_id, task_id) -> time the task was recorded
+
+    def track_saves(printer):
+        save = printer.print_task.ReportAndSaveTask
+
+        def timed_save():
+            task_id = printer.print_task.task_id
+            save()
+            saved[(printer.dev_id, task_id)] = time.time()
+
+        printer.print_task.ReportAndSaveTask = timed_save
+
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        import Local_MQTT.local_mqtt as local_mqtt
+        from BambuPrinter.printer_registry import printer_registry
+        from Metrics.metrics import mqtt_messages
+        printer_registry.AddCreateListener(track_saves)
+        rss_before = rss_mib()
+        connect_start = time.perf_counter()
+        local_mqtt.StartMQTT()
+        while sum(local_mqtt.GetConnectionStatus(d)["connected"] for d in dev_ids) < len(dev_ids):
+            if time.perf_counter() - connect_start > 60 + len(dev_ids) * 0.5:
+                break
+            time.sleep(0.1)
+        connect_seconds = time.perf_counter() - connect_start
+        connected = sum(local_mqtt.GetConnectionStatus(d)["connected"] for d in dev_ids)
+
+        # Ends reported before the measured window are ignored
+        while True:
+            try:
+                events.get_nowait()
+            except queue.Empty:
+                break
+        messages_before = sum(mqtt_messages.values.values())
+        cpu_before, wall_before = cpu_seconds(), time.perf_counter()
+        ends = []
+        deadline = time.monotonic() + args.duration
+        while time.monotonic() < deadline:
+            try:
+                ends.append(events.get(timeout=0.5))
+            except queue.Empty:
+                pass
+        # Let the last tasks land
+        time.sleep(2)
+        cpu = cpu_seconds() - cpu_before
+        wall = time.perf_counter() - wall_before
+        messages = sum(mqtt_messages.values.values()) - messages_before
+        queue_status = local_mqtt.ingest_queue.Status()
+        local_mqtt.usage_outbox.Flush(timeout=30)
+
+    rss_after = rss_mib()
+    for process in processes:
+        process.terminate()
+
+    latencies = [saved[(dev_id, task_id)] - sent for _, dev_id, task_id, _, sent in ends if (dev_id, task_id) in saved]
+    print(f"{connected}/{len(dev_ids)} printers connected in {connect_seconds:.1f}s "
+          f"({len(processes)} simulator process(es))")
+    print(f"{messages} reports in {wall:.1f}s: {messages / wall:,.0f} msg/s "
+          f"({messages / wall / max(connected, 1):.2f} per printer)")
+    print(f"CPU: {cpu:.2f}s = {cpu / wall * 100:.1f}% of one core, "
+          f"{cpu / wall / max(connected, 1) * 1000:.2f} ms/s per printer, {cpu / max(messages, 1) * 1e6:.1f} us per report")
+    print(f"RSS: {rss_before:.1f} MiB before connecting, {rss_after:.1f} MiB after "
+          f"({(rss_after - rss_before) / max(connected, 1) * 1024:.0f} KiB per printer)")
+    print(f"ingest queue: {queue_status}")
+    finished = sum(1 for e in ends if e[3] == "FINISH")
+    print(f"prints ended: {len(ends)} ({finished} finished, {len(ends) - finished} failed), recorded: {len(latencies)}")
+    if latencies:
+        print(f"report → recorded task: p50 {percentile(latencies, 0.5) * 1000:.1f} ms, "
+              f"p95 {percentile(latencies, 0.95) * 1000:.1f} ms, max {max(latencies) * 1000:.1f} ms")
+    print(f"cloud requests: {dict(cloud.server.requests)}, spoolman uses: {len(spoolman.uses)}")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+"""Synthetic data for the micro-benchmarks, in the formats the service reads and writes."""
+import configparser
+import json
+import random
+from datetime import datetime, timedelta
+
+from Benchmarks.standins import generated_filament
+
+TIME_FORMAT = "%H:%M:%S-%d-%m-%Y"
+
+def filament_line(name, ftype, vendor, filament_id):
+    # Same line as SlicerFilament / SpoolmanFilament __str__
+    return f"Filament Name: {name}, Filament Type: {ftype}, Filament Vendor: {vendor}, Filament ID: {filament_id}"
+
+def slicer_filaments(count, seed=0):
+    """{key: {"id", "vendor", "type", "name"}} as parse_filaments returns them."""
+    rng = random.Random(seed)
+    filaments = {}
+    for i in range(count):
+        vendor, material, name, _ = generated_filament(rng)
+        filament_id = f"P{i:06X}"
+        filaments[f"{vendor} {material} {name} {filament_id}"] = {
+            "id": filament_id, "vendor": vendor, "type": material, "name": name}
+    return filaments
+
+def spoolman_filaments(count, seed=1):
+    rng = random.Random(seed)
+    filaments = {}
+    for spool_id in range(1, count + 1):
+        vendor, material, name, _ = generated_filament(rng)
+        filaments[f"{vendor} {material} {name} {spool_id}"] = {
+            "id": str(spool_id), "vendor": vendor, "type": material, "name": name}
+    return filaments
+
+def write_filament_file(path, filaments):
+    with open(path, "w", encoding="utf-8") as f:
+        for filament in filaments.values():
+            f.write(filament_line(filament["name"], filament["type"], filament["vendor"], filament["id"]) + "\n")
+
+def mapping(slicer, spoolman, fraction=0.5, seed=2):
+    """Maps `fraction` of the slicer filaments to distinct spools."""
+    rng = random.Random(seed)
+    spools = [f["id"] for f in spoolman.values()]
+    rng.shuffle(spools)
+    count = min(int(len(slicer) * fraction), len(spools))
+    return {f["id"]: int(spool) for f, spool in zip(list(slicer.values())[:count], spools)}
+
+def task_history(count, seed=3):
+    """Finished tasks as PrintTask.to_dict writes them to task.txt."""
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 1)
+    tasks = []
+    for i in range(count):
+        begin = start + timedelta(hours=i * 3)
+        end = begin + timedelta(minutes=rng.randint(10, 600))
+        filaments = [{"filamentId": f"GFA0{rng.randint(0, 3)}", "weight": round(rng.uniform(1, 120), 2),
+                      "spoolId": rng.randint(1, 50)} for _ in range(rng.randint(1, 4))]
+        status = "Complete" if rng.random() < 0.9 else "Failed"
+        tasks.append({
+            "model_name": f"Model {i}", "task_id": str(100000000 + i), "job_id": 200000000 + i,
+            "total_weight": round(sum(f["weight"] for f in filaments), 2),
+            "start_time": begin.strftime(TIME_FORMAT), "end_time": end.strftime(TIME_FORMAT),
+            "teoric_filaments": filaments, "reported_filament": filaments if status == "Complete" else filaments[:1],
+            "init_percent": 0, "percent_complete": 100 if status == "Complete" else rng.randint(1, 99),
+            "status": status, "image_cover_url": "", "printer_id": f"PRINTER{i % 3}",
+        })
+    return tasks
+
+def write_task_history(path, count):
+    with open(path, "w") as f:
+        json.dump(task_history(count), f, indent=4)
+
+def write_credentials(path, extra_keys=20, printers=3):
+    """A credentials.ini like a configured install, padded with `extra_keys` settings."""
+    config = configparser.ConfigParser()
+    config["DEFAULT"] = {
+        "access_token": "x" * 600, "email": "bench@example.com", "spoolman_ip": "127.0.0.1",
+        "spoolman_port": "7912", "dev_id": "PRINTER0", "printer_ip": "192.168.1.10",
+        "dev_acces_code": "12345678",
+    }
+    for i in range(extra_keys):
+        config["DEFAULT"][f"setting_{i}"] = str(i)
+    for i in range(printers):
+        config[f"printer:PRINTER{i}"] = {"name": f"Printer {i}", "printer_ip": f"192.168.1.{10 + i}",
+                                         "dev_acces_code": "12345678"}
+    with open(path, "w") as f:
+        config.write(f)
@@ -0,0 +1,293 @@
+"""Micro-benchmarks of the hot functions, at several data sizes.
+
+Run from the repository root:
+    python -m Benchmarks.microbench                       # small and medium sizes
+    python -m Benchmarks.microbench --scales small,medium,large --save baseline.json
+    python -m Benchmarks.microbench --compare baseline.json --threshold 0.15
+    python -m Benchmarks.microbench --filter parse_filaments,ReadCredentials
+
+--compare exits with status 1 when a case got slower than the baseline by more
+than --threshold (0.2 = 20 %). Baselines only make sense on the machine that
+recorded them.
+"""
+import argparse
+import builtins
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+# Every file the benchmarked code touches lives in a scratch directory
+os.environ["BAMBU_DATA_DIR"] = tempfile.mkdtemp(prefix="bambu-microbench-")
+
+import BambuCloud.projects
+import BambuPrinter.print_task as print_task
+from BambuPrinter.bambu_printer import BambuPrinter
+from Benchmarks import generators
+from Benchmarks.report_payloads import Message, encode, print_session
+from Filament import filament
+from Filament.mapping_store import mapping_store
+from helper_logs import Logger
+import tools
+
+SCALES = ("small", "medium", "large")
+MIN_SAMPLE_SECONDS = 0.05
+
+class Case:
+    """prepare(size) returns (func, ops): func() is timed, ops is how many
+    operations one call does. reset(size), if given, runs before every call,
+    outside the timing, for code that changes its own input."""
+
+    def __init__(self, name, sizes, prepare, reset=None):
+        self.name = name
+        self.sizes = dict(zip(SCALES, sizes))
+        self.prepare = prepare
+        self.reset = reset
+
+# ---------- cases ----------
+
+def prepare_parse_filaments(count):
+    path = os.path.join(tools.DATA_DIR, f"parse_{count}.txt")
+    generators.write_filament_file(path, generators.spoolman_filaments(count))
+    return (lambda: filament.parse_filaments(path)), count
+
+def prepare_find_best_match(count):
+    slicer = list(generators.slicer_filaments(20).values())
+    spoolman = generators.spoolman_filaments(count)
+    used = {str(i) for i in range(1, count // 2)}
+
+    def run():
+        for bambu in slicer:
+            filament.find_best_match(bambu, spoolman, used)
+    return run, len(slicer)
+
+def _write_filament_files(slicer_count, spool_count):
+    slicer = generators.slicer_filaments(slicer_count)
+    spoolman = generators.spoolman_filaments(spool_count)
+    generators.write_filament_file(filament.BAMBU_FILE, slicer)
+    generators.write_filament_file(filament.SPOOLMAN_FILE, spoolman)
+    return slicer, spoolman
+
+def prepare_map_filaments(sizes):
+    slicer_count, spool_count = sizes
+    _write_filament_files(slicer_count, spool_count)
+
+    def run():
+        # Accept every suggestion, as pressing Enter does
+        original = builtins.input
+        builtins.input = lambda prompt="": ""
+        try:
+            filament.map_filaments()
+        finally:
+            builtins.input = original
+    return run, slicer_count
+
+def reset_mapping(sizes):
+    mapping_store.replace({})
+
+def prepare_get_filaments_data(sizes):
+    from Gui.WebServer import websockets_service
+    slicer_count, spool_count = sizes
+    slicer, spoolman = _write_filament_files(slicer_count, spool_count)
+    mapping_store.replace(generators.mapping(slicer, spoolman))
+    # Only the local work: the syncs are network calls
+    websockets_service.sync_scheduler.RunNow = lambda *names: None
+    return websockets_service.get_filaments_data, 1
+
+def _fake_job_id(task_id):
+    return 1
+
+def _fake_task_detail(job_id):
+    return {"weight": 10.0, "title": "bench", "cover": "",
+            "amsDetailMapping": [{"ams": 0, "filamentId": "GFA00", "weight": 10.0}]}
+
+def prepare_process_mqtt(reports_per_percent):
+    BambuCloud.projects.GetJobID = _fake_job_id
+    BambuCloud.projects.GetTaksDetail = _fake_task_detail
+    payloads = encode(print_session(reports_per_percent=reports_per_percent, full_every=20))
+    messages = [Message(p, "MICROBENCH") for p in payloads]
+
+    def run():
+        printer = BambuPrinter("MICROBENCH", "microbench")
+        # Reporting is its own case
+        printer.print_task.ReportAndSaveTask = lambda: None
+        for message in messages:
+            printer.ProccessMQTTMsg(message)
+    return run, len(messages)
+
+class NullOutbox:
+    """Spoolman delivery is not part of the ReportAndSaveTask case."""
+
+    def Add(self, task, spool_id, weight):
+        return True
+
+def prepare_report_and_save(history):
+    print_task.usage_outbox = NullOutbox()
+
+    def run():
+        task = print_task.PrintTask()
+        task.task_id = "987654321"
+        task.printer_id = "MICROBENCH"
+        task.start_time = "10:00:00-01-01-2026"
+        task.percent_complete = 100
+        task.teoric_filaments = [{"filamentId": "GFA00", "weight": 12.5, "spoolId": 1},
+                                 {"filamentId": "GFA01", "weight": 3.0, "spoolId": 2}]
+        task.ReportAndSaveTask()
+    return run, 1
+
+def reset_task_history(history):
+    generators.write_task_history(os.path.join(tools.DATA_DIR, "task.txt"), history)
+
+def prepare_write_log(threads, lines=200):
+    log = Logger(os.path.join(tools.DATA_DIR, f"contention_{threads}.log"))
+
+    def worker():
+        for i in range(lines):
+            log._write_log(f"INFO: line {i} from {threading.current_thread().name}")
+
+    def run():
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+    return run, threads * lines
+
+def prepare_read_credentials(extra_keys):
+    generators.write_credentials(tools.CONFIG_FILE, extra_keys=extra_keys, printers=3)
+    return tools.ReadCredentials, 1
+
+CASES = [
+    Case("parse_filaments", (100, 1000, 10000), prepare_parse_filaments),
+    Case("find_best_match", (100, 1000, 10000), prepare_find_best_match),
+    Case("map_filaments", ((20, 100), (100, 1000), (300, 5000)), prepare_map_filaments, reset_mapping),
+    Case("get_filaments_data", ((50, 500), (200, 2000), (1000, 10000)), prepare_get_filaments_data),
+    Case("ProccessMQTTMsg", (1, 5, 20), prepare_process_mqtt),
+    Case("ReportAndSaveTask", (100, 1000, 10000), prepare_report_and_save, reset_task_history),
+    Case("Logger._write_log", (1, 4, 16), prepare_write_log),
+    Case("ReadCredentials", (10, 100, 1000), prepare_read_credentials),
+]
+
+# ---------- runner ----------
+
+def size_label(size):
+    return "x".join(str(s) for s in size) if isinstance(size, tuple) else str(size)
+
+def measure(case, size, repeat):
+    """Seconds per operation: (median, min) over `repeat` samples."""
+    func, ops = case.prepare(size)
+    if case.reset:
+        # Calls change their input: one call per sample, fresh input each time
+        number = 1
+    else:
+        func()  # warm up caches and lazy imports
+        number = 1
+        while True:
+            start = time.perf_counter()
+            for _ in range(number):
+                func()
+            if time.perf_counter() - start >= MIN_SAMPLE_SECONDS or number >= 1 << 16:
+                break
+            number *= 2
+    samples = []
+    for _ in range(repeat):
+        if case.reset:
+            case.reset(size)
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        samples.append((time.perf_counter() - start) / (number * ops))
+    return statistics.median(samples), min(samples)
+
+def format_time(seconds):
+    if seconds >= 1:
+        return f"{seconds:8.3f} s "
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:8.3f} ms"
+    return f"{seconds * 1e6:8.3f} us"
+
+def run_cases(scales, names, repeat):
+    results = {}
+    for case in CASES:
+        if names and case.name not in names:
+            continue
+        for scale in scales:
+            size = case.sizes[scale]
+            key = f"{case.name}[{size_label(size)}]"
+            with contextlib.redirect_stdout(io.StringIO()):
+                median, best = measure(case, size, repeat)
+            results[key] = {"median": median, "min": best, "scale": scale}
+            print(f"{key:<40}{format_time(median)} per op   (min {format_time(best).strip()})", flush=True)
+    return results
+
+def compare(results, baseline, threshold):
+    """Print the change against the baseline. Returns the keys that regressed."""
+    regressions = []
+    print()
+    print(f"{'case':<40}{'baseline':>12}{'now':>12}{'change':>10}")
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base is None:
+            print(f"{key:<40}{'-':>12}{format_time(result['median']):>12}{'new':>10}")
+            continue
+        change = result["median"] / base["median"] - 1
+        flag = ""
+        if change > threshold:
+            regressions.append(key)
+            flag = "  REGRESSION"
+        elif change < -threshold:
+            flag = "  faster"
+        print(f"{key:<40}{format_time(base['median']):>12}{format_time(result['median']):>12}{change:>+10.1%}{flag}")
+    missing = [key for key in baseline if key not in results]
+    if missing:
+        print(f"not run this time: {', '.join(missing)}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", default="small,medium", help=f"comma separated, from {', '.join(SCALES)}")
+    parser.add_argument("--filter", default="", help="comma separated case names (default: all)")
+    parser.add_argument("--repeat", type=int, default=5, help="samples per case; the median is reported")
+    parser.add_argument("--save", metavar="FILE", help="write the results as a baseline")
+    parser.add_argument("--compare", metavar="FILE", help="compare with a saved baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="slowdown that counts as a regression")
+    args = parser.parse_args(argv)
+
+    scales = [s for s in args.scales.split(",") if s]
+    unknown = [s for s in scales if s not in SCALES]
+    if unknown:
+        parser.error(f"unknown scale(s): {', '.join(unknown)}")
+    names = {n for n in args.filter.split(",") if n}
+    unknown = names - {case.name for case in CASES}
+    if unknown:
+        parser.error(f"unknown case(s): {', '.join(sorted(unknown))}")
+
+    results = run_cases(scales, names, args.repeat)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"meta": {"date": datetime.now().isoformat(timespec="seconds"),
+                                "python": platform.python_version(), "machine": platform.platform(),
+                                "repeat": args.repeat},
+                       "results": results}, f, indent=2)
+        print(f"baseline saved to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) over {args.threshold:.0%}: {', '.join(regressions)}")
+            return 1
+        print(f"no regressions over {args.threshold:.0%}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
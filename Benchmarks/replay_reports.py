@@ -0,0 +1,172 @@
+"""Replay recorded MQTT reports through BambuPrinter, against local cloud/Spoolman stand-ins.
+
+Record on a live service with BAMBU_RECORD_REPORTS=1 (files land in data/recordings/),
+then run from the repository root:
+    python -m Benchmarks.replay_reports data/recordings/<dev_id>-<time>.brpt.gz [--speed 10]
+    python -m Benchmarks.replay_reports --synthetic --speed max --repeat 5
+
+--speed 1 replays in real time, 10 ten times faster, max without any waiting.
+"""
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+# Logs, tasks and credentials go to a scratch directory
+os.environ.setdefault("BAMBU_DATA_DIR", tempfile.mkdtemp(prefix="bambu-replay-"))
+
+from BambuPrinter.bambu_printer import BambuPrinter
+from Benchmarks.report_payloads import Message, encode, load_payloads, print_session
+from Benchmarks.standins import start_standins
+from Local_MQTT.report_recorder import ReadRecording, RecordingWriter
+from Spoolman.usage_outbox import usage_outbox
+
+TRANSITION_FIELDS = ("gcode_state", "stg_cur")
+
+class Replay:
+    """One run over the merged, time-ordered records of every recording."""
+
+    def __init__(self, recordings, speed):
+        self.speed = speed
+        self.printers = {}
+        self.events = []
+        for recording in recordings:
+            for offset, payload in recording.records:
+                self.events.append((offset, recording.dev_id, payload))
+        self.events.sort(key=lambda e: e[0])
+        self.transitions = []
+        self.saves = []
+        self.latencies = []
+        self.message_start = 0.0
+        self.replay_start = 0.0
+        self.offset = 0.0
+
+    def printer(self, dev_id):
+        printer = self.printers.get(dev_id)
+        if printer is None:
+            printer = BambuPrinter(dev_id, dev_id)
+            printer.AddChangeListener(self.on_change, TRANSITION_FIELDS)
+            save = printer.print_task.ReportAndSaveTask
+
+            def timed_save(save=save, dev_id=dev_id):
+                start = time.perf_counter()
+                save()
+                self.saves.append((dev_id, self.offset, time.perf_counter() - start))
+
+            printer.print_task.ReportAndSaveTask = timed_save
+            self.printers[dev_id] = printer
+        return printer
+
+    def on_change(self, changed, printer):
+        for field in TRANSITION_FIELDS:
+            if field in changed:
+                self.transitions.append({
+                    "printer": printer.dev_id,
+                    "field": field,
+                    "value": printer.state.Get(field),
+                    "recorded_at": self.offset,
+                    "replayed_at": time.perf_counter() - self.replay_start,
+                    # Handler time up to here, including any ReportAndSaveTask
+                    "handling": time.perf_counter() - self.message_start,
+                })
+
+    def run(self):
+        messages = [(offset, self.printer(dev_id), Message(payload, dev_id))
+                    for offset, dev_id, payload in self.events]
+        self.replay_start = time.perf_counter()
+        for offset, printer, message in messages:
+            if self.speed:
+                delay = self.replay_start + offset / self.speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            self.offset = offset
+            self.message_start = time.perf_counter()
+            printer.ProccessMQTTMsg(message)
+            self.latencies.append(time.perf_counter() - self.message_start)
+        return time.perf_counter() - self.replay_start
+
+def synthetic_recording(path, interval, full_every):
+    writer = RecordingWriter(path, "SYNTHETIC", start=0)
+    for i, payload in enumerate(encode(print_session(full_every=full_every))):
+        writer.Write(payload, offset=i * interval)
+    writer.Close()
+    return ReadRecording(path)
+
+def load(paths):
+    recordings = []
+    for path in paths:
+        if path.endswith(".jsonl"):
+            # Bare payloads from Benchmarks.report_payloads, one second apart
+            writer = RecordingWriter(path + ".brpt.gz", os.path.basename(path), start=0)
+            for i, payload in enumerate(load_payloads(path)):
+                writer.Write(payload, offset=i)
+            writer.Close()
+            path = path + ".brpt.gz"
+        recordings.append(ReadRecording(path))
+    return recordings
+
+def parse_speed(value):
+    if value == "max":
+        return 0
+    speed = float(value)
+    if speed <= 0:
+        raise argparse.ArgumentTypeError("speed must be > 0 or 'max'")
+    return speed
+
+def report(replay, wall, cloud, spoolman):
+    count = len(replay.latencies)
+    busy = sum(replay.latencies)
+    lat = sorted(replay.latencies)
+    print(f"{count} reports from {len(replay.printers)} printer(s) in {wall:.3f}s "
+          f"({count / wall:,.0f} msg/s wall, {count / busy:,.0f} msg/s processing)")
+    print(f"per report: mean {statistics.mean(lat) * 1e6:.1f} us, p50 {lat[count // 2] * 1e6:.1f} us, "
+          f"p99 {lat[min(count - 1, int(count * 0.99))] * 1e6:.1f} us, max {lat[-1] * 1e3:.2f} ms")
+    print()
+    print(f"{'printer':<12}{'field':<13}{'value':<10}{'recorded s':>12}{'replayed s':>12}{'handling ms':>13}")
+    for t in replay.transitions:
+        print(f"{t['printer']:<12}{t['field']:<13}{str(t['value']):<10}{t['recorded_at']:>12.1f}"
+              f"{t['replayed_at']:>12.3f}{t['handling'] * 1000:>13.2f}")
+    print()
+    for dev_id, offset, seconds in replay.saves:
+        print(f"ReportAndSaveTask [{dev_id}] at {offset:.1f}s took {seconds * 1000:.2f} ms")
+    print(f"cloud requests: {dict(cloud.server.requests)}; spoolman uses: {spoolman.uses}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("recordings", nargs="*", help=".brpt.gz recordings or JSON-lines payload files")
+    parser.add_argument("--synthetic", action="store_true", help="replay a generated print session")
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between synthetic reports")
+    parser.add_argument("--full-every", type=int, default=0, help="every Nth synthetic report is a pushall")
+    parser.add_argument("--speed", type=parse_speed, default=parse_speed("max"), help="1 = real time, N = N times faster, max")
+    parser.add_argument("--repeat", type=int, default=1, help="replay N times on fresh printers, report the fastest")
+    parser.add_argument("--filaments", default="GFA00", help="comma separated filament ids used by stand-in tasks")
+    parser.add_argument("--verbose", action="store_true", help="show the service log while replaying")
+    args = parser.parse_args(argv)
+
+    if args.synthetic:
+        path = os.path.join(os.environ["BAMBU_DATA_DIR"], "synthetic.brpt.gz")
+        recordings = [synthetic_recording(path, args.interval, args.full_every)]
+    elif args.recordings:
+        recordings = load(args.recordings)
+    else:
+        parser.error("give recordings or --synthetic")
+
+    cloud, spoolman = start_standins(args.filaments.split(","))
+    best = None
+    for _ in range(args.repeat):
+        replay = Replay(recordings, args.speed)
+        output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        with output:
+            wall = replay.run()
+        if best is None or wall < best[1]:
+            best = (replay, wall)
+    # Usage reaches the Spoolman stand-in through the outbox
+    usage_outbox.Flush(timeout=30)
+    report(best[0], best[1], cloud, spoolman)
+
+if __name__ == "__main__":
+    sys.exit(main())
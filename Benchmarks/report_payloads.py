@@ -0,0 +1,172 @@
+import json
+import random
+
+# Shapes follow what an A1 + AMS Lite publishes on device/<id>/report
+
+class Message:
+    """What BambuPrinter.ProccessMQTTMsg needs of a paho MQTTMessage."""
+
+    def __init__(self, payload, dev_id="BENCH"):
+        self.topic = f"device/{dev_id}/report"
+        self.payload = payload
+
+def tray(index, filament_id="GFA00", filament_type="PLA", color="FFFFFFFF", remain=80):
+    return {
+        "id": str(index),
+        "tag_uid": "0000000000000000",
+        "tray_id_name": "",
+        "tray_info_idx": filament_id,
+        "tray_type": filament_type,
+        "tray_sub_brands": "",
+        "tray_color": color,
+        "tray_weight": "1000",
+        "tray_diameter": "1.75",
+        "tray_temp": "0",
+        "tray_time": "0",
+        "bed_temp_type": "0",
+        "bed_temp": "0",
+        "nozzle_temp_max": "230",
+        "nozzle_temp_min": "190",
+        "xcam_info": "000000000000000000000000",
+        "tray_uuid": "00000000000000000000000000000000",
+        "remain": remain,
+        "k": 0.02,
+        "n": 1,
+        "cali_idx": -1,
+        "total_len": 330000,
+        "cols": [color],
+        "ctype": 0,
+    }
+
+def pushall(sequence_id=0, gcode_state="IDLE", stg_cur=255, mc_percent=0, task_id="0"):
+    """A full `pushall` report."""
+    colors = ("FFFFFFFF", "000000FF", "FF0000FF", "00AE42FF")
+    return {
+        "print": {
+            "ams": {
+                "ams": [{"humidity": "5", "id": "0", "temp": "0.0",
+                         "tray": [tray(i, f"GFA0{i}", "PLA", colors[i], 90 - i * 10) for i in range(4)]}],
+                "ams_exist_bits": "1",
+                "insert_flag": True,
+                "power_on_flag": False,
+                "tray_exist_bits": "f",
+                "tray_is_bbl_bits": "f",
+                "tray_now": "255",
+                "tray_pre": "255",
+                "tray_read_done_bits": "f",
+                "tray_reading_bits": "0",
+                "tray_tar": "255",
+                "version": 5,
+            },
+            "ams_rfid_status": 0,
+            "ams_status": 0,
+            "bed_target_temper": 0.0,
+            "bed_temper": 24.5,
+            "big_fan1_speed": "0",
+            "big_fan2_speed": "0",
+            "chamber_temper": 5.0,
+            "command": "push_status",
+            "cooling_fan_speed": "0",
+            "fail_reason": "0",
+            "fan_gear": 0,
+            "force_upgrade": False,
+            "gcode_file": "",
+            "gcode_file_prepare_percent": "0",
+            "gcode_start_time": "0",
+            "gcode_state": gcode_state,
+            "heatbreak_fan_speed": "0",
+            "hms": [],
+            "home_flag": 322454936,
+            "hw_switch_state": 0,
+            "ipcam": {"ipcam_dev": "1", "ipcam_record": "enable", "mode_bits": 3, "resolution": "1080p",
+                      "rtsp_url": "disable", "timelapse": "disable", "tutk_server": "disable"},
+            "layer_num": 0,
+            "lifecycle": "product",
+            "lights_report": [{"mode": "on", "node": "chamber_light"}],
+            "mc_percent": mc_percent,
+            "mc_print_line_number": "0",
+            "mc_print_stage": "1",
+            "mc_print_sub_stage": 0,
+            "mc_remaining_time": 0,
+            "mess_production_state": "active",
+            "net": {"conf": 0, "info": [{"ip": 1694607552, "mask": 16777215}]},
+            "nozzle_diameter": "0.4",
+            "nozzle_target_temper": 0.0,
+            "nozzle_temper": 25.0,
+            "nozzle_type": "stainless_steel",
+            "online": {"ahb": False, "rfid": False, "version": 7},
+            "print_error": 0,
+            "print_gcode_action": 0,
+            "print_real_action": 0,
+            "print_type": "idle",
+            "profile_id": "",
+            "project_id": "",
+            "queue_number": 0,
+            "sdcard": True,
+            "sequence_id": str(sequence_id),
+            "spd_lvl": 2,
+            "spd_mag": 100,
+            "stg": [],
+            "stg_cur": stg_cur,
+            "subtask_id": "",
+            "subtask_name": "",
+            "task_id": task_id,
+            "total_layer_num": 0,
+            "upgrade_state": {"ahb_new_version_number": "", "ams_new_version_number": "", "consistency_request": False,
+                              "dis_state": 0, "err_code": 0, "force_upgrade": False, "message": "0%, 0B/s",
+                              "module": "", "new_version_state": 2, "ota_new_version_number": "",
+                              "progress": "0", "sequence_id": 0, "status": "IDLE"},
+            "upload": {"file_size": 0, "finish_size": 0, "message": "Good", "oss_url": "",
+                       "progress": 0, "sequence_id": "0903", "speed": 0, "status": "idle",
+                       "task_id": "", "time_remaining": 0, "trouble_id": ""},
+            "vt_tray": {"id": "254", "tray_info_idx": "GFL99", "tray_type": "PLA", "tray_color": "FFFFFFFF",
+                        "remain": 0, "k": 0.02, "n": 1},
+            "wifi_signal": "-45dBm",
+            "xcam": {"buildplate_marker_detector": True},
+        }
+    }
+
+def print_session(reports_per_percent=5, full_every=0, seed=1, task_id="123456789"):
+    """Payload dicts for a whole print: pushall, prepare, 0..100 %, finish.
+
+    Periodic reports are deltas; with full_every > 0 every Nth report is a
+    full report instead (X1-style printers send those all the time).
+    """
+    rng = random.Random(seed)
+    messages = [pushall(0), pushall(1, "PREPARE", 2, 0, task_id)]
+    sequence = 1
+    started = False
+    for percent in range(0, 101):
+        for _ in range(reports_per_percent):
+            sequence += 1
+            delta = {
+                "bed_temper": round(60 + rng.uniform(-0.5, 0.5), 1),
+                "nozzle_temper": round(220 + rng.uniform(-1, 1), 1),
+                "wifi_signal": f"-{rng.randint(40, 50)}dBm",
+                "mc_percent": percent,
+                "mc_remaining_time": max(0, 100 - percent),
+                "layer_num": percent * 2,
+                "command": "push_status",
+                "msg": 1,
+                "sequence_id": str(sequence),
+            }
+            if not started:
+                delta.update({"gcode_state": "RUNNING", "stg_cur": 0})
+                started = True
+            if full_every and sequence % full_every == 0:
+                full = pushall(sequence, "RUNNING", 0, percent, task_id)
+                full["print"].update(delta)
+                messages.append(full)
+            else:
+                messages.append({"print": delta})
+    messages.append({"print": {"gcode_state": "FINISH", "stg_cur": 255, "mc_percent": 100,
+                               "command": "push_status", "sequence_id": str(sequence + 1)}})
+    return messages
+
+def encode(messages):
+    return [json.dumps(m, separators=(",", ":")).encode() for m in messages]
+
+def load_payloads(path):
+    """Raw payloads from a JSON-lines file (one report per line)."""
+    with open(path, "rb") as f:
+        return [line.rstrip(b"\n") for line in f if line.strip()]
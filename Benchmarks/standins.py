@@ -0,0 +1,548 @@
+"""Local stand-ins for Bambu Cloud, Spoolman and the printer's FTPS share, so
+recorded or synthetic print sessions run through the real network code paths
+without touching any of them.
+
+The HTTP stand-ins can be slowed down (`latency`, seconds per request, +-50 %)
+and made to fail (`error_rate`, fraction of requests answered with 503), and
+filled with generated spools, slicer filaments and cloud tasks."""
+import base64
+import hashlib
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import ssl
+import struct
+import subprocess
+import sys
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+class StandInHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def dispatch(self, method):
+        path = urlparse(self.path).path
+        for route_method, pattern, name in self.server.routes:
+            match = pattern.fullmatch(path)
+            if route_method == method and match:
+                self.server.requests[name] += 1
+                if self.server.latency:
+                    time.sleep(self.server.latency * self.server.rng.uniform(0.5, 1.5))
+                if self.server.error_rate and self.server.rng.random() < self.server.error_rate:
+                    self.server.requests["injected_errors"] += 1
+                    self.send_json(503, {"error": "injected by stand-in"})
+                    return
+                headers = None
+                try:
+                    result = getattr(self.server.app, name)(self, *match.groups())
+                    status, body = result[:2]
+                    if len(result) > 2:
+                        headers = result[2]
+                except Exception as e:
+                    status, body = 500, {"error": str(e)}
+                self.send_json(status, body, headers)
+                return
+        self.server.requests["not_found"] += 1
+        self.send_json(404, {"error": "not found"})
+
+    def do_GET(self):
+        if self.headers.get("Upgrade", "").lower() == "websocket" and hasattr(self.server.app, "subscribe"):
+            self.websocket()
+            return
+        self.dispatch("GET")
+
+    def websocket(self):
+        """Minimal server side of RFC 6455: text frames out, answers pings and close."""
+        key = self.headers.get("Sec-WebSocket-Key", "")
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+        self.protocol_version = "HTTP/1.1"
+        self.send_response(101, "Switching Protocols")
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept)
+        self.end_headers()
+        self.wfile.flush()
+        self.close_connection = True
+        peer = WebSocketPeer(self.connection)
+        self.server.requests["websocket"] += 1
+        self.server.app.subscribe(peer)
+        try:
+            while True:
+                opcode, payload = peer.read_frame(self.rfile)
+                if opcode == 0x8:
+                    peer.send_frame(0x8, payload[:2])
+                    break
+                if opcode == 0x9:
+                    peer.send_frame(0xA, payload)
+        except (OSError, ValueError, struct.error):
+            pass
+        finally:
+            self.server.app.unsubscribe(peer)
+
+    def do_PUT(self):
+        self.dispatch("PUT")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+class WebSocketPeer:
+    def __init__(self, sock):
+        self.sock = sock
+        self.lock = threading.Lock()
+
+    def send_frame(self, opcode, payload):
+        header = bytes([0x80 | opcode])
+        if len(payload) < 126:
+            header += bytes([len(payload)])
+        elif len(payload) < 1 << 16:
+            header += bytes([126]) + struct.pack("!H", len(payload))
+        else:
+            header += bytes([127]) + struct.pack("!Q", len(payload))
+        with self.lock:
+            self.sock.sendall(header + payload)
+
+    def send_text(self, text):
+        self.send_frame(0x1, text.encode())
+
+    def read_frame(self, stream):
+        first, second = stream.read(2)
+        length = second & 0x7F
+        if length == 126:
+            length, = struct.unpack("!H", stream.read(2))
+        elif length == 127:
+            length, = struct.unpack("!Q", stream.read(8))
+        mask = stream.read(4) if second & 0x80 else b"\0\0\0\0"
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(stream.read(length)))
+        return first & 0x0F, payload
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, app, routes, host="127.0.0.1", port=0, latency=0.0, error_rate=0.0, seed=0):
+        super().__init__((host, port), StandInHandler)
+        self.app = app
+        self.routes = [(m, re.compile(p), n) for m, p, n in routes]
+        self.requests = Counter()
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+# Catalogue the generated datasets draw names from
+VENDORS = ("Bambu Lab", "Polymaker", "eSUN", "Prusament", "Sunlu", "Elegoo", "Overture", "Generic")
+MATERIALS = ("PLA", "PETG", "ABS", "ASA", "TPU", "PLA-CF", "PA")
+FINISHES = ("Basic", "Matte", "Silk", "Pro", "HF")
+COLORS = (("Black", "000000"), ("White", "FFFFFF"), ("Red", "C12E1F"), ("Blue", "0A2989"), ("Green", "00AE42"),
+          ("Grey", "8E9089"), ("Orange", "FF6A13"), ("Yellow", "F4EE2A"), ("Purple", "5E43B7"), ("Silver", "A6A9AA"))
+
+def generated_filament(rng):
+    """(vendor, material, name, color hex) of a plausible filament."""
+    color, color_hex = rng.choice(COLORS)
+    return rng.choice(VENDORS), rng.choice(MATERIALS), f"{rng.choice(FINISHES)} {color}", color_hex
+
+class CloudStandIn:
+    """Answers the calls done by BambuCloud: login, bound printers, slicer
+    filaments and task lookups.
+
+    Unknown task ids get a made-up task that used `weight_per_filament` grams of
+    each of `filament_ids`, so any recording can be replayed. `task_count` older
+    tasks and `slicer_filament_count` custom slicer filaments are generated up front.
+    """
+
+    def __init__(self, filament_ids=("GFA00",), weight_per_filament=10.0, task_count=0,
+                 slicer_filament_count=0, devices=(), seed=0, **server_options):
+        self.filament_ids = list(filament_ids)
+        self.weight_per_filament = weight_per_filament
+        self.tasks = {}  # job_id -> task detail, oldest first
+        self.devices = [dict(d) for d in devices]
+        self.lock = threading.Lock()
+        rng = random.Random(seed)
+        for i in range(task_count):
+            self.AddTask(f"history-{i}", [(rng.choice(self.filament_ids), round(rng.uniform(1, 200), 2))])
+        self.slicer_filaments = []
+        for i in range(slicer_filament_count):
+            vendor, material, name, _ = generated_filament(rng)
+            self.slicer_filaments.append({
+                "setting_id": f"PFUS{i:012x}", "filament_id": f"P{i:06X}",
+                "name": f"{vendor} {material} {name} @Bambu Lab A1 0.4 nozzle",
+                "filament_vendor": vendor, "filament_type": material,
+            })
+        self.server = StandInServer(self, [
+            ("GET", r"/v1/iot-service/api/user/task/([^/]+)", "task"),
+            ("GET", r"/v1/user-service/my/tasks", "my_tasks"),
+            ("GET", r"/v1/iot-service/api/slicer/setting", "slicer_setting"),
+            ("GET", r"/v1/iot-service/api/user/bind", "bind"),
+            ("POST", r"/v1/user-service/user/login", "login"),
+            ("POST", r"/v1/user-service/user/sendemail/code", "send_code"),
+        ], seed=seed, **server_options)
+
+    def AddTask(self, task_id, filaments=None, title=None):
+        """filaments: list of (filament_id, grams). Returns the job id."""
+        job_id = zlib.crc32(str(task_id).encode())
+        if filaments is None:
+            filaments = [(f, self.weight_per_filament) for f in self.filament_ids]
+        mapping = [{"ams": i, "filamentId": f, "weight": w} for i, (f, w) in enumerate(filaments)]
+        with self.lock:
+            self.tasks[job_id] = {
+                "id": job_id,
+                "title": title or f"Task {task_id}",
+                "cover": "",
+                "weight": sum(w for _, w in filaments),
+                "amsDetailMapping": mapping,
+            }
+        return job_id
+
+    def task(self, handler, task_id):
+        job_id = zlib.crc32(task_id.encode())
+        if job_id not in self.tasks:
+            self.AddTask(task_id)
+        return 200, {"id": task_id, "job_id": job_id}
+
+    def my_tasks(self, handler):
+        """Newest first. Without `limit` every task is returned, the worst case for GetTaksDetail."""
+        query = parse_qs(urlparse(handler.path).query)
+        offset = int(query.get("offset", ["0"])[0])
+        limit = int(query.get("limit", ["0"])[0]) or None
+        with self.lock:
+            hits = list(reversed(self.tasks.values()))
+        return 200, {"total": len(hits), "hits": hits[offset:offset + limit if limit else None]}
+
+    def slicer_setting(self, handler):
+        return 200, {"filament": {"private": self.slicer_filaments, "public": []}}
+
+    def bind(self, handler):
+        return 200, {"message": "success", "devices": self.devices}
+
+    def login(self, handler):
+        body = handler.read_json()
+        if not body.get("account"):
+            return 400, {"error": "account missing"}
+        return 200, {"accessToken": "stand-in", "refreshToken": "stand-in", "expiresIn": 7776000}
+
+    def send_code(self, handler):
+        return 200, {}
+
+class SpoolmanStandIn:
+    """Spools with remaining weights; PUT /spool/<id>/use subtracts like Spoolman does.
+
+    Changes are pushed to websocket subscribers of /api/v1/ as Spoolman events.
+    Without `filament_count` every spool has a filament of its own ("Filament <id>");
+    with it, spools share that many generated filaments and are partly used.
+    """
+
+    def __init__(self, spool_count=4, initial_weight=1000.0, filament_count=None, seed=0, **server_options):
+        self.spools = {}
+        self.uses = []  # (spool_id, grams) in arrival order
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        rng = random.Random(seed)
+        filaments = []
+        for filament_id in range(1, (filament_count or 0) + 1):
+            vendor, material, name, color_hex = generated_filament(rng)
+            filaments.append({"id": filament_id, "name": name, "material": material,
+                              "vendor": {"name": vendor}, "color_hex": color_hex})
+        for spool_id in range(1, spool_count + 1):
+            if filaments:
+                filament = rng.choice(filaments)
+                used = round(rng.choice((0.0, rng.uniform(0, initial_weight))), 2)
+            else:
+                filament = {"id": spool_id, "name": f"Filament {spool_id}", "material": "PLA",
+                            "vendor": {"name": "Stand-in"}, "color_hex": "FFFFFF"}
+                used = 0.0
+            self.spools[spool_id] = {
+                "id": spool_id,
+                "remaining_weight": initial_weight - used,
+                "used_weight": used,
+                "archived": False,
+                "filament": filament,
+            }
+        self.server = StandInServer(self, [
+            ("GET", r"/api/v1/spool", "list_spools"),
+            ("GET", r"/api/v1/info", "info"),
+            ("PUT", r"/api/v1/spool/(\d+)/use", "use_spool"),
+        ], seed=seed, **server_options)
+
+    def list_spools(self, handler):
+        """Honours Spoolman's limit/offset/allow_archived and reports X-Total-Count."""
+        query = parse_qs(urlparse(handler.path).query)
+        allow_archived = query.get("allow_archived", ["false"])[0].lower() == "true"
+        offset = int(query.get("offset", ["0"])[0])
+        limit = int(query.get("limit", ["0"])[0]) or None
+        with self.lock:
+            spools = [s for _, s in sorted(self.spools.items()) if allow_archived or not s["archived"]]
+            page = [dict(s) for s in spools[offset:offset + limit if limit else None]]
+        return 200, page, {"X-Total-Count": str(len(spools))}
+
+    def info(self, handler):
+        return 200, {"version": "stand-in"}
+
+    def use_spool(self, handler, spool_id):
+        weight = float(handler.read_json().get("use_weight", 0))
+        with self.lock:
+            spool = self.spools.get(int(spool_id))
+            if spool is None:
+                return 404, {"message": "Spool not found"}
+            spool["used_weight"] += weight
+            spool["remaining_weight"] -= weight
+            self.uses.append((int(spool_id), weight))
+            spool = dict(spool)
+        self.emit("spool", "updated", spool)
+        return 200, spool
+
+    def subscribe(self, peer):
+        with self.lock:
+            self.subscribers.add(peer)
+
+    def unsubscribe(self, peer):
+        with self.lock:
+            self.subscribers.discard(peer)
+
+    def emit(self, resource, kind, payload):
+        message = json.dumps({"type": kind, "resource": resource, "payload": payload})
+        with self.lock:
+            peers = list(self.subscribers)
+        for peer in peers:
+            try:
+                peer.send_text(message)
+            except OSError:
+                self.unsubscribe(peer)
+
+    def drop_subscribers(self):
+        """Cut every websocket, as a Spoolman restart would."""
+        with self.lock:
+            peers = list(self.subscribers)
+        for peer in peers:
+            peer.close()
+
+    def add_spool(self, name, material="PLA", vendor="Stand-in", weight=1000.0):
+        with self.lock:
+            spool_id = max(self.spools, default=0) + 1
+            spool = {"id": spool_id, "remaining_weight": weight, "used_weight": 0.0, "archived": False,
+                     "filament": {"id": spool_id, "name": name, "material": material,
+                                  "vendor": {"name": vendor}, "color_hex": "FFFFFF"}}
+            self.spools[spool_id] = spool
+            spool = dict(spool)
+        self.emit("spool", "added", spool)
+        return spool_id
+
+    def update_spool(self, spool_id, **fields):
+        with self.lock:
+            spool = self.spools[spool_id]
+            spool.update(fields)
+            spool = dict(spool)
+        self.emit("spool", "updated", spool)
+
+    def update_filament(self, filament_id, **fields):
+        with self.lock:
+            filament = None
+            for spool in self.spools.values():
+                if spool["filament"]["id"] == filament_id:
+                    spool["filament"] = filament = dict(spool["filament"], **fields)
+        if filament is not None:
+            self.emit("filament", "updated", filament)
+
+    def delete_spool(self, spool_id):
+        with self.lock:
+            spool = self.spools.pop(spool_id)
+        self.emit("spool", "deleted", spool)
+
+def make_certificate(directory):
+    """Self-signed certificate for the TLS stand-ins; needs the openssl binary."""
+    if shutil.which("openssl") is None:
+        sys.exit("openssl is needed to create a stand-in certificate")
+    cert, key = os.path.join(directory, "standin.crt"), os.path.join(directory, "standin.key")
+    if not os.path.exists(cert):
+        # Before tools is imported, nothing has created BAMBU_DATA_DIR yet
+        os.makedirs(directory, exist_ok=True)
+        subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                        "-subj", "/CN=localhost", "-keyout", key, "-out", cert],
+                       check=True, capture_output=True)
+    return cert, key
+
+class FTPSStandIn:
+    """Implicit TLS FTP server over a local directory, with just what printers
+    offer and the job file reader uses: login, PROT P, PASV, SIZE, REST and RETR."""
+
+    def __init__(self, root, cert, key, access_code="stand-in", host="127.0.0.1", port=0):
+        self.root = root
+        self.access_code = access_code
+        self.context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        self.context.load_cert_chain(cert, key)
+        self.listener = socket.create_server((host, port))
+        self.host, self.port = self.listener.getsockname()[:2]
+        self.bytes_sent = 0
+        self.retrievals = 0
+
+    def start(self):
+        threading.Thread(target=self.serve, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.listener.close()
+
+    def serve(self):
+        while True:
+            try:
+                conn, _ = self.listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.session, args=(conn,), daemon=True).start()
+
+    def session(self, conn):
+        try:
+            conn = self.context.wrap_socket(conn, server_side=True)
+            control = conn.makefile("rwb", buffering=0)
+        except (OSError, ssl.SSLError):
+            conn.close()
+            return
+
+        def reply(text):
+            control.write(text.encode() + b"\r\n")
+
+        reply("220 stand-in FTPS ready")
+        passive = None
+        rest = 0
+        logged_in = False
+        try:
+            for line in control:
+                command, _, argument = line.decode().strip().partition(" ")
+                command = command.upper()
+                if command == "USER":
+                    reply("331 Password required")
+                elif command == "PASS":
+                    logged_in = argument == self.access_code
+                    reply("230 Logged in" if logged_in else "530 Login incorrect")
+                elif not logged_in:
+                    reply("530 Not logged in")
+                elif command in ("PBSZ", "PROT", "TYPE"):
+                    reply("200 OK")
+                elif command == "SIZE":
+                    path = self.resolve(argument)
+                    reply(f"213 {os.path.getsize(path)}" if path else "550 No such file")
+                elif command == "REST":
+                    rest = int(argument)
+                    reply(f"350 Restarting at {rest}")
+                elif command == "PASV":
+                    passive = socket.create_server((self.host, 0))
+                    port = passive.getsockname()[1]
+                    reply(f"227 Entering Passive Mode ({self.host.replace('.', ',')},{port >> 8},{port & 255})")
+                elif command == "RETR":
+                    path = self.resolve(argument)
+                    if not path or passive is None:
+                        reply("550 No such file")
+                        continue
+                    reply("150 Opening data connection")
+                    data, _ = passive.accept()
+                    passive.close()
+                    passive = None
+                    complete = self.send_file(data, path, rest)
+                    rest = 0
+                    reply("226 Transfer complete" if complete else "426 Transfer aborted")
+                elif command == "QUIT":
+                    reply("221 Bye")
+                    break
+                else:
+                    reply("502 Not implemented")
+        except (OSError, ssl.SSLError, ValueError):
+            pass
+        finally:
+            conn.close()
+
+    def resolve(self, path):
+        full = os.path.realpath(os.path.join(self.root, path.lstrip("/")))
+        if full.startswith(os.path.realpath(self.root)) and os.path.isfile(full):
+            return full
+        return None
+
+    def send_file(self, data, path, rest):
+        self.retrievals += 1
+        try:
+            data = self.context.wrap_socket(data, server_side=True)
+            with open(path, "rb") as f:
+                f.seek(rest)
+                while True:
+                    chunk = f.read(65536)
+                    if not chunk:
+                        break
+                    data.sendall(chunk)
+                    self.bytes_sent += len(chunk)
+            return True
+        except (OSError, ssl.SSLError):
+            # The client stops reading once it has the range it needs
+            return False
+        finally:
+            data.close()
+
+def start_standins(filament_ids=("GFA00",), weight_per_filament=10.0, spool_count=None, filament_count=None,
+                   task_count=0, slicer_filament_count=0, latency=0.0, error_rate=0.0, seed=0):
+    """Start both stand-ins and point this process at them.
+
+    BAMBU_DATA_DIR must already be a scratch directory: credentials and the
+    filament mapping are written there. Filament i is mapped to spool i + 1.
+    """
+    import BambuCloud.login
+    import BambuCloud.projects
+    import BambuCloud.slicer_filament
+    from tools import SaveNewToken
+    from Filament.mapping_store import mapping_store
+
+    options = {"latency": latency, "error_rate": error_rate, "seed": seed}
+    cloud = CloudStandIn(filament_ids, weight_per_filament, task_count, slicer_filament_count, **options).server.start()
+    spoolman = SpoolmanStandIn(spool_count or len(filament_ids), filament_count=filament_count,
+                               **options).server.start()
+    BambuCloud.projects.BASE_URL = cloud.url + "/v1"
+    BambuCloud.slicer_filament.URL = (cloud.url + "/v1/iot-service/api/slicer/setting?version="
+                                      + BambuCloud.slicer_filament.slicer_version)
+    BambuCloud.login.LOGIN_URL = cloud.url + "/v1/user-service/user/login"
+    BambuCloud.login.SEND_CODE_URL = cloud.url + "/v1/user-service/user/sendemail/code"
+    BambuCloud.login.TEST_URL = cloud.url + "/v1/iot-service/api/user/bind"
+    host, port = spoolman.server_address[:2]
+    SaveNewToken("access_token", "stand-in")
+    SaveNewToken("spoolman_ip", host)
+    SaveNewToken("spoolman_port", str(port))
+    mapping_store.replace({filament_id: i + 1 for i, filament_id in enumerate(filament_ids)})
+    return cloud.app, spoolman.app
@@ -1,14 +1,13 @@
-import json
 import difflib
 import os
 import re
 from helper_logs import logger
 from tools import DATA_DIR
+from Filament.mapping_store import mapping_store
 
 # File paths
 BAMBU_FILE = os.path.join(DATA_DIR, "slicer_filaments.txt")
 SPOOLMAN_FILE = os.path.join(DATA_DIR, "spoolman_filaments.txt")
-MAPPING_FILE = os.path.join(DATA_DIR, "filament_mapping.json")
 
 def parse_filaments(filename):
     """Parses filament data from a text file."""
@@ -28,17 +27,12 @@ def parse_filaments(filename):
     return filaments
 
 def load_mappings():
-    """Loads existing filament mappings from a JSON file."""
-    try:
-        with open(MAPPING_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {}
+    """Returns a copy of the filament mappings, free to modify."""
+    return dict(mapping_store.snapshot().forward)
 
 def save_mappings(mapping):
     """Saves filament mappings to a JSON file."""
-    with open(MAPPING_FILE, "w", encoding="utf-8") as f:
-        json.dump(mapping, f, indent=4)
+    mapping_store.replace(mapping)
 
 def find_best_match(bambu_f, spoolman_filaments, used_spool_ids):
     """Finds the best match for a Bambu filament, giving highest priority to type and vendor."""
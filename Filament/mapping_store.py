@@ -0,0 +1,133 @@
+import json
+import os
+import threading
+import time
+from helper_logs import logger
+from tools import DATA_DIR
+
+MAPPING_FILE = os.path.join(DATA_DIR, "filament_mapping.json")
+# How often readers look at the file for edits made outside this process
+RELOAD_CHECK_SECONDS = 1.0
+# A mapping value is a spool id, or "filament:<id>" for a Spoolman filament
+# whose active spool is picked when usage is reported
+FILAMENT_PREFIX = "filament:"
+
+def filament_target(filament_id):
+    return f"{FILAMENT_PREFIX}{filament_id}"
+
+def target_filament(value):
+    """Spoolman filament id of a filament-level mapping value, None for a spool id."""
+    if not isinstance(value, str) or not value.startswith(FILAMENT_PREFIX):
+        return None
+    filament_id = value[len(FILAMENT_PREFIX):]
+    return int(filament_id) if filament_id.isdigit() else filament_id
+
+class MappingSnapshot:
+    """One published version of the mapping. Never modified once published:
+    writers build a new snapshot, so readers need no lock."""
+
+    __slots__ = ("forward", "reverse")
+
+    def __init__(self, forward):
+        self.forward = forward  # bambu filament id -> spoolman id
+        # Spoolman ids come back as int or str depending on who wrote them
+        self.reverse = {}
+        for bambu_id, spool_id in forward.items():
+            key = str(spool_id)
+            shared = self.reverse.get(key)
+            if shared is not None and target_filament(spool_id) is None:
+                # Only a hand-edited file gets here: set() moves a spool instead
+                logger.log_warning(f"Spool {spool_id} is mapped to both {shared} and {bambu_id}, "
+                                   f"lookups by spool give {bambu_id}; map it again to keep one")
+            self.reverse[key] = bambu_id
+
+class MappingStore:
+    """filament_mapping.json held in memory, with lookups in both directions."""
+
+    def __init__(self, path=MAPPING_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file_state = None
+        self.next_check = 0.0
+        self.current = MappingSnapshot({})
+        self._reload()
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _reload(self):
+        with self.lock:
+            state = self._stat()
+            if state == self.file_state:
+                return
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    forward = json.load(f)
+            except FileNotFoundError:
+                forward = {}
+            except (OSError, ValueError) as e:
+                # Keep what we have; a half-written file from an editor is retried next check
+                logger.log_error(f"Could not read filament mapping {self.path}: {e}")
+                return
+            self.current = MappingSnapshot(forward)
+            self.file_state = state
+
+    def snapshot(self):
+        now = time.monotonic()
+        if now >= self.next_check:
+            self.next_check = now + RELOAD_CHECK_SECONDS
+            self._reload()
+        return self.current
+
+    def get_spool(self, bambu_id):
+        return self.snapshot().forward.get(bambu_id)
+
+    def get_bambu(self, spool_id):
+        return self.snapshot().reverse.get(str(spool_id))
+
+    def _publish(self, forward):
+        """Called with the lock held: write the file in one step, then publish."""
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(forward, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self.current = MappingSnapshot(forward)
+        self.file_state = self._stat()
+
+    def set(self, bambu_id, spool_id):
+        """Map bambu_id to spool_id, taking the spool from any other filament.
+        Returns the filament the spool was taken from, or None. Spoolman
+        filaments (filament_target) can be shared and are never taken."""
+        self.snapshot()
+        with self.lock:
+            current = self.current
+            forward = dict(current.forward)
+            previous = None
+            if target_filament(spool_id) is None:
+                previous = current.reverse.get(str(spool_id))
+            if previous is not None and previous != bambu_id:
+                del forward[previous]
+            forward[bambu_id] = spool_id
+            self._publish(forward)
+        return previous if previous != bambu_id else None
+
+    def remove(self, bambu_id):
+        self.snapshot()
+        with self.lock:
+            if bambu_id not in self.current.forward:
+                return
+            forward = dict(self.current.forward)
+            del forward[bambu_id]
+            self._publish(forward)
+
+    def replace(self, mapping):
+        with self.lock:
+            self._publish(dict(mapping))
+
+mapping_store = MappingStore()
@@ -1,36 +1,184 @@
 import socket
+import struct
 import threading
 import time
 from helper_logs import logger
-import socket
+
+try:
+    import fcntl  # Interface enumeration on Linux/macOS
+except ImportError:
+    fcntl = None
+
+try:
+    from zeroconf import ServiceInfo, Zeroconf  # Optional mDNS/DNS-SD announcement
+except ImportError:
+    Zeroconf = None
+
+WS_PORT = 12346
+DISCOVERY_PORT = 54545
+PROBE_MESSAGE = b"WS_DISCOVER"
+SERVER_PREFIX = "WS_SERVER:"
+MDNS_SERVICE_TYPE = "_bambuspoolman._tcp.local."
+
+# Unsolicited broadcasts are only a fallback for clients that do not probe
+FALLBACK_BROADCAST_INTERVAL = 60
+
+SIOCGIFADDR = 0x8915
+SIOCGIFBRDADDR = 0x8919
+
+def _ioctl_ipv4(sock, ifname, request):
+    packed = struct.pack("256s", ifname.encode()[:15])
+    return socket.inet_ntoa(fcntl.ioctl(sock.fileno(), request, packed)[20:24])
+
+def get_interfaces():
+    """List (ip, broadcast) for every non-loopback IPv4 interface."""
+    interfaces = []
+    if fcntl is not None and hasattr(socket, "if_nameindex"):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            for _, ifname in socket.if_nameindex():
+                try:
+                    ip = _ioctl_ipv4(sock, ifname, SIOCGIFADDR)
+                except OSError:
+                    continue  # Interface without IPv4 address
+                if ip.startswith("127."):
+                    continue
+                try:
+                    broadcast = _ioctl_ipv4(sock, ifname, SIOCGIFBRDADDR)
+                except OSError:
+                    broadcast = None
+                interfaces.append((ip, broadcast or "255.255.255.255"))
+        finally:
+            sock.close()
+    if not interfaces:
+        try:
+            for info in socket.getaddrinfo(socket.gethostname(), None, socket.AF_INET):
+                ip = info[4][0]
+                if not ip.startswith("127.") and (ip, "255.255.255.255") not in interfaces:
+                    interfaces.append((ip, "255.255.255.255"))
+        except socket.gaierror:
+            pass
+    return interfaces
 
 def get_local_ip():
-    # Método robusto para obtener IP local
+    """Best guess of the LAN address, without needing a route to the internet."""
+    interfaces = get_interfaces()
+    if interfaces:
+        return interfaces[0][0]
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     try:
         s.connect(("8.8.8.8", 80))
         return s.getsockname()[0]
+    except OSError:
+        return "127.0.0.1"
     finally:
         s.close()
 
-def broadcast_server_ip(port=12346, broadcast_port=54545):
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+def get_reply_ip(client_ip):
+    """Address of the interface that routes to the client that probed us."""
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        # connect() on UDP only selects the route, nothing is sent
+        s.connect((client_ip, DISCOVERY_PORT))
+        return s.getsockname()[0]
+    except OSError:
+        return get_local_ip()
+    finally:
+        s.close()
+
+def server_message(ip, port=WS_PORT):
+    return f"{SERVER_PREFIX}{ip}:{port}".encode()
+
+class DiscoveryResponder:
+    """Answers client probes immediately and broadcasts rarely as a fallback."""
+
+    def __init__(self, port=WS_PORT, discovery_port=DISCOVERY_PORT,
+                 broadcast_interval=FALLBACK_BROADCAST_INTERVAL):
+        self.port = port
+        self.discovery_port = discovery_port
+        self.broadcast_interval = broadcast_interval
+        self.sock = None
+        self.zeroconf = None
+
+    def open_socket(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, "SO_REUSEPORT"):
+            # Lets a GUI client on the same host bind the discovery port too
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        sock.bind(("", self.discovery_port))
+        return sock
 
-    local_ip = get_local_ip()
-    port = 12346
+    def broadcast(self):
+        for ip, broadcast in get_interfaces():
+            try:
+                self.sock.sendto(server_message(ip, self.port), (broadcast, self.discovery_port))
+            except OSError as e:
+                logger.log_warning(f"Autodiscover: broadcast on {ip} failed: {e}")
 
-    message = f'WS_SERVER:{local_ip}:{port}'
-    logger.log_info(f"Autodiscover: {message}")
-    while True:
+    def announce_mdns(self):
+        if Zeroconf is None:
+            return
         try:
-            sock.sendto(message.encode(), ('<broadcast>', broadcast_port))
+            addresses = [socket.inet_aton(ip) for ip, _ in get_interfaces()]
+            info = ServiceInfo(
+                MDNS_SERVICE_TYPE,
+                f"Bambulab Spoolman on {socket.gethostname()}.{MDNS_SERVICE_TYPE}",
+                addresses=addresses,
+                port=self.port,
+                properties={"path": "/"},
+            )
+            self.zeroconf = Zeroconf()
+            self.zeroconf.register_service(info)
+            logger.log_info("Autodiscover: mDNS service registered")
         except Exception as e:
-            print(f"Broadcast error: {e}")
-        time.sleep(5)
+            logger.log_error(f"mDNS announcement failed: {e}")
 
-# Start broadcasting in another thread
+    def serve_forever(self):
+        self.sock = self.open_socket()
+        self.sock.settimeout(self.broadcast_interval)
+        logger.log_info(f"Autodiscover: answering probes on UDP {self.discovery_port} "
+                        f"for {[ip for ip, _ in get_interfaces()]}")
+        self.announce_mdns()
+        self.broadcast()
+        next_broadcast = time.monotonic() + self.broadcast_interval
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(512)
+                if data.strip() == PROBE_MESSAGE:
+                    self.sock.sendto(server_message(get_reply_ip(addr[0]), self.port), addr)
+            except socket.timeout:
+                pass
+            except OSError as e:
+                logger.log_error(f"Autodiscover: discovery socket error: {e}")
+                time.sleep(1)
+            now = time.monotonic()
+            if now >= next_broadcast:
+                self.broadcast()
+                next_broadcast = now + self.broadcast_interval
+            self.sock.settimeout(max(next_broadcast - now, 0.1))
+
+def discover_server(timeout=1.0, discovery_port=DISCOVERY_PORT):
+    """Client side probe, returns 'ip:port' of the first server that answers."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    sock.settimeout(timeout)
+    try:
+        sock.sendto(PROBE_MESSAGE, ("255.255.255.255", discovery_port))
+        while True:
+            data, _ = sock.recvfrom(512)
+            message = data.decode(errors="ignore")
+            if message.startswith(SERVER_PREFIX):
+                return message[len(SERVER_PREFIX):]
+    except socket.timeout:
+        return None
+    finally:
+        sock.close()
+
+# Start the discovery responder in another thread
 def start_broadcast_thread():
-    t = threading.Thread(target=broadcast_server_ip, daemon=True)
+    responder = DiscoveryResponder()
+    t = threading.Thread(target=responder.serve_forever, daemon=True)
     t.start()
-
+    return responder
@@ -1,24 +1,237 @@
+import gzip
+import hashlib
 import http.server
-import socketserver
-import webbrowser
-import threading
+import mimetypes
 import os
+import posixpath
+import re
+import threading
+from urllib.parse import unquote, urlsplit
+from helper_logs import logger
+from Metrics.metrics import registry
+from Metrics.profiling import profiler
+
+try:
+    import brotli  # Optional, only used when installed
+except ImportError:
+    brotli = None
 
 PORT = 2323
 # Should point to the *folder*, not the index.html file
 DIRECTORY = "Gui/bambulab_spoolman/build/web"
 
-class Handler(http.server.SimpleHTTPRequestHandler):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, directory=DIRECTORY, **kwargs)
+# Files whose name carries a content hash never change under the same URL
+HASHED_NAME = re.compile(r"[.-][0-9a-f]{8,}\.[A-Za-z0-9]+$")
+LONG_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+COMPRESSIBLE = (".html", ".js", ".mjs", ".json", ".css", ".wasm", ".otf", ".ttf",
+                ".frag", ".symbols", ".txt", ".svg", ".bin")
+MIN_COMPRESS_SIZE = 1024
+
+mimetypes.add_type("application/wasm", ".wasm")
+mimetypes.add_type("application/javascript", ".mjs")
+mimetypes.add_type("font/otf", ".otf")
+mimetypes.add_type("font/ttf", ".ttf")
+
+class CachedFile:
+    """One static file held in memory with its compressed variants."""
+
+    def __init__(self, path, stat):
+        with open(path, "rb") as f:
+            body = f.read()
+        self.mtime = stat.st_mtime_ns
+        self.size = stat.st_size
+        self.content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        digest = hashlib.sha1(body).hexdigest()
+        # Every representation needs its own strong ETag
+        self.variants = {"identity": (body, f'"{digest}"')}
+
+        if path.endswith(COMPRESSIBLE) and len(body) >= MIN_COMPRESS_SIZE:
+            gz = _read_sibling(path + ".gz", stat) or gzip.compress(body, compresslevel=9, mtime=0)
+            if len(gz) < len(body):
+                self.variants["gzip"] = (gz, f'"{digest}-gz"')
+            br = _read_sibling(path + ".br", stat)
+            if br is None and brotli is not None:
+                br = brotli.compress(body)
+            if br is not None and len(br) < len(body):
+                self.variants["br"] = (br, f'"{digest}-br"')
+
+        if HASHED_NAME.search(os.path.basename(path)):
+            self.cache_control = LONG_CACHE
+        else:
+            self.cache_control = REVALIDATE
+
+def _read_sibling(path, stat):
+    """Use a precompressed file shipped next to the original, if it is current."""
+    try:
+        if os.stat(path).st_mtime_ns >= stat.st_mtime_ns:
+            with open(path, "rb") as f:
+                return f.read()
+    except OSError:
+        pass
+    return None
+
+class FileCache:
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+        self.lock = threading.Lock()
+        self.files = {}
+        self.loading = {}  # path -> lock held while that file is read and compressed
+
+    def resolve(self, url_path):
+        """Map a URL path to a file inside the served directory, or None."""
+        path = posixpath.normpath(unquote(url_path))
+        parts = [p for p in path.split("/") if p and p not in (".", "..")]
+        full_path = os.path.join(self.directory, *parts)
+        if os.path.isdir(full_path):
+            full_path = os.path.join(full_path, "index.html")
+        if not full_path.startswith(self.directory):
+            return None
+        return full_path
+
+    def get(self, full_path):
+        try:
+            stat = os.stat(full_path)
+        except OSError:
+            return None
+        cached = self.files.get(full_path)
+        # Reload when the build output changed on disk
+        if cached is None or cached.mtime != stat.st_mtime_ns or cached.size != stat.st_size:
+            with self.lock:
+                loading = self.loading.setdefault(full_path, threading.Lock())
+            # Compressing a large bundle takes seconds: only requests for this file wait
+            with loading:
+                cached = self.files.get(full_path)
+                if cached is None or cached.mtime != stat.st_mtime_ns or cached.size != stat.st_size:
+                    cached = CachedFile(full_path, stat)
+                    with self.lock:
+                        self.files[full_path] = cached
+        return cached
+
+def accepted_encodings(header):
+    """Encodings from an Accept-Encoding header that are not refused with q=0."""
+    accepted = set()
+    for item in (header or "").split(","):
+        token, _, params = item.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(token)
+    return accepted
+
+file_cache = FileCache(DIRECTORY)
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.serve(send_body=True)
+
+    def do_HEAD(self):
+        self.serve(send_body=False)
+
+    def serve(self, send_body):
+        url_path = urlsplit(self.path).path
+        if url_path == "/metrics":
+            self.serve_metrics(send_body)
+            return
+        if url_path.startswith("/profiles/"):
+            self.serve_profile(url_path[len("/profiles/"):], send_body)
+            return
+        full_path = file_cache.resolve(url_path)
+        cached = file_cache.get(full_path) if full_path else None
+        if cached is None:
+            self.send_error(404, "File not found")
+            return
+
+        accepted = accepted_encodings(self.headers.get("Accept-Encoding"))
+        encoding = "identity"
+        if "br" in accepted and "br" in cached.variants:
+            encoding = "br"
+        elif ("gzip" in accepted or "*" in accepted) and "gzip" in cached.variants:
+            encoding = "gzip"
+        body, etag = cached.variants[encoding]
+
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match:
+            tags = {t.strip().removeprefix("W/") for t in if_none_match.split(",")}
+            # Only the variant being served: a cached gzip body is no match for br
+            if "*" in tags or etag in tags:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Cache-Control", cached.cache_control)
+                self.send_header("Vary", "Accept-Encoding")
+                self.end_headers()
+                return
+
+        self.send_response(200)
+        self.send_header("Content-Type", cached.content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if encoding != "identity":
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", cached.cache_control)
+        self.send_header("Vary", "Accept-Encoding")
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def serve_metrics(self, send_body):
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def serve_profile(self, name, send_body):
+        # Returns None when profiling is disabled, so nothing leaks by default
+        body = profiler.ReadFile(unquote(name))
+        if body is None:
+            self.send_error(404, "File not found")
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Disposition", f'attachment; filename="{unquote(name)}"')
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
 
     def log_message(self, format, *args):
         pass  # Suppress logs if desired
 
+class WebServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
 def start_server():
-    with socketserver.TCPServer(("0.0.0.0", PORT), Handler) as httpd:
+    with WebServer(("0.0.0.0", PORT), Handler) as httpd:
         print(f"Serving Flutter web app at http://127.0.0.1:{PORT}")
         httpd.serve_forever()
 
 def start_thread():
     threading.Thread(target=start_server, daemon=True).start()
+    threading.Thread(target=warm_cache, daemon=True).start()
+
+def warm_cache():
+    """Load the files every page view needs so the first visitor does not pay for it."""
+    for name in ("index.html", "flutter_bootstrap.js", "flutter.js", "main.dart.js",
+                 "canvaskit/canvaskit.js", "canvaskit/canvaskit.wasm"):
+        full_path = file_cache.resolve(name)
+        if full_path and os.path.exists(full_path):
+            try:
+                file_cache.get(full_path)
+            except OSError as e:
+                logger.log_error(f"Could not cache {name}: {e}")
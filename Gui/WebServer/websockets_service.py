@@ -9,36 +9,46 @@ from BambuCloud.login import *
 import BambuCloud.slicer_filament
 import Spoolman.spoolman_filament
 from Filament.filament import *
+from Filament.mapping_store import mapping_store, filament_target
+from Analytics.usage_stats import usage_stats
+from Scheduler.sync_scheduler import sync_scheduler
+from Metrics.metrics import matching_seconds, websocket_clients, websocket_messages
+from Metrics.profiling import profiler, profiled_section, ProfilingDisabled
+from BambuPrinter.printer_registry import printer_registry
+from Spoolman.usage_outbox import usage_outbox
+from Spoolman.spoolman_filament import spool_inventory
+from Spoolman.spoolman_feed import spoolman_feed
+
+# Printer fields pushed to the GUI as soon as they change
+LIVE_FIELDS = ("gcode_state", "stg_cur", "mc_percent", "mc_remaining_time", "layer_num",
+               "total_layer_num", "task_id", "subtask_name")
 
 def get_filaments_data():
-    # Try to update the filament lists
-    filaments = BambuCloud.slicer_filament.GetSlicerFilaments()
-    filaments = BambuCloud.slicer_filament.ProcessSlicerFilament(filaments)
-    if filaments:
-        BambuCloud.slicer_filament.SaveFilamentsToFile(filaments)
-
-    # Save Filaments From Spoolman
-    filaments = Spoolman.spoolman_filament.GetSpoolmanFilaments()
-    filaments = Spoolman.spoolman_filament.ProcessSpoolmanFilament(filaments)
-    if filaments:
-        Spoolman.spoolman_filament.SaveFilamentsToFile(filaments)
+    # Try to update the filament lists (both sources at once). The change
+    # feed already keeps the Spoolman list current while it is subscribed.
+    if spoolman_feed.IsLive():
+        sync_scheduler.RunNow("bambu")
+    else:
+        sync_scheduler.RunNow()
 
     bambu_filaments = parse_filaments(BAMBU_FILE)
     spoolman_filaments = parse_filaments(SPOOLMAN_FILE)
-    mappings = load_mappings()
+    snapshot = mapping_store.snapshot()
+    mappings = snapshot.forward
 
-    used_spool_ids = set(mappings.values())
+    used_spool_ids = snapshot.reverse.keys()
     pending_filaments = [f for f in bambu_filaments.values() if f["id"] not in mappings]
 
     # Compute possible matches for unmapped filaments
     possible_matches = {}
-    for bambu in pending_filaments:
-        match = find_best_match(bambu, spoolman_filaments, used_spool_ids)
-        if match:
-            possible_matches[bambu["id"]] = [spoolman_filaments[match]["id"]]
-        else:
-            # fallback: return all unused spoolman IDs
-            possible_matches[bambu["id"]] = [f["id"] for f in spoolman_filaments.values() if f["id"] not in used_spool_ids]
+    with matching_seconds.time():
+        for bambu in pending_filaments:
+            match = find_best_match(bambu, spoolman_filaments, used_spool_ids)
+            if match:
+                possible_matches[bambu["id"]] = [spoolman_filaments[match]["id"]]
+            else:
+                # fallback: return all unused spoolman IDs
+                possible_matches[bambu["id"]] = [f["id"] for f in spoolman_filaments.values() if f["id"] not in used_spool_ids]
 
     return {
         "type": "filaments_data",
@@ -46,15 +56,30 @@ def get_filaments_data():
             "bambuFilaments": list(bambu_filaments.values()),
             "spoolmanFilaments": list(spoolman_filaments.values()),
             "mappings": mappings,
-            "possibleMatches": possible_matches
+            "possibleMatches": possible_matches,
+            # Targets for filament-level mappings ("filament:<id>")
+            "spoolmanFilamentGroups": spool_inventory.Filaments()
         }
     }
 
+def command_name(message):
+    """Command label for metrics: the plain string command or the JSON type."""
+    if isinstance(message, str) and message.startswith("{"):
+        try:
+            return str(json.loads(message).get("type", "json"))
+        except (json.JSONDecodeError, AttributeError):
+            return "invalid"
+    if isinstance(message, str) and len(message) <= 40 and message.replace("_", "").isalpha():
+        return message
+    return "other"
+
 class WebSocketService:
     def __init__(self, host='localhost', port=12346):
         self.host = host
         self.port = port
         self.connected_clients = set()
+        self.loop = None
+        websocket_clients.set_function(lambda: len(self.connected_clients))
 
     def load_tasks_from_file(self, path=None):
         if path is None:
@@ -78,11 +103,28 @@ class WebSocketService:
             print(f"Error reading logs file: {e}")
             return []    
 
+    def handle_profiling(self, data):
+        """Admin commands for on-demand profiling. Result files are downloadable from /profiles/<name>."""
+        payload = data.get("payload") or {}
+        try:
+            if data["type"] == "profile_start":
+                result = profiler.Start(payload.get("seconds", 30), payload.get("mode", "sampling"))
+            elif data["type"] == "profile_stop":
+                result = {"files": profiler.Stop()}
+            elif data["type"] == "memory_snapshot":
+                result = profiler.MemorySnapshot(stop=bool(payload.get("stop")))
+            else:
+                result = profiler.Status()
+        except (ProfilingDisabled, ValueError, RuntimeError) as e:
+            return {"type": "profiling_error", "payload": str(e)}
+        return {"type": "profiling", "payload": result}
+
     async def handle_client(self, websocket):
         self.connected_clients.add(websocket)
         try:
             async for message in websocket:
                 print(f"Received: {message}")
+                websocket_messages.inc(command_name(message))
 
                 # ---------- SIMPLE STRING COMMANDS ----------
                 if message == "get_tasks":
@@ -100,6 +142,11 @@ class WebSocketService:
 
                 if message == "get_local_settings":
                     credentials = ReadCredentials()
+                    printers = [
+                        {"printer_id": dev_id, "name": settings.get("name", dev_id),
+                         "printer_ip": settings.get("printer_ip", "")}
+                        for dev_id, settings in ReadPrinters().items()
+                    ]
 
                     printer_ip = credentials.get('DEFAULT', 'printer_ip', fallback=None)
                     if not (printer_ip and IsValidIp(printer_ip)):
@@ -113,7 +160,8 @@ class WebSocketService:
                         "payload": {
                             "printer_ip": printer_ip,
                             "spoolman_ip": spoolman_ip,
-                            "spoolman_port": spoolman_port
+                            "spoolman_port": spoolman_port,
+                            "printers": printers
                         }
                     }
                     await websocket.send(json.dumps(response))
@@ -134,8 +182,63 @@ class WebSocketService:
                     }
                     await websocket.send(json.dumps(response))
                     continue
+                if message == "get_usage_stats":
+                    response = {"type": "usage_stats", "payload": usage_stats.GetStats()}
+                    await websocket.send(json.dumps(response))
+                    continue
+
+                if message == "rebuild_usage_stats":
+                    stats = await asyncio.to_thread(usage_stats.Rebuild)
+                    response = {"type": "usage_stats", "payload": stats}
+                    await websocket.send(json.dumps(response))
+                    continue
+
+                if message == "get_sync_status":
+                    response = {"type": "sync_status", "payload": sync_scheduler.GetStatus()}
+                    await websocket.send(json.dumps(response))
+                    continue
+
+                if message == "force_sync":
+                    sync_scheduler.RequestSync()
+                    response = {"type": "sync_status", "payload": sync_scheduler.GetStatus()}
+                    await websocket.send(json.dumps(response))
+                    continue
+
+                if message == "get_startup_profile":
+                    from startup_profile import startup_profile
+                    response = {"type": "startup_profile", "payload": startup_profile.as_dict()}
+                    await websocket.send(json.dumps(response))
+                    continue
+
+                if message == "get_printer_state":
+                    payload = {printer.dev_id: printer.state.Subset(LIVE_FIELDS) for printer in printer_registry.All()}
+                    response = {"type": "printer_state", "payload": payload}
+                    await websocket.send(json.dumps(response))
+                    continue
+
+                if message == "get_printers":
+                    response = {"type": "printers", "payload": self.list_printers()}
+                    await websocket.send(json.dumps(response))
+                    continue
+
+                if message == "get_ingest_status":
+                    response = {"type": "ingest_status", "payload": ingest_queue.Status()}
+                    await websocket.send(json.dumps(response))
+                    continue
+
+                if message == "get_outbox_status":
+                    response = {"type": "outbox_status", "payload": usage_outbox.Status()}
+                    await websocket.send(json.dumps(response))
+                    continue
+
+                if message == "get_spoolman_status":
+                    payload = {"inventory": spool_inventory.Status(), "feed": spoolman_feed.Status()}
+                    await websocket.send(json.dumps({"type": "spoolman_status", "payload": payload}))
+                    continue
+
                 if message == "get_filaments":
-                    response = get_filaments_data()
+                    with profiled_section():
+                        response = get_filaments_data()
                     await websocket.send(json.dumps(response))
 
                 # ---------- JSON COMMANDS ----------
@@ -145,14 +248,20 @@ class WebSocketService:
                     if data.get("type") == "update_local_settings":
                         payload = data.get("payload", {})
 
+                        printer_id = payload.get("printer_id")
                         printer_ip = payload.get("printer_ip", "")
                         spoolman_ip = payload.get("spoolman_ip", "")
                         spoolman_port = str(payload.get("spoolman_port", 0))
 
-                        SaveNewToken("printer_ip", printer_ip)
+                        # Without printer_id the single-printer settings are updated, as before
+                        if printer_id:
+                            SavePrinterSetting(printer_id, "printer_ip", printer_ip)
+                        else:
+                            SaveNewToken("printer_ip", printer_ip)
                         SaveNewToken("spoolman_ip", spoolman_ip)
                         SaveNewToken("spoolman_port", spoolman_port)
                         StartMQTT()
+                        sync_scheduler.RequestSync("spoolman")
 
                         print("⚙️ Settings updated:",
                             printer_ip, spoolman_ip, spoolman_port)
@@ -179,6 +288,7 @@ class WebSocketService:
                             if TestToken():
                                 print("BambuCloud login successful")
                                 StartMQTT()
+                                sync_scheduler.RequestSync("bambu")
                             else:
                                 print("BambuCloud login failed after obtaining token")
                                 result = LOGIN_BAD_CREDENTIALS
@@ -190,35 +300,46 @@ class WebSocketService:
 
                         await websocket.send(json.dumps(response))
                     
+                    elif data.get("type") == "get_printer_state":
+                        printer = printer_registry.Get(data.get("payload", {}).get("printer_id"))
+                        if printer:
+                            response = {"type": "printer_state",
+                                        "payload": {printer.dev_id: printer.state.Subset(LIVE_FIELDS)}}
+                        else:
+                            response = {"type": "printer_state_failed", "payload": "Unknown printer_id"}
+                        await websocket.send(json.dumps(response))
+
+                    elif data.get("type") == "get_tasks":
+                        printer_id = data.get("payload", {}).get("printer_id")
+                        tasks = self.load_tasks_from_file()
+                        if printer_id:
+                            tasks = [t for t in tasks if t.get("printer_id") == printer_id]
+                        response = {"type": "tasks", "payload": tasks}
+                        await websocket.send(json.dumps(response))
+
+                    elif data.get("type") in ("profile_start", "profile_stop", "profile_status", "memory_snapshot"):
+                        response = await asyncio.to_thread(self.handle_profiling, data)
+                        await websocket.send(json.dumps(response))
+
                     elif data.get("type") == "update_mapping":
                         payload = data.get("payload", {})
                         bambu_id = payload.get("bambu_id")
                         spoolman_id = payload.get("spoolman_id")
+                        if payload.get("spoolman_filament_id") is not None:
+                            # Charge whichever spool of that filament is active
+                            spoolman_id = filament_target(payload["spoolman_filament_id"])
 
                         if bambu_id:
-                            mappings = load_mappings()
-                            
-                            # If spoolman_id is provided, we map.
+                            # If spoolman_id is provided, we map. A spool used by another
+                            # bambu_id is taken from it (aka "stolen").
                             if spoolman_id:
-                                # Check if the spoolman_id is already used by another bambu_id
-                                old_bambu_id = None
-                                for key, value in mappings.items():
-                                    if value == spoolman_id:
-                                        old_bambu_id = key
-                                        break
-                                
-                                # If it was used, remove the old mapping (aka "steal" it)
-                                if old_bambu_id and old_bambu_id != bambu_id:
+                                old_bambu_id = mapping_store.set(bambu_id, spoolman_id)
+                                if old_bambu_id:
                                     print(f"Stole spoolman_id {spoolman_id} from {old_bambu_id} for {bambu_id}")
-                                    del mappings[old_bambu_id]
-
-                                mappings[bambu_id] = spoolman_id
                             
                             # If spoolman_id is null, we unmap.
-                            elif bambu_id in mappings:
-                                del mappings[bambu_id]
-                            
-                            save_mappings(mappings)
+                            else:
+                                mapping_store.remove(bambu_id)
                             
                             print(f"✔️ Filament mapping updated: {bambu_id} -> {spoolman_id}")
 
@@ -237,7 +358,32 @@ class WebSocketService:
         finally:
             self.connected_clients.remove(websocket)
 
+    def broadcast(self, message_type, payload):
+        """Send an event to every connected client. Safe to call from any thread."""
+        if self.loop is None or not self.connected_clients:
+            return
+        message = json.dumps({"type": message_type, "payload": payload})
+        self.loop.call_soon_threadsafe(websockets.broadcast, set(self.connected_clients), message)
+
+    def list_printers(self):
+        printers = []
+        for printer in printer_registry.All():
+            entry = {"printer_id": printer.dev_id, "name": printer.name}
+            entry.update(GetConnectionStatus(printer.dev_id))
+            entry["state"] = printer.state.Subset(LIVE_FIELDS)
+            entry["ams"] = printer.ams.Snapshot()
+            printers.append(entry)
+        return printers
+
+    def push_printer_state(self, changed, printer):
+        if not self.connected_clients:
+            return
+        fields = changed.intersection(LIVE_FIELDS)
+        if fields:
+            self.broadcast("printer_state", {printer.dev_id: printer.state.Subset(fields)})
+
     async def start_server(self):
+        self.loop = asyncio.get_running_loop()
         server = await websockets.serve(self.handle_client, self.host, self.port)
         print(f"WebSocket server started on ws://{self.host}:{self.port}")
         await server.wait_closed()
@@ -245,9 +391,21 @@ class WebSocketService:
     def run_server(self):
         asyncio.run(self.start_server())
 
+ws_service = None
+
+def broadcast_event(message_type, payload):
+    if ws_service is not None:
+        ws_service.broadcast(message_type, payload)
+
 # Wrapper to start in thread
 def start_websocket_server():
+    global ws_service
     ws_service = WebSocketService(host='0.0.0.0', port=12346)
+    printer_registry.AddCreateListener(
+        lambda printer: printer.AddChangeListener(ws_service.push_printer_state, LIVE_FIELDS))
+    AddConnectionListener(lambda status: ws_service.broadcast("printer_connection", status))
+    spool_inventory.AddChangeListener(
+        lambda updated, removed: ws_service.broadcast("spoolman_spools", {"updated": updated, "removed": removed}))
     websocket_thread = threading.Thread(target=ws_service.run_server)
     websocket_thread.daemon = True
     websocket_thread.start()
@@ -6,7 +6,8 @@ import 'package:bambulab_spoolman/data/web_socket_service.dart';
 class FilamentMappingModel extends ChangeNotifier {
   List<BambuFilament> bambuFilaments = [];
   List<SpoolmanFilament> spoolmanFilaments = [];
-  Map<String, String> mapping = {}; // BambuID -> SpoolmanID
+  List<SpoolmanFilamentGroup> spoolmanFilamentGroups = [];
+  Map<String, String> mapping = {}; // BambuID -> SpoolmanID, or "filament:<id>" for any spool of a filament
   Map<String, List<String>> possibleMatches = {}; // BambuID -> suggested spool IDs
   bool isLoading = false;
 
@@ -45,7 +46,13 @@ class FilamentMappingModel extends ChangeNotifier {
         .map((e) => SpoolmanFilament.fromJson(e))
         .toList();
 
-    final mappings = Map<String, String>.from(payload['mappings']);
+    final groups = ((payload['spoolmanFilamentGroups'] ?? []) as List)
+        .map((e) => SpoolmanFilamentGroup.fromJson(e))
+        .toList();
+
+    final mappings = (payload['mappings'] as Map).map(
+      (k, v) => MapEntry(k.toString(), v.toString()),
+    );
     
     final matches = (payload['possibleMatches'] as Map).map(
       (k, v) => MapEntry(k.toString(), List<String>.from(v)),
@@ -54,6 +61,7 @@ class FilamentMappingModel extends ChangeNotifier {
     updateFilaments(
       bambuFilaments: bambu,
       spoolmanFilaments: spoolman,
+      spoolmanFilamentGroups: groups,
       mappings: mappings,
       possibleMatches: matches,
     );
@@ -64,6 +72,30 @@ class FilamentMappingModel extends ChangeNotifier {
 
   String? getMappedSpoolman(String bambuId) => mapping[bambuId];
 
+  /// The Spoolman filament of a "filament:<id>" mapping value, null for a spool id.
+  SpoolmanFilamentGroup? groupForTarget(String? value) {
+    if (value == null || !value.startsWith(SpoolmanFilamentGroup.prefix)) {
+      return null;
+    }
+    final id = value.substring(SpoolmanFilamentGroup.prefix.length);
+    return spoolmanFilamentGroups.firstWhere(
+      (g) => g.id == id,
+      orElse: () => SpoolmanFilamentGroup(id: id, name: 'Unknown', type: '', vendor: '', spoolCount: 0),
+    );
+  }
+
+  /// Charge whichever spool of a Spoolman filament is active.
+  void mapFilamentGroup(String bambuId, SpoolmanFilamentGroup group) {
+    mapping[bambuId] = group.target;
+
+    webSocketService.sendMessage(jsonEncode({
+      "type": "update_mapping",
+      "payload": {"bambu_id": bambuId, "spoolman_filament_id": group.id}
+    }));
+
+    notifyListeners();
+  }
+
   void mapFilament(String bambuId, String spoolmanId) {
     mapping[bambuId] = spoolmanId;
     
@@ -89,11 +121,13 @@ class FilamentMappingModel extends ChangeNotifier {
   void updateFilaments({
     required List<BambuFilament> bambuFilaments,
     required List<SpoolmanFilament> spoolmanFilaments,
+    List<SpoolmanFilamentGroup> spoolmanFilamentGroups = const [],
     required Map<String, String> mappings,
     required Map<String, List<String>> possibleMatches,
   }) {
     this.bambuFilaments = bambuFilaments;
     this.spoolmanFilaments = spoolmanFilaments;
+    this.spoolmanFilamentGroups = spoolmanFilamentGroups;
     this.mapping = mappings;
     this.possibleMatches = possibleMatches;
     notifyListeners();
@@ -142,3 +176,31 @@ class SpoolmanFilament {
     );
   }
 }
+
+/// A Spoolman filament with its active spools; mapping to it charges the active one.
+class SpoolmanFilamentGroup {
+  static const prefix = "filament:";
+
+  final String id;
+  final String name;
+  final String type;
+  final String vendor;
+  final int spoolCount;
+  final String? activeSpool;
+
+  SpoolmanFilamentGroup({required this.id, required this.name, required this.type, required this.vendor,
+      required this.spoolCount, this.activeSpool});
+
+  String get target => "$prefix$id";
+
+  factory SpoolmanFilamentGroup.fromJson(Map<String, dynamic> json) {
+    return SpoolmanFilamentGroup(
+      id: json['id'].toString(),
+      name: json['name'] ?? '',
+      type: json['type'] ?? '',
+      vendor: json['vendor'] ?? '',
+      spoolCount: (json['spools'] as List?)?.length ?? 0,
+      activeSpool: json['activeSpool']?.toString(),
+    );
+  }
+}
@@ -9,6 +9,8 @@ Future<String?> discoverWebSocketServer({int broadcastPort = 54545}) async {
   final receiver = await UDP.bind(Endpoint.any(port: Port(broadcastPort)));
   final timeout = DateTime.now().add(Duration(seconds: 5));
   print("Discovering....");
+  // Ask servers to answer right away instead of waiting for their fallback broadcast
+  await receiver.send('WS_DISCOVER'.codeUnits, Endpoint.broadcast(port: Port(broadcastPort)));
   await for (final datagram in receiver.asStream(timeout: Duration(seconds: 5))) {
     print("Here");
     final data = String.fromCharCodes(datagram!.data);
@@ -105,7 +105,15 @@ class _FilamentsMapViewState extends State<FilamentsMapView> with SingleTickerPr
         
         // Find the mapped spool object if it exists
         SpoolmanFilament? mappedSpool;
-        if (mappedSpoolId != null) {
+        String? mappedNote;
+        final mappedGroup = model.groupForTarget(mappedSpoolId);
+        if (mappedGroup != null) {
+          mappedSpool = SpoolmanFilament(
+            id: mappedGroup.target, name: mappedGroup.name, type: mappedGroup.type, vendor: mappedGroup.vendor);
+          mappedNote = mappedGroup.activeSpool != null
+              ? "Any spool (${mappedGroup.spoolCount}) • using #${mappedGroup.activeSpool}"
+              : "Any spool • no active spool";
+        } else if (mappedSpoolId != null) {
           mappedSpool = model.spoolmanFilaments.firstWhere(
             (s) => s.id == mappedSpoolId, 
             orElse: () => SpoolmanFilament(id: '', name: 'Unknown', type: '', vendor: '')
@@ -149,7 +157,7 @@ class _FilamentsMapViewState extends State<FilamentsMapView> with SingleTickerPr
                 if (!isMapped) ...[
                    _buildUnmappedAction(context, model, bambu),
                 ] else ...[
-                   _buildMappedAction(context, model, bambu, mappedSpool!),
+                   _buildMappedAction(context, model, bambu, mappedSpool!, note: mappedNote),
                 ]
               ],
             ),
@@ -191,10 +199,11 @@ class _FilamentsMapViewState extends State<FilamentsMapView> with SingleTickerPr
     );
   }
 
-  Widget _buildMappedAction(BuildContext context, FilamentMappingModel model, BambuFilament bambu, SpoolmanFilament spool) {
+  Widget _buildMappedAction(BuildContext context, FilamentMappingModel model, BambuFilament bambu, SpoolmanFilament spool,
+      {String? note}) {
     return Row(
       children: [
-        const Icon(Icons.inventory_2_outlined, size: 20, color: Colors.blueGrey),
+        Icon(note != null ? Icons.layers_outlined : Icons.inventory_2_outlined, size: 20, color: Colors.blueGrey),
         const SizedBox(width: 8),
         Expanded(
           child: Column(
@@ -202,6 +211,8 @@ class _FilamentsMapViewState extends State<FilamentsMapView> with SingleTickerPr
             children: [
               Text(spool.name, style: const TextStyle(fontWeight: FontWeight.w600)),
               Text("${spool.vendor} • ${spool.type}", style: const TextStyle(fontSize: 12, color: Colors.grey)),
+              if (note != null)
+                Text(note, style: const TextStyle(fontSize: 12, color: Colors.blueGrey)),
             ],
           ),
         ),
@@ -269,6 +280,10 @@ class _FilamentSelectionSheetState extends State<_FilamentSelectionSheet> {
     final suggestedSpools = filteredSpools.where((s) => suggestedIds.contains(s.id)).toList();
     final otherSpools = filteredSpools.where((s) => !suggestedIds.contains(s.id)).toList();
 
+    final filteredGroups = widget.model.spoolmanFilamentGroups.where((g) =>
+        g.name.toLowerCase().contains(_searchQuery.toLowerCase()) ||
+        g.vendor.toLowerCase().contains(_searchQuery.toLowerCase())).toList();
+
     return DraggableScrollableSheet(
       initialChildSize: 0.9,
       minChildSize: 0.5,
@@ -309,10 +324,16 @@ class _FilamentSelectionSheetState extends State<_FilamentSelectionSheet> {
                     const Divider(),
                   ],
                   
+                  if (filteredGroups.isNotEmpty) ...[
+                    _buildSectionHeader("Spoolman Filaments (any spool)", Icons.layers, Colors.teal),
+                    ...filteredGroups.map(_buildGroupTile),
+                    const Divider(),
+                  ],
+
                   _buildSectionHeader("All Inventory", Icons.list, Colors.blueGrey),
                   ...otherSpools.map((s) => _buildOptionTile(s, isSuggested: false)),
                   
-                  if (otherSpools.isEmpty && suggestedSpools.isEmpty)
+                  if (otherSpools.isEmpty && suggestedSpools.isEmpty && filteredGroups.isEmpty)
                      const Padding(
                        padding: EdgeInsets.all(20.0),
                        child: Text("No filaments found matching search."),
@@ -339,6 +360,25 @@ class _FilamentSelectionSheetState extends State<_FilamentSelectionSheet> {
     );
   }
 
+  Widget _buildGroupTile(SpoolmanFilamentGroup group) {
+    // Several slicer filaments can share a Spoolman filament, so there is no "Used" warning
+    final isCurrentSelection = widget.model.mapping[widget.bambuTarget.id] == group.target;
+
+    return ListTile(
+      leading: CircleAvatar(
+        backgroundColor: Colors.teal.shade50,
+        child: const Icon(Icons.layers, size: 18),
+      ),
+      title: Text(group.name),
+      subtitle: Text("${group.vendor} • ${group.type} • ${group.spoolCount} spool${group.spoolCount == 1 ? '' : 's'}"),
+      trailing: isCurrentSelection ? const Icon(Icons.check_circle, color: Colors.green) : null,
+      onTap: () {
+        widget.model.mapFilamentGroup(widget.bambuTarget.id, group);
+        Navigator.pop(context);
+      },
+    );
+  }
+
   Widget _buildOptionTile(SpoolmanFilament spool, {required bool isSuggested}) {
     // Check if this spool is currently mapped to THIS specific Bambu filament
     final isCurrentSelection = widget.model.mapping[widget.bambuTarget.id] == spool.id;
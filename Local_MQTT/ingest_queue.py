@@ -0,0 +1,170 @@
+import threading
+import time
+from collections import deque
+from helper_logs import logger
+from Metrics.metrics import registry, mqtt_messages, mqtt_processing_seconds
+from Metrics.profiling import profiled_section
+
+DEFAULT_SIZE = 1000
+
+# Fields that only report progress. A newer value replaces an older one that is
+# still waiting; reports with any other field are state transitions and are
+# always delivered, in order.
+TELEMETRY_FIELDS = frozenset({"mc_percent", "mc_remaining_time", "layer_num", "total_layer_num"})
+
+queue_depth = registry.gauge(
+    "bambu_mqtt_queue_depth", "Reports waiting to be processed")
+queue_high_water = registry.gauge(
+    "bambu_mqtt_queue_high_water", "Largest queue depth seen since start")
+queue_coalesced = registry.counter(
+    "bambu_mqtt_queue_coalesced_total", "Telemetry reports merged into one still waiting", ("printer",))
+queue_dropped = registry.counter(
+    "bambu_mqtt_queue_dropped_total", "Reports dropped because the printer's queue was full", ("printer",))
+queue_wait_seconds = registry.histogram(
+    "bambu_mqtt_queue_wait_seconds", "Time reports spend in the queue")
+
+class Entry:
+    __slots__ = ("printer", "fields", "msg_type", "enqueued", "parse_seconds")
+
+    def __init__(self, printer, fields, msg_type, parse_seconds):
+        self.printer = printer
+        self.fields = fields
+        self.msg_type = msg_type
+        self.enqueued = time.perf_counter()
+        self.parse_seconds = parse_seconds
+
+class Lane:
+    """The reports of one printer, in order, and the worker that applies them."""
+    __slots__ = ("entries", "pending", "cond", "thread", "overflowing")
+
+    def __init__(self, lock):
+        self.entries = deque()
+        self.pending = None  # telemetry entry that is still waiting
+        self.cond = threading.Condition(lock)
+        self.thread = None
+        self.overflowing = False
+
+class IngestQueue:
+    """Reports are parsed on the MQTT network thread and applied on a worker thread per
+    printer, so slow handlers (cloud calls, FTPS reads, Spoolman reports) never hold up
+    the sockets, and a slow printer never holds up the others.
+
+    maxsize bounds the reports waiting for each printer. Past it telemetry is dropped,
+    and a state transition makes room by dropping that printer's oldest report.
+    """
+
+    def __init__(self, maxsize=DEFAULT_SIZE):
+        self.maxsize = max(maxsize, 1)
+        self.lock = threading.Lock()
+        self.lanes = {}  # printer -> Lane
+        self.depth = 0
+        self.high_water = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.started = False
+        queue_depth.set_function(lambda: self.depth)
+        queue_high_water.set_function(lambda: self.high_water)
+
+    def Start(self):
+        with self.lock:
+            self.started = True
+            for printer, lane in self.lanes.items():
+                self._StartLane(printer, lane)
+
+    def _StartLane(self, printer, lane):
+        """Called with the lock held."""
+        if lane.thread is None:
+            lane.thread = threading.Thread(target=self.Run, args=(lane,),
+                                           name=f"mqtt-ingest-{printer.dev_id}", daemon=True)
+            lane.thread.start()
+
+    def _Drop(self, printer, lane, what):
+        """Called with the lock held."""
+        self.dropped += 1
+        queue_dropped.inc(printer.dev_id)
+        if not lane.overflowing:
+            lane.overflowing = True
+            logger.log_warning(f"MQTT {printer.dev_id}: {self.maxsize} reports waiting, "
+                               f"dropping {what} until it catches up")
+
+    def Put(self, printer, payload):
+        start = time.perf_counter()
+        fields, msg_type = printer.ParseReport(payload)
+        parse_seconds = time.perf_counter() - start
+        mqtt_messages.inc(msg_type)
+        if not fields:
+            mqtt_processing_seconds.observe(parse_seconds, msg_type)
+            return
+        telemetry = fields.keys() <= TELEMETRY_FIELDS
+        with self.lock:
+            lane = self.lanes.get(printer)
+            if lane is None:
+                lane = self.lanes[printer] = Lane(self.lock)
+                if self.started:
+                    self._StartLane(printer, lane)
+            if telemetry:
+                waiting = lane.pending
+                if waiting is not None:
+                    # Latest wins; the waiting entry keeps its place in the queue
+                    waiting.fields.update(fields)
+                    waiting.parse_seconds += parse_seconds
+                    self.coalesced += 1
+                    queue_coalesced.inc(printer.dev_id)
+                    return
+                if len(lane.entries) >= self.maxsize:
+                    self._Drop(printer, lane, "telemetry")
+                    return
+            elif len(lane.entries) >= self.maxsize:
+                oldest = lane.entries.popleft()
+                self.depth -= 1
+                if lane.pending is oldest:
+                    lane.pending = None
+                self._Drop(printer, lane, "the oldest reports")
+            entry = Entry(printer, fields, msg_type, parse_seconds)
+            lane.entries.append(entry)
+            self.depth += 1
+            if telemetry:
+                lane.pending = entry
+            else:
+                # Later telemetry must not be merged back in front of this transition
+                lane.pending = None
+            if self.depth > self.high_water:
+                self.high_water = self.depth
+            lane.cond.notify()
+
+    def Get(self, lane):
+        with self.lock:
+            while not lane.entries:
+                lane.overflowing = False
+                lane.cond.wait()
+            entry = lane.entries.popleft()
+            self.depth -= 1
+            if lane.pending is entry:
+                lane.pending = None
+            return entry
+
+    def Run(self, lane):
+        while True:
+            entry = self.Get(lane)
+            start = time.perf_counter()
+            queue_wait_seconds.observe(start - entry.enqueued)
+            try:
+                with profiled_section():
+                    entry.printer.ApplyReport(entry.fields)
+            except Exception as e:
+                logger.log_exception(e)
+            finally:
+                mqtt_processing_seconds.observe(time.perf_counter() - start + entry.parse_seconds, entry.msg_type)
+
+    def Status(self):
+        with self.lock:
+            deepest = max((len(lane.entries) for lane in self.lanes.values()), default=0)
+        return {
+            "depth": self.depth,
+            "deepest_printer": deepest,
+            "high_water": self.high_water,
+            "max_size": self.maxsize,
+            "printers": len(self.lanes),
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+        }
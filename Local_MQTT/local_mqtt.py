@@ -1,17 +1,36 @@
 import re
+import random
 import time
+import selectors
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import paho.mqtt.client as mqtt
 from helper_logs import logger
 import ssl
 import json
-import BambuPrinter.bambu_printer as bp
+from BambuPrinter.printer_registry import printer_registry
 from tools import *
+from Local_MQTT.ingest_queue import IngestQueue, DEFAULT_SIZE
+from Local_MQTT.report_recorder import recorder
+from Metrics.metrics import registry
+from Spoolman.usage_outbox import usage_outbox
 
 PORT = 8883  # MQTT over TLS
 USERNAME = "bblp"  # Fixed username for local MQTT
 
-mqtt_client = None
-current_printer_ip = None
+# Blocking TLS connects run here so one unreachable printer does not hold up the others
+connector = ThreadPoolExecutor(max_workers=4, thread_name_prefix="mqtt-connect")
+connections = {}  # dev_id -> PrinterConnection
+connections_lock = threading.Lock()
+
+def _QueueSize():
+    try:
+        return int(ReadCredentials().get('DEFAULT', 'mqtt_queue_size', fallback=DEFAULT_SIZE))
+    except ValueError:
+        return DEFAULT_SIZE
+
+ingest_queue = IngestQueue(_QueueSize())
 
 def GetPrinterIP():
     """Checks for printer_ip in credentials or prompts the user to provide one."""
@@ -55,24 +74,403 @@ def CheckMQTTConnection():
         logger.log_exception(e)
         return False
     
+class MQTTNetworkLoop:
+    """Drives the paho clients of every printer from a single thread."""
+
+    MISC_INTERVAL = 1.0  # keepalive pings and timeouts
+    # loop_read takes one packet when nothing is in flight, but a TLS record can carry
+    # several reports; the ones already decrypted never make the socket readable again
+    MAX_READS = 64
+
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.registered = {}  # PrinterConnection -> (socket, events)
+        self.connections = set()
+        self.lock = threading.Lock()
+        self.wake_r, self.wake_w = socket.socketpair()
+        self.wake_r.setblocking(False)
+        self.wake_w.setblocking(False)
+        self.selector.register(self.wake_r, selectors.EVENT_READ, None)
+        self.thread = None
+
+    def Add(self, connection):
+        with self.lock:
+            self.connections.add(connection)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.Run, name="mqtt-network", daemon=True)
+                self.thread.start()
+        self.Wake()
+
+    def Remove(self, connection):
+        with self.lock:
+            self.connections.discard(connection)
+        self.Wake()
+
+    def Wake(self):
+        """Re-evaluate sockets now, e.g. after a publish from another thread."""
+        try:
+            self.wake_w.send(b"\0")
+        except (BlockingIOError, OSError):
+            pass
+
+    def _sync_registrations(self):
+        with self.lock:
+            connections = set(self.connections)
+        for connection in list(self.registered):
+            if connection not in connections:
+                self._unregister(connection)
+        for connection in connections:
+            client = connection.client
+            try:
+                self._sync_registration(connection, client)
+            except Exception as e:
+                self._drop(connection, client, e)
+
+    def _sync_registration(self, connection, client):
+        sock = client.socket() if client else None
+        current = self.registered.get(connection)
+        if sock is None:
+            if current:
+                self._unregister(connection)
+            return
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if client.want_write() else 0)
+        if current is None or current[0] is not sock:
+            if current:
+                self._unregister(connection)
+            self.selector.register(sock, events, connection)
+            self.registered[connection] = (sock, events)
+        elif current[1] != events:
+            self.selector.modify(sock, events, connection)
+            self.registered[connection] = (sock, events)
+
+    def _unregister(self, connection):
+        sock, _ = self.registered.pop(connection)
+        try:
+            self.selector.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+
+    def _read(self, client):
+        """Read until the TLS buffer is empty. Returns True if bytes are still
+        buffered after MAX_READS packets, so the next select must not block."""
+        for _ in range(self.MAX_READS):
+            client.loop_read()
+            sock = client.socket()
+            if sock is None or not isinstance(sock, ssl.SSLSocket) or not sock.pending():
+                return False
+        return True
+
+    def _drop(self, connection, client, error):
+        """One client failed: stop serving it and let its supervisor reconnect."""
+        logger.log_exception(error)
+        if connection in self.registered:
+            self._unregister(connection)
+        connection.Failed("error", f"network loop error: {error}", client)
+
+    def Run(self):
+        next_misc = time.monotonic()
+        buffered = set()  # connections with decrypted bytes left in the TLS buffer
+        while True:
+            try:
+                self._sync_registrations()
+                for connection in list(buffered):
+                    buffered.discard(connection)
+                    client = connection.client
+                    if client is None or connection not in self.registered:
+                        continue
+                    try:
+                        if self._read(client):
+                            buffered.add(connection)
+                    except Exception as e:
+                        self._drop(connection, client, e)
+                timeout = 0 if buffered else max(next_misc - time.monotonic(), 0)
+                for key, events in self.selector.select(timeout):
+                    connection = key.data
+                    if connection is None:
+                        try:
+                            while self.wake_r.recv(4096):
+                                pass
+                        except (BlockingIOError, OSError):
+                            pass
+                        continue
+                    client = connection.client
+                    if client is None:
+                        continue
+                    try:
+                        if events & selectors.EVENT_READ:
+                            buffered.discard(connection)
+                            if self._read(client):
+                                buffered.add(connection)
+                        if events & selectors.EVENT_WRITE:
+                            client.loop_write()
+                    except Exception as e:
+                        buffered.discard(connection)
+                        self._drop(connection, client, e)
+                if time.monotonic() >= next_misc:
+                    for connection in list(self.registered):
+                        client = connection.client
+                        if client:
+                            try:
+                                client.loop_misc()
+                            except Exception as e:
+                                self._drop(connection, client, e)
+                    next_misc = time.monotonic() + self.MISC_INTERVAL
+            except Exception as e:
+                # Only the loop's own bookkeeping gets here; client errors are handled above
+                logger.log_exception(e)
+                time.sleep(1)
+
+network_loop = MQTTNetworkLoop()
+
+# Reconnect delays grow 1s, 2s, 4s ... up to BACKOFF_MAX, each shortened by up to half at random
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+CONNECT_TIMEOUT = 30.0  # TCP + TLS + CONNACK
+# Idle printers can stay quiet for minutes, so silence is first answered with a pushall probe
+STALE_AFTER = 60.0
+PROBE_TIMEOUT = 15.0
+SUPERVISOR_INTERVAL = 1.0
+
+mqtt_connected = registry.gauge(
+    "bambu_mqtt_connected", "1 while the MQTT session with the printer is up", ("printer",))
+mqtt_connect_attempts = registry.counter(
+    "bambu_mqtt_connect_attempts_total", "MQTT connection attempts, by result", ("printer", "result"))
+mqtt_disconnects = registry.counter(
+    "bambu_mqtt_disconnects_total", "MQTT sessions lost, by reason", ("printer", "reason"))
+mqtt_report_age = registry.gauge(
+    "bambu_mqtt_last_report_age_seconds", "Seconds since the last report from the printer", ("printer",))
+
+connection_listeners = []
+
+def AddConnectionListener(callback):
+    """callback(status) runs on every connection state change, from MQTT threads."""
+    connection_listeners.append(callback)
+
+def Backoff(attempts):
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** max(attempts - 1, 0))
+    return random.uniform(delay / 2, delay)
+
+class PrinterConnection:
+    """MQTT session with one printer. Network I/O happens on the shared network_loop,
+    reconnects and stale checks on the supervisor."""
+
+    def __init__(self, printer, printer_ip, access_code, port=PORT):
+        self.printer = printer
+        self.printer_ip = printer_ip
+        self.access_code = access_code
+        self.port = port
+        self.client = None
+        self.lock = threading.Lock()
+        self.state = "disconnected"
+        self.closed = False
+        self.attempts = 0  # failed attempts since the last successful connect
+        self.attempt_id = 0
+        self.next_attempt = 0.0
+        self.state_since = time.monotonic()
+        self.last_report = None
+        self.probe_sent = None
+        self.last_error = None
+        mqtt_connected.set(0, printer.dev_id)
+        mqtt_report_age.set_function(self.ReportAge, printer.dev_id)
+
+    def Matches(self, printer_ip, access_code, port):
+        return (self.printer_ip, self.access_code, self.port) == (printer_ip, access_code, port)
+
+    def ReportAge(self):
+        if self.last_report is None:
+            return float("nan")
+        return round(time.monotonic() - self.last_report, 1)
+
+    def _SetState(self, state, reason=None):
+        self.state = state
+        self.state_since = time.monotonic()
+        if reason:
+            self.last_error = reason
+        mqtt_connected.set(1 if state == "connected" else 0, self.printer.dev_id)
+        status = self.Status()
+        for callback in connection_listeners:
+            try:
+                callback(status)
+            except Exception as e:
+                logger.log_exception(e)
+
+    def StartConnect(self):
+        with self.lock:
+            if self.closed or self.state in ("connecting", "connected"):
+                return
+            self.attempt_id += 1
+            self._SetState("connecting")
+        connector.submit(self.Connect, self.attempt_id)
+
+    def Connect(self, attempt_id):
+        logger.log_info(f"Starting MQTT connection to {self.printer.name} at {self.printer_ip}")
+        client = mqtt.Client()
+        client.clean_session = True
+        client.user_data_set(self)
+        client.username_pw_set(USERNAME, self.access_code)
+        client.tls_set(cert_reqs=ssl.CERT_NONE)
+        client.tls_insecure_set(True)
+        client.on_connect = OnConnect
+        client.on_disconnect = OnDisconnect
+        client.on_message = OnMessage
+        try:
+            client.connect(self.printer_ip, self.port, 60)
+        except Exception as e:
+            logger.log_error(f"MQTT connection failed: {e}")
+            if attempt_id == self.attempt_id:
+                self.Failed("unreachable", str(e))
+            return
+        with self.lock:
+            # Given up on (timeout) or closed while connect() was blocking
+            if self.closed or self.state != "connecting" or attempt_id != self.attempt_id:
+                _DropClient(client)
+                return
+            self.client = client
+        # The session counts as up once the CONNACK arrives in OnConnect
+        network_loop.Add(self)
+
+    def Connected(self, client):
+        with self.lock:
+            if client is not self.client or self.closed:
+                return
+            self.attempts = 0
+            self.last_report = self.probe_sent = None
+            self._SetState("connected")
+        mqtt_connect_attempts.inc(self.printer.dev_id, "success")
+        logger.log_info(f"MQTT connected to {self.printer.name} ({self.printer_ip})")
+
+    def Failed(self, reason, detail=None, client=None):
+        """Drop the current session (if it is still `client`) and schedule the next attempt."""
+        with self.lock:
+            if self.closed or (client is not None and client is not self.client):
+                return
+            was_connected = self.state == "connected"
+            client, self.client = self.client, None
+            self.attempts += 1
+            delay = Backoff(self.attempts)
+            self.next_attempt = time.monotonic() + delay
+            self._SetState("backoff", detail or reason)
+        network_loop.Remove(self)
+        if client is not None:
+            _DropClient(client)
+        if was_connected:
+            mqtt_disconnects.inc(self.printer.dev_id, reason)
+        else:
+            mqtt_connect_attempts.inc(self.printer.dev_id, reason)
+        logger.log_warning(f"MQTT {self.printer.name}: {detail or reason}, retrying in {delay:.1f}s")
+
+    def Supervise(self, now):
+        """Called every SUPERVISOR_INTERVAL: reconnect when due, catch hung connects and silent sessions."""
+        state = self.state
+        if state in ("disconnected", "backoff") and now >= self.next_attempt:
+            self.StartConnect()
+        elif state == "connecting" and now - self.state_since > CONNECT_TIMEOUT:
+            self.Failed("timeout", "connection attempt timed out", self.client)
+        elif state == "connected":
+            last = max(self.last_report or self.state_since, self.probe_sent or 0)
+            if self.probe_sent and now - self.probe_sent > PROBE_TIMEOUT and (self.last_report or 0) < self.probe_sent:
+                self.Failed("stale", f"no reports for {now - (self.last_report or self.state_since):.0f}s", self.client)
+            elif now - last > STALE_AFTER:
+                client = self.client
+                if client is not None:
+                    self.probe_sent = now
+                    SendStatusMessage(client, self.printer.dev_id)
+
+    def Close(self):
+        with self.lock:
+            self.closed = True
+            client, self.client = self.client, None
+            self._SetState("closed")
+        network_loop.Remove(self)
+        mqtt_report_age.remove(self.printer.dev_id)
+        mqtt_connected.remove(self.printer.dev_id)
+        if client is not None:
+            try:
+                client.disconnect()
+                client.loop_write()
+            except Exception:
+                pass
+            _DropClient(client)
+
+    def Status(self):
+        retry_in = max(self.next_attempt - time.monotonic(), 0) if self.state == "backoff" else 0
+        return {
+            "printer_id": self.printer.dev_id,
+            "name": self.printer.name,
+            "printer_ip": self.printer_ip,
+            "state": self.state,
+            "connected": self.state == "connected",
+            "attempts": self.attempts,
+            "retry_in": round(retry_in, 1),
+            "last_report_age": None if self.last_report is None else round(time.monotonic() - self.last_report, 1),
+            "last_error": self.last_error,
+        }
+
+def _DropClient(client):
+    sock = client.socket()
+    if sock:
+        try:
+            sock.close()
+        except OSError:
+            pass
+
+class Supervisor:
+    def __init__(self):
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def Start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.Run, name="mqtt-supervisor", daemon=True)
+                self.thread.start()
+
+    def Run(self):
+        while True:
+            now = time.monotonic()
+            with connections_lock:
+                current = list(connections.values())
+            for connection in current:
+                try:
+                    connection.Supervise(now)
+                except Exception as e:
+                    logger.log_exception(e)
+            time.sleep(SUPERVISOR_INTERVAL)
+
+supervisor = Supervisor()
+
 # Callback when connecting to MQTT Broker
 def OnConnect(client, userdata, flags, rc):
-    credentials = ReadCredentials()
-    TOPIC_REPORT = f"device/{credentials.get('DEFAULT','dev_id', fallback= None)}/report"
+    if rc != 0:
+        logger.log_error(f"MQTT connection refused: {rc}")
+        userdata.Failed("refused", f"connection refused ({mqtt.connack_string(rc)})", client)
+        return
+    dev_id = userdata.printer.dev_id
     # Subscribe to report topic
-    client.subscribe(TOPIC_REPORT)
-        
-# Callback for received messages
+    client.subscribe(f"device/{dev_id}/report")
+    userdata.Connected(client)
+    # Ask for the full status on every (re)connect; the state model merges it like any report
+    SendStatusMessage(client, dev_id)
+
+def OnDisconnect(client, userdata, rc):
+    userdata.Failed("lost", f"connection lost (rc={rc})", client)
+
+# Callback for received messages. Runs on the network thread, so it only parses
+# and queues; the printer's ingest worker applies the report.
 def OnMessage(client, userdata, msg):
+    userdata.last_report = time.monotonic()
     try:
-        bp.bambu_printer.ProccessMQTTMsg(msg)
+        if recorder.enabled:
+            recorder.Write(userdata.printer.dev_id, msg.payload)
+        ingest_queue.Put(userdata.printer, msg.payload)
     except Exception as e:
         logger.log_exception(e)
-    
-def SendStatusMessage(client):
+
+def SendStatusMessage(client, dev_id=None):
     """Sends a message to the local MQTT broker."""
-    credentials = ReadCredentials()
-    dev_id = credentials.get('DEFAULT','dev_id', fallback= None)
+    if dev_id is None:
+        credentials = ReadCredentials()
+        dev_id = credentials.get('DEFAULT','dev_id', fallback= None)
     topic = f"device/{dev_id}/request"
     message ={
     "pushing": {
@@ -83,53 +481,51 @@ def SendStatusMessage(client):
     }
     }
     client.publish(topic, json.dumps(message))
+    network_loop.Wake()
 
 def StartMQTT():
-    global mqtt_client, current_printer_ip
-
-    credentials = ReadCredentials()
-    printer_ip = credentials.get('DEFAULT', 'printer_ip', fallback=None)
+    """Connect to every configured printer. Connections whose settings changed are
+    reopened and printers that were removed are disconnected."""
+    printers = ReadPrinters()
+    wanted = {}
+    for dev_id, settings in printers.items():
+        printer_registry.GetOrCreate(dev_id, settings.get("name"))
+        printer_ip = settings.get("printer_ip")
+        if not printer_ip or not IsValidIp(printer_ip):
+            logger.log_warning(f"MQTT not started for {settings.get('name', dev_id)}: invalid or missing printer IP")
+            continue
+        try:
+            port = int(settings.get("mqtt_port", PORT))
+        except ValueError:
+            port = PORT
+        wanted[dev_id] = (printer_ip, settings.get("dev_acces_code"), port)
 
-    if not printer_ip or not IsValidIp(printer_ip):
+    if not wanted:
         logger.log_warning("MQTT not started: invalid or missing printer IP")
-        return
-
-    # Already connected to this printer → nothing to do
-    if mqtt_client and current_printer_ip == printer_ip:
-        return
-
-    # If connected to a different printer → disconnect first
-    if mqtt_client:
-        logger.log_info(f"Switching MQTT connection from {current_printer_ip} to {printer_ip}")
-        mqtt_client.loop_stop()
-        mqtt_client.disconnect()
-        mqtt_client = None
-
-    logger.log_info(f"Starting MQTT connection to {printer_ip}")
 
-    client = mqtt.Client()
-    client.clean_session = True
-
-    dev_acces_code = credentials.get('DEFAULT', 'dev_acces_code', fallback=None)
-    client.username_pw_set(USERNAME, dev_acces_code)
-    client.tls_set(cert_reqs=ssl.CERT_NONE)
-    client.tls_insecure_set(True)
-
-    client.on_connect = OnConnect
-    client.on_message = OnMessage
-
-    try:
-        client.connect(printer_ip, PORT, 60)
-        client.loop_start()
+    with connections_lock:
+        for dev_id, connection in list(connections.items()):
+            # Already connected to this printer with the same settings → nothing to do
+            if dev_id in wanted and connection.Matches(*wanted[dev_id]):
+                continue
+            logger.log_info(f"Closing MQTT connection to {connection.printer.name} ({connection.printer_ip})")
+            connection.Close()
+            del connections[dev_id]
 
-        mqtt_client = client
-        current_printer_ip = printer_ip
+        for dev_id, (printer_ip, access_code, port) in wanted.items():
+            if dev_id in connections:
+                continue
+            connection = PrinterConnection(printer_registry.Get(dev_id), printer_ip, access_code, port)
+            connections[dev_id] = connection
+            connection.StartConnect()
 
-        logger.log_info(f"MQTT connected to {printer_ip}")
+    ingest_queue.Start()
+    supervisor.Start()
+    # Deliver usage reports left over from before a restart
+    usage_outbox.Start()
 
-        # Ask printer to send full status after connect
-        time.sleep(2)
-        SendStatusMessage(client)
-
-    except Exception as e:
-        logger.log_error(f"MQTT connection failed: {e}")
+def GetConnectionStatus(dev_id):
+    connection = connections.get(dev_id)
+    if connection:
+        return connection.Status()
+    return {"printer_id": dev_id, "printer_ip": None, "state": "not configured", "connected": False}
@@ -0,0 +1,112 @@
+import gzip
+import os
+import struct
+import threading
+import time
+from datetime import datetime
+from helper_logs import logger
+from tools import DATA_DIR
+
+# Off unless explicitly enabled; recordings can be replayed with Benchmarks.replay_reports
+ENABLED = os.environ.get("BAMBU_RECORD_REPORTS", "").lower() in ("1", "true", "yes")
+RECORD_DIR = os.path.join(DATA_DIR, "recordings")
+EXTENSION = ".brpt.gz"
+FLUSH_SECONDS = 5.0
+
+# File layout (gzip compressed):
+#   header: MAGIC, dev_id length (H), dev_id, start time (d, unix seconds)
+#   records: offset since start in ms (I), payload length (I), raw payload
+MAGIC = b"BRPT\x01"
+HEADER = struct.Struct("<H")
+START = struct.Struct("<d")
+RECORD = struct.Struct("<II")
+
+class RecordingWriter:
+    def __init__(self, path, dev_id, start=None):
+        self.path = path
+        self.dev_id = dev_id
+        self.start = time.time() if start is None else start
+        self.started = time.monotonic()
+        self.count = 0
+        self.last_flush = self.started
+        self.lock = threading.Lock()
+        self.file = gzip.open(path, "wb")
+        encoded = dev_id.encode()
+        self.file.write(MAGIC + HEADER.pack(len(encoded)) + encoded + START.pack(self.start))
+
+    def Write(self, payload, offset=None):
+        """offset in seconds since the start; defaults to now."""
+        if offset is None:
+            offset = time.monotonic() - self.started
+        with self.lock:
+            self.file.write(RECORD.pack(int(offset * 1000), len(payload)))
+            self.file.write(payload)
+            self.count += 1
+            # Keep what was captured readable if the service is killed
+            if time.monotonic() - self.last_flush > FLUSH_SECONDS:
+                self.file.flush()
+                self.last_flush = time.monotonic()
+
+    def Close(self):
+        with self.lock:
+            self.file.close()
+
+class Recording:
+    """A recording read back: dev_id, start time and (offset seconds, payload) records."""
+
+    def __init__(self, dev_id, start, records):
+        self.dev_id = dev_id
+        self.start = start
+        self.records = records
+
+def ReadRecording(path):
+    records = []
+    with gzip.open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a report recording")
+        (length,) = HEADER.unpack(f.read(HEADER.size))
+        dev_id = f.read(length).decode()
+        (start,) = START.unpack(f.read(START.size))
+        try:
+            while True:
+                head = f.read(RECORD.size)
+                if len(head) < RECORD.size:
+                    break
+                offset, size = RECORD.unpack(head)
+                payload = f.read(size)
+                if len(payload) < size:
+                    break
+                records.append((offset / 1000, payload))
+        except EOFError:
+            # Recording cut short by a crash; keep what is complete
+            pass
+    return Recording(dev_id, start, records)
+
+class ReportRecorder:
+    """Appends every raw report to one recording file per printer."""
+
+    def __init__(self, enabled=ENABLED):
+        self.enabled = enabled
+        self.writers = {}
+        self.lock = threading.Lock()
+
+    def Write(self, dev_id, payload):
+        writer = self.writers.get(dev_id)
+        if writer is None:
+            with self.lock:
+                writer = self.writers.get(dev_id)
+                if writer is None:
+                    os.makedirs(RECORD_DIR, exist_ok=True)
+                    name = f"{dev_id}-{datetime.now().strftime('%Y%m%d-%H%M%S')}{EXTENSION}"
+                    writer = RecordingWriter(os.path.join(RECORD_DIR, name), dev_id)
+                    self.writers[dev_id] = writer
+                    logger.log_info(f"Recording reports of {dev_id} to {writer.path}")
+        writer.Write(payload)
+
+    def Close(self):
+        with self.lock:
+            for writer in self.writers.values():
+                writer.Close()
+            self.writers = {}
+
+recorder = ReportRecorder()
@@ -0,0 +1,186 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from sub-millisecond MQTT handling to slow cloud calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            items = list(self.values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+class Gauge:
+    """A value that is set directly or read from a callback at scrape time."""
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.values = {}
+        self.callbacks = {}
+
+    def set(self, value, *labels):
+        self.values[labels] = value
+
+    def set_function(self, func, *labels):
+        self.callbacks[labels] = func
+
+    def remove(self, *labels):
+        self.values.pop(labels, None)
+        self.callbacks.pop(labels, None)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        values = dict(self.values)
+        for labels, func in list(self.callbacks.items()):
+            try:
+                values[labels] = func()
+            except Exception:
+                continue
+        for labels, value in values.items():
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                # Per-bucket counts plus +Inf; cumulated only when rendering
+                series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            items = [(labels, (list(s[0]), s[1], s[2])) for labels, s in self.series.items()]
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = _labels(self.labelnames, labels, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {count}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, help_text, labelnames, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, help_text, tuple(labelnames), **kwargs)
+            return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._get_or_create(Counter, name, help_text, labelnames)
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._get_or_create(Gauge, name, help_text, labelnames)
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, help_text, labelnames, buckets=buckets)
+
+    def render(self):
+        """Prometheus text exposition format. Only runs when someone scrapes."""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+# Metrics shared by several modules
+mqtt_messages = registry.counter(
+    "bambu_mqtt_messages_total", "MQTT reports received, by message type", ("type",))
+mqtt_processing_seconds = registry.histogram(
+    "bambu_mqtt_processing_seconds", "Time spent in ProccessMQTTMsg", ("type",))
+http_request_seconds = registry.histogram(
+    "bambu_http_request_seconds", "Latency of outgoing API calls", ("service", "endpoint"))
+http_request_errors = registry.counter(
+    "bambu_http_request_errors_total", "Failed outgoing API calls", ("service", "endpoint"))
+websocket_messages = registry.counter(
+    "bambu_websocket_messages_total", "Websocket messages received, by command", ("command",))
+websocket_clients = registry.gauge(
+    "bambu_websocket_clients", "Connected websocket clients")
+log_buffer_lines = registry.gauge(
+    "bambu_log_buffer_lines", "Log lines held in memory for the GUI")
+sync_seconds = registry.histogram(
+    "bambu_sync_seconds", "Duration of filament sync runs", ("source",))
+matching_seconds = registry.histogram(
+    "bambu_matching_seconds", "Duration of filament matching runs")
+
+class CallResult:
+    def __init__(self):
+        self.failed = False
+
+    def fail(self):
+        self.failed = True
+
+@contextmanager
+def track_call(service, endpoint):
+    """Time an outgoing API call. Exceptions and call.fail() count as errors."""
+    call = CallResult()
+    start = time.perf_counter()
+    try:
+        yield call
+    except Exception:
+        call.failed = True
+        raise
+    finally:
+        http_request_seconds.observe(time.perf_counter() - start, service, endpoint)
+        if call.failed:
+            http_request_errors.inc(service, endpoint)
@@ -0,0 +1,243 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from helper_logs import logger
+from tools import DATA_DIR
+
+# Off unless explicitly enabled; when off nothing below starts a thread or hooks the interpreter
+ENABLED = os.environ.get("BAMBU_ENABLE_PROFILING", "").lower() in ("1", "true", "yes")
+PROFILE_DIR = os.path.join(DATA_DIR, "profiles")
+SAMPLE_INTERVAL = 0.005
+MAX_SECONDS = 600
+TOP_N = 40
+
+MODE_SAMPLING = "sampling"
+MODE_CPROFILE = "cprofile"
+
+# From 3.12 cProfile sits on sys.monitoring: one profiler sees every thread.
+# Older versions profile per thread, inside profiled_section() blocks.
+GLOBAL_CPROFILE = sys.version_info >= (3, 12)
+
+class ProfilingDisabled(Exception):
+    pass
+
+def _stamp():
+    return datetime.now().strftime("%Y%m%d-%H%M%S")
+
+def _write(name, content, mode="w"):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, name)
+    with open(path, mode) as f:
+        f.write(content)
+    return name
+
+class ProfileSession:
+    """One profiling run, stopped by a timer or by an admin command."""
+
+    def __init__(self, mode, seconds):
+        self.mode = mode
+        self.seconds = seconds
+        self.started = time.time()
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        self.samples = Counter()
+        self.sample_count = 0
+        # cProfile profilers, one per thread that entered a profiled section
+        self.profilers = []
+        self.local = threading.local()
+        self.files = None
+        self.thread = threading.Thread(target=self.run, name="profiler", daemon=True)
+
+    def run(self):
+        if self.mode == MODE_SAMPLING:
+            own_id = threading.get_ident()
+            names = {}
+            while not self.stop_event.wait(SAMPLE_INTERVAL):
+                if len(names) != threading.active_count():
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == own_id:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                        frame = frame.f_back
+                    stack.append(names.get(thread_id, str(thread_id)))
+                    self.samples[";".join(reversed(stack))] += 1
+                self.sample_count += 1
+        elif GLOBAL_CPROFILE:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            self.stop_event.wait()
+            profiler.disable()
+            self.profilers.append(profiler)
+        else:
+            self.stop_event.wait()
+        self.files = self.finish()
+        logger.log_info(f"Profiling session finished: {self.files}")
+
+    @contextmanager
+    def section(self):
+        profiler = getattr(self.local, "profiler", None)
+        if profiler is None:
+            profiler = cProfile.Profile()
+            self.local.profiler = profiler
+            self.local.depth = 0
+            with self.lock:
+                self.profilers.append(profiler)
+        # Nested sections keep the outer one running
+        if self.local.depth == 0:
+            profiler.enable()
+        self.local.depth += 1
+        try:
+            yield
+        finally:
+            self.local.depth -= 1
+            if self.local.depth == 0:
+                profiler.disable()
+
+    def finish(self):
+        stamp = _stamp()
+        files = []
+        if self.mode == MODE_SAMPLING:
+            # Folded stacks load directly into flamegraph.pl / speedscope
+            folded = "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common())
+            files.append(_write(f"sampling-{stamp}.folded", folded + "\n"))
+            leaf = Counter()
+            for stack, count in self.samples.items():
+                leaf[stack.rsplit(";", 1)[-1]] += count
+            total = max(sum(leaf.values()), 1)
+            lines = [f"{self.sample_count} sampling rounds every {SAMPLE_INTERVAL * 1000:.0f} ms", ""]
+            lines += [f"{count * 100 / total:6.2f}%  {count:8d}  {func}" for func, count in leaf.most_common(TOP_N)]
+            files.append(_write(f"sampling-{stamp}.txt", "\n".join(lines) + "\n"))
+        else:
+            with self.lock:
+                profilers = list(self.profilers)
+            if not profilers:
+                files.append(_write(f"cprofile-{stamp}.txt", "No profiled section ran during the session.\n"))
+                return files
+            stats = pstats.Stats(profilers[0])
+            for profiler in profilers[1:]:
+                stats.add(profiler)
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            stats.dump_stats(os.path.join(PROFILE_DIR, f"cprofile-{stamp}.pstats"))
+            files.append(f"cprofile-{stamp}.pstats")
+            text = io.StringIO()
+            stats.stream = text
+            stats.sort_stats("cumulative").print_stats(TOP_N)
+            files.append(_write(f"cprofile-{stamp}.txt", text.getvalue()))
+        return files
+
+class Profiler:
+    def __init__(self):
+        self.session = None
+        self.lock = threading.Lock()
+        self.last_snapshot = None
+
+    def _check(self):
+        if not ENABLED:
+            raise ProfilingDisabled("Profiling is disabled. Set BAMBU_ENABLE_PROFILING=1 to enable it.")
+
+    def Start(self, seconds=30, mode=MODE_SAMPLING):
+        self._check()
+        if mode not in (MODE_SAMPLING, MODE_CPROFILE):
+            raise ValueError(f"Unknown profiling mode: {mode}")
+        seconds = min(max(float(seconds), 1), MAX_SECONDS)
+        with self.lock:
+            if self.session is not None and self.session.thread.is_alive():
+                raise RuntimeError("A profiling session is already running")
+            self.session = ProfileSession(mode, seconds)
+            self.session.thread.start()
+            timer = threading.Timer(seconds, self.session.stop_event.set)
+            timer.daemon = True
+            timer.start()
+        logger.log_info(f"Profiling ({mode}) started for {seconds:.0f} s")
+        return self.Status()
+
+    def Stop(self):
+        """Stop the running session early and return the files it wrote."""
+        self._check()
+        session = self.session
+        if session is None:
+            return []
+        session.stop_event.set()
+        session.thread.join(timeout=30)
+        return session.files or []
+
+    def Status(self):
+        session = self.session
+        running = session is not None and session.thread.is_alive()
+        return {
+            "enabled": ENABLED,
+            "running": running,
+            "mode": session.mode if session else None,
+            "seconds": session.seconds if session else None,
+            "elapsed": round(time.time() - session.started, 1) if running else None,
+            "last_files": session.files if session and session.files else [],
+            "tracemalloc": tracemalloc.is_tracing(),
+            "files": self.ListFiles(),
+        }
+
+    def ListFiles(self):
+        try:
+            return sorted(os.listdir(PROFILE_DIR))
+        except FileNotFoundError:
+            return []
+
+    def MemorySnapshot(self, stop=False):
+        """Start tracemalloc on first use; afterwards write the top allocators (and growth since last call)."""
+        self._check()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+            self.last_snapshot = None
+            logger.log_info("tracemalloc started")
+            return {"started": True, "files": []}
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"Traced memory: current {current / 1024:.1f} KiB, peak {peak / 1024:.1f} KiB", "",
+                 f"Top {TOP_N} allocators:"]
+        lines += [str(stat) for stat in snapshot.statistics("lineno")[:TOP_N]]
+        if self.last_snapshot is not None:
+            lines += ["", f"Top {TOP_N} changes since previous snapshot:"]
+            lines += [str(stat) for stat in snapshot.compare_to(self.last_snapshot, "lineno")[:TOP_N]]
+        self.last_snapshot = snapshot
+        name = _write(f"tracemalloc-{_stamp()}.txt", "\n".join(lines) + "\n")
+        if stop:
+            tracemalloc.stop()
+            self.last_snapshot = None
+        return {"started": False, "files": [name]}
+
+    def ReadFile(self, name):
+        """Contents of a result file, or None. Only plain names inside PROFILE_DIR are served."""
+        if not ENABLED or os.path.basename(name) != name or name.startswith("."):
+            return None
+        try:
+            with open(os.path.join(PROFILE_DIR, name), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+profiler = Profiler()
+
+@contextmanager
+def profiled_section():
+    """Wrap a unit of work (MQTT message, websocket command, sync run) for cProfile sessions."""
+    session = profiler.session
+    if (session is None or GLOBAL_CPROFILE or session.mode != MODE_CPROFILE
+            or session.stop_event.is_set()):
+        yield
+        return
+    with session.section():
+        yield
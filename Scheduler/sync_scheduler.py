@@ -0,0 +1,148 @@
+import random
+import threading
+import time
+from datetime import datetime
+from helper_logs import logger
+from Metrics.metrics import sync_seconds
+from Metrics.profiling import profiled_section
+from tools import ReadCredentials
+
+TIME_FORMAT = "%H:%M:%S-%d-%m-%Y"
+DEFAULT_INTERVAL_HOURS = 24
+# Spread runs by up to this fraction of the interval so restarts do not line up
+DEFAULT_JITTER = 0.05
+
+def _format_time(timestamp):
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp).strftime(TIME_FORMAT)
+
+class SyncSource:
+    def __init__(self, name, func, interval, jitter=DEFAULT_JITTER):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.jitter = jitter
+        self.lock = threading.Lock()
+        self.next_run = time.time()
+        self.last_start = None
+        self.last_end = None
+        self.last_duration = None
+        self.last_error = None
+        self.runs = 0
+        self.skipped = 0
+
+    def schedule_next(self):
+        spread = self.interval * self.jitter
+        self.next_run = time.time() + self.interval + random.uniform(-spread, spread)
+
+    def run(self):
+        """Run the sync unless one is already in progress. Returns False if skipped."""
+        if not self.lock.acquire(blocking=False):
+            self.skipped += 1
+            logger.log_info(f"Sync '{self.name}' already running, skipping")
+            return False
+        try:
+            self.last_start = time.time()
+            started = time.perf_counter()
+            try:
+                with profiled_section():
+                    self.func()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                logger.log_exception(e)
+            self.last_duration = time.perf_counter() - started
+            sync_seconds.observe(self.last_duration, self.name)
+            self.last_end = time.time()
+            self.runs += 1
+            self.schedule_next()
+        finally:
+            self.lock.release()
+        return True
+
+    def wait_idle(self):
+        with self.lock:
+            pass
+
+    def status(self):
+        return {
+            "running": self.lock.locked(),
+            "interval_s": self.interval,
+            "last_run": _format_time(self.last_start),
+            "last_end": _format_time(self.last_end),
+            "last_duration_s": None if self.last_duration is None else round(self.last_duration, 3),
+            "next_run": _format_time(self.next_run),
+            "last_error": self.last_error,
+            "runs": self.runs,
+            "skipped": self.skipped,
+        }
+
+class SyncScheduler:
+    """Runs each filament source on its own interval and wakes up on demand."""
+
+    def __init__(self):
+        self.sources = {}
+        self.requested = set()
+        self.lock = threading.Lock()
+        self.wake_event = threading.Event()
+
+    def AddSource(self, name, func, interval, jitter=DEFAULT_JITTER):
+        self.sources[name] = SyncSource(name, func, interval, jitter)
+
+    def RequestSync(self, *names):
+        """Ask the scheduler loop to sync the given sources (all if none) as soon as possible."""
+        with self.lock:
+            self.requested.update(names or self.sources.keys())
+        self.wake_event.set()
+
+    def RunNow(self, *names):
+        """Sync the given sources concurrently and wait. A source already running is awaited, not repeated."""
+        sources = [self.sources[n] for n in (names or self.sources.keys())]
+        threads = []
+        for source in sources:
+            t = threading.Thread(target=source.run, name=f"sync-{source.name}", daemon=True)
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+        for source in sources:
+            source.wait_idle()
+
+    def GetStatus(self):
+        return {name: source.status() for name, source in self.sources.items()}
+
+    def Run(self):
+        """Scheduler loop, blocks forever."""
+        while True:
+            now = time.time()
+            with self.lock:
+                due = [s.name for s in self.sources.values() if s.next_run <= now or s.name in self.requested]
+                self.requested.clear()
+                self.wake_event.clear()
+            if due:
+                self.RunNow(*due)
+            next_run = min((s.next_run for s in self.sources.values()), default=time.time() + 60)
+            self.wake_event.wait(max(next_run - time.time(), 0))
+
+def SyncBambuFilaments():
+    import BambuCloud.slicer_filament as slicer_filament
+    filaments = slicer_filament.GetSlicerFilaments()
+    filaments = slicer_filament.ProcessSlicerFilament(filaments)
+    if filaments:
+        slicer_filament.SaveFilamentsToFile(filaments)
+
+def SyncSpoolmanFilaments():
+    from Spoolman.spoolman_filament import spool_inventory
+    spool_inventory.Sync()
+
+def _interval_hours(key):
+    try:
+        hours = float(ReadCredentials().get('DEFAULT', key, fallback=DEFAULT_INTERVAL_HOURS))
+    except ValueError:
+        hours = DEFAULT_INTERVAL_HOURS
+    return max(hours, 0.01) * 60 * 60
+
+sync_scheduler = SyncScheduler()
+sync_scheduler.AddSource("bambu", SyncBambuFilaments, _interval_hours("bambu_sync_hours"))
+sync_scheduler.AddSource("spoolman", SyncSpoolmanFilaments, _interval_hours("spoolman_sync_hours"))
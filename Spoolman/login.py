@@ -2,12 +2,16 @@ import os
 import requests
 from tools import *
 from helper_logs import logger
+from Metrics.metrics import track_call
 
 # Test the Spoolman API endpoint
 def TestSpoolmanApi(ip, port):
     url = f"http://{ip}:{port}/api/v1/info"
     try:
-        response = requests.get(url, timeout=5)  # Timeout after 5 seconds
+        with track_call("spoolman", "info") as call:
+            response = requests.get(url, timeout=5)  # Timeout after 5 seconds
+            if response.status_code != 200:
+                call.fail()
         if response.status_code == 200:
             logger.log_info("Spoolman API is working correctly!")
             return True
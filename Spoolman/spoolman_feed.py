@@ -0,0 +1,167 @@
+import json
+import random
+import threading
+import time
+from websockets.exceptions import WebSocketException
+from websockets.sync.client import connect
+from helper_logs import logger
+from tools import ReadCredentials
+from Metrics.metrics import registry
+from Spoolman.spoolman_filament import SpoolmanURL, spool_inventory
+
+# Reconnect delays grow 1s, 2s, 4s ... up to BACKOFF_MAX, each shortened by up to half at random
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 120.0
+POLL_INTERVAL = 60.0
+# A burst of events (a spool edited field by field) ends up in one file write
+SAVE_AFTER_QUIET = 1.0
+
+feed_live = registry.gauge(
+    "bambu_spoolman_feed_live", "1 while subscribed to Spoolman change events")
+feed_events = registry.counter(
+    "bambu_spoolman_feed_events_total", "Spoolman change events received", ("resource", "type"))
+feed_reconnects = registry.counter(
+    "bambu_spoolman_feed_reconnects_total", "Spoolman change feed connection attempts that failed or dropped")
+
+def Backoff(attempts):
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** max(attempts - 1, 0))
+    return random.uniform(delay / 2, delay)
+
+def LiveUpdatesEnabled():
+    value = ReadCredentials().get('DEFAULT', 'spoolman_live_updates', fallback="false")
+    return value.lower() in ("1", "true", "yes")
+
+def _PollInterval():
+    try:
+        return max(5.0, float(ReadCredentials().get('DEFAULT', 'spoolman_poll_seconds', fallback=POLL_INTERVAL)))
+    except ValueError:
+        return POLL_INTERVAL
+
+class SpoolmanFeed:
+    """Keeps spool_inventory current from Spoolman's websocket change events.
+
+    While the websocket is down the inventory is synced incrementally instead,
+    every poll interval, and a full catch-up sync runs after each reconnect.
+    """
+
+    def __init__(self, inventory=spool_inventory):
+        self.inventory = inventory
+        self.state = "stopped"  # stopped / unconfigured / connecting / live / polling
+        self.attempts = 0
+        self.events = 0
+        self.last_event = None
+        self.last_poll = None
+        self.last_error = None
+        self.logged_error = None  # the unavailable reason last written to the log
+        self.thread = None
+        self.stop_event = threading.Event()
+        feed_live.set_function(lambda: 1 if self.state == "live" else 0)
+
+    def Start(self):
+        if self.thread is None:
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self.Run, name="spoolman-feed", daemon=True)
+            self.thread.start()
+
+    def Stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.state = "stopped"
+
+    def IsLive(self):
+        return self.state == "live"
+
+    def Run(self):
+        while not self.stop_event.is_set():
+            base_url = SpoolmanURL(quiet=True)
+            if base_url is None:
+                # Nothing to connect to or poll until the settings are saved
+                self.state = "unconfigured"
+                self.last_error = "Spoolman IP/port not configured"
+                self._LogUnavailable("waiting for the Spoolman IP/port")
+                self.stop_event.wait(_PollInterval())
+                continue
+            self.state = "connecting"
+            try:
+                self.Listen("ws" + base_url[len("http"):] + "/")
+            except (OSError, TimeoutError, WebSocketException) as e:
+                self.last_error = str(e) or e.__class__.__name__
+            except Exception as e:
+                self.last_error = str(e)
+                logger.log_exception(e)
+            if self.stop_event.is_set():
+                break
+            feed_reconnects.inc()
+            self.attempts += 1
+            self.state = "polling"
+            self.inventory.SaveIfDirty()
+            delay = Backoff(self.attempts)
+            self._LogUnavailable(f"polling and retrying with backoff up to {BACKOFF_MAX:.0f}s")
+            deadline = time.time() + delay
+            while not self.stop_event.is_set() and time.time() < deadline:
+                if self.last_poll is None or time.time() - self.last_poll >= _PollInterval():
+                    self.Poll()
+                self.stop_event.wait(min(1.0, max(deadline - time.time(), 0)))
+
+    def _LogUnavailable(self, action):
+        """Log once per reason, not once per retry."""
+        if self.last_error != self.logged_error:
+            self.logged_error = self.last_error
+            logger.log_info(f"Spoolman change feed unavailable ({self.last_error}), {action}")
+
+    def Poll(self):
+        self.last_poll = time.time()
+        self.inventory.Sync()
+
+    def Listen(self, url):
+        with connect(url, open_timeout=10, ping_interval=20, ping_timeout=20) as websocket:
+            self.state = "live"
+            self.attempts = 0
+            self.last_error = self.logged_error = None
+            logger.log_info(f"Subscribed to Spoolman changes at {url}")
+            # Catch up on whatever changed while nobody was listening
+            self.Poll()
+            while not self.stop_event.is_set():
+                try:
+                    message = websocket.recv(timeout=SAVE_AFTER_QUIET)
+                except TimeoutError:
+                    self.inventory.SaveIfDirty()
+                    continue
+                self.HandleEvent(message)
+
+    def HandleEvent(self, message):
+        """Spoolman events: {"type": added/updated/deleted, "resource": spool/filament/vendor, "payload": {...}}."""
+        try:
+            event = json.loads(message)
+        except (TypeError, ValueError):
+            return
+        if not isinstance(event, dict):
+            return
+        resource, kind, payload = event.get("resource"), event.get("type"), event.get("payload") or {}
+        feed_events.inc(str(resource), str(kind))
+        self.events += 1
+        self.last_event = time.time()
+        if resource == "spool":
+            if kind == "deleted":
+                self.inventory.RemoveSpool(payload.get("id"))
+            else:
+                self.inventory.ApplySpool(payload)
+        elif resource == "filament" and kind != "deleted":
+            # Spools of a deleted filament are deleted with their own events
+            self.inventory.ApplyFilament(payload)
+        elif resource == "vendor" and kind == "updated":
+            # Rare; the incremental sync picks up the new vendor name on affected spools
+            self.Poll()
+
+    def Status(self):
+        return {
+            "state": self.state,
+            "events": self.events,
+            "last_event": self.last_event,
+            "last_poll": self.last_poll,
+            "last_error": self.last_error,
+        }
+
+spoolman_feed = SpoolmanFeed()
@@ -1,8 +1,12 @@
+import copy
 import os
+import threading
+import time
 import requests
 from tools import *
-import json
 from helper_logs import logger
+from Metrics.metrics import track_call
+from Filament.mapping_store import mapping_store, target_filament
 
 class SpoolmanFilament:
     def __init__(self):
@@ -10,11 +14,25 @@ class SpoolmanFilament:
         self.filament_name = None
         self.filament_vendor_name = None
         self.filament_type = None
+        self.filament_id = None
+        self.color = None
+        self.remaining_weight = None
+        self.used_weight = None
+        self.last_used = None
     
     def __str__(self):
         return f"Filament Name: {self.filament_name}, Filament Type: {self.filament_type}, Filament Vendor: {self.filament_vendor_name}, Filament ID: {self.spoolId}"
 
-def GetSpoolmanFilaments():
+SPOOLMAN_FILE = os.path.join(DATA_DIR, "spoolman_filaments.txt")
+PAGE_SIZE = 100
+PAGE_TIMEOUT = 10
+# A failed page is retried this many times before the whole sync is given up
+PAGE_RETRIES = 2
+PAGE_RETRY_DELAY = 0.5
+
+def SpoolmanURL(quiet=False):
+    """Base API url from the credentials, or None when Spoolman is not (validly) configured.
+    quiet skips the log line, for callers that check again and again."""
     # Load credentials from the file
     credentials = ReadCredentials()
     spoolman_ip = credentials.get('DEFAULT',"spoolman_ip", fallback = None)
@@ -22,62 +40,102 @@ def GetSpoolmanFilaments():
     
     # Config missing → silently skip
     if not spoolman_ip or not spoolman_port:
-        logger.log_info("Spoolman IP/Port not configured yet. Skipping request.")
-        return []
+        if not quiet:
+            logger.log_info("Spoolman IP/Port not configured yet. Skipping request.")
+        return None
 
     # Invalid values → skip
     if not IsValidIp(spoolman_ip):
-        logger.log_error(f"Invalid Spoolman IP: {spoolman_ip}")
-        return []
+        if not quiet:
+            logger.log_error(f"Invalid Spoolman IP: {spoolman_ip}")
+        return None
 
     if not IsValidPort(spoolman_port):
-        logger.log_error(f"Invalid Spoolman Port: {spoolman_port}")
-        return []
-    
-    url = f"http://{spoolman_ip}:{spoolman_port}/api/v1/spool"
-    try:
-        response = requests.get(url, timeout=5)
+        if not quiet:
+            logger.log_error(f"Invalid Spoolman Port: {spoolman_port}")
+        return None
 
-        if response.status_code == 200:
-            return response.json()
+    return f"http://{spoolman_ip}:{spoolman_port}/api/v1"
 
-        logger.log_error(
-            f"Spoolman error {response.status_code}: {response.text[:200]}"
-        )
+def _PageSize():
+    try:
+        size = int(ReadCredentials().get('DEFAULT', "spoolman_page_size", fallback=PAGE_SIZE))
+    except ValueError:
+        size = PAGE_SIZE
+    return max(size, 1)
 
-    except requests.exceptions.ConnectTimeout:
-        logger.log_error("Spoolman connection timed out.")
-    except requests.exceptions.ConnectionError:
-        logger.log_error("Could not connect to Spoolman server.")
-    except requests.exceptions.RequestException as e:
-        logger.log_exception(e)
+def _GetPage(url, params):
+    for attempt in range(PAGE_RETRIES + 1):
+        try:
+            with track_call("spoolman", "spool") as call:
+                response = requests.get(url, params=params, timeout=PAGE_TIMEOUT)
+                if response.status_code != 200:
+                    call.fail()
+            if response.status_code == 200:
+                return response
+            error = requests.exceptions.HTTPError(
+                f"Spoolman error {response.status_code}: {response.text[:200]}", response=response)
+            if response.status_code < 500:
+                raise error
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            error = e
+        if attempt < PAGE_RETRIES:
+            time.sleep(PAGE_RETRY_DELAY * (attempt + 1))
+    raise error
 
-    return []
+def IterSpoolPages(base_url, page_size=None, allow_archived=False):
+    """Yields the spools one page at a time (limit/offset, oldest id first).
 
-def ProcessSpoolmanFilament(filaments):
-    filaments_list = []
-    unique_ids = set()  # To track unique filament IDs
-    for filament in filaments:
-        spoolman_filament = SpoolmanFilament()
-        
-        # Ensure safe access to dictionary fields
-        spoolman_filament.spoolId = filament.get("id")
-        filament_data = filament.get("filament", {})  # Ensure it's a dict
-        spoolman_filament.filament_name = filament_data.get("name")
-        
-        vendor_data = filament_data.get("vendor", {})  # Ensure vendor is a dict
-        spoolman_filament.filament_vendor_name = vendor_data.get("name")
+    Archived spools are filtered out by Spoolman itself. Server errors and
+    dropped connections are retried per page; when a page still cannot be
+    fetched requests.exceptions.RequestException is raised, so a partial
+    listing is never mistaken for the whole inventory.
+    """
+    page_size = page_size or _PageSize()
+    params = {"limit": page_size, "offset": 0, "sort": "id:asc",
+              "allow_archived": "true" if allow_archived else "false"}
+    first_ids = set()
+    while True:
+        response = _GetPage(f"{base_url}/spool", params)
+        page = response.json()
+        try:
+            total = int(response.headers.get("X-Total-Count"))
+        except (TypeError, ValueError):
+            total = None
+        # Without X-Total-Count, a server that ignores offset sends the first page again
+        if page and total is None:
+            first_id = page[0].get("id")
+            if first_id in first_ids:
+                return
+            first_ids.add(first_id)
+        if page:
+            yield page
+        params["offset"] += len(page)
+        # Servers without paging return everything at once, ignoring limit
+        if len(page) != page_size or (total is not None and params["offset"] >= total):
+            return
 
-        spoolman_filament.filament_type = filament_data.get("material")
+def BuildSpoolmanFilament(spool):
+    spoolman_filament = SpoolmanFilament()
+    
+    # Ensure safe access to dictionary fields
+    spoolman_filament.spoolId = spool.get("id")
+    filament_data = spool.get("filament") or {}  # Ensure it's a dict
+    spoolman_filament.filament_name = filament_data.get("name")
+    
+    vendor_data = filament_data.get("vendor") or {}  # Ensure vendor is a dict
+    spoolman_filament.filament_vendor_name = vendor_data.get("name")
 
-        # Ensure is unique by filamentID
-        if spoolman_filament.spoolId not in unique_ids:
-            filaments_list.append(spoolman_filament)
-            unique_ids.add(spoolman_filament.spoolId)  # Add ID to the set
-    return filaments_list
+    spoolman_filament.filament_type = filament_data.get("material")
+    spoolman_filament.filament_id = filament_data.get("id")
+    spoolman_filament.color = filament_data.get("color_hex")
+    spoolman_filament.remaining_weight = spool.get("remaining_weight")
+    spoolman_filament.used_weight = spool.get("used_weight")
+    spoolman_filament.last_used = spool.get("last_used")
+    return spoolman_filament
 
 def SaveFilamentsToFile(filaments):
-    filename = os.path.join(DATA_DIR, "spoolman_filaments.txt")
+    filename = SPOOLMAN_FILE
     try:
         with open(filename, "w", encoding="utf-8") as file:
             for filament in filaments:
@@ -85,35 +143,298 @@ def SaveFilamentsToFile(filaments):
         logger.log_info(f"Filaments saved successfully to {filename}")
     except Exception as e:
         logger.log_exception(e)
+
+def _ChangeKey(spool):
+    """What a spool looks like to us. Spoolman stamps last_used on every use and the
+    rest covers edits, so an equal key means the spool needs no reprocessing."""
+    filament = spool.get("filament") or {}
+    vendor = filament.get("vendor") or {}
+    return (spool.get("registered"), spool.get("last_used"), spool.get("remaining_weight"), spool.get("used_weight"),
+            spool.get("archived"), filament.get("id"), filament.get("name"),
+            filament.get("material"), filament.get("color_hex"), vendor.get("name"))
+
+def _ActiveOrder(spool):
+    """Sort key of the spool to charge for a filament: partly used spools first,
+    then the one with the least left; empty spools only as a last resort."""
+    remaining = spool.remaining_weight if spool.remaining_weight is not None else float("inf")
+    return (remaining <= 0, not spool.used_weight, remaining, spool.spoolId)
+
+class InventoryState:
+    """One published version of the spool index. Never modified once published:
+    writers build a new one, so readers take `inventory.state` once and need no lock."""
+
+    __slots__ = ("spools", "keys", "by_filament", "active")
+
+    def __init__(self, spools=None, keys=None, by_filament=None, active=None):
+        self.spools = spools or {}  # spool id -> SpoolmanFilament
+        self.keys = keys or {}  # spool id -> _ChangeKey of the spool it was built from
+        self.by_filament = by_filament or {}  # spoolman filament id -> frozenset of its spool ids
+        self.active = active or {}  # spoolman filament id -> spool id to charge next
+
+class SpoolInventory:
+    """Index of the active Spoolman spools, kept up to date page by page or from
+    Spoolman's change events.
+
+    Writers hold the lock and publish a new InventoryState in one assignment.
+    """
+
+    def __init__(self):
+        self.state = InventoryState()
+        self.lock = threading.Lock()
+        # One sync at a time; the pages are fetched outside self.lock
+        self.sync_lock = threading.Lock()
+        # Spools changed by events while a sync fetches, None when no sync runs
+        self.touched = None
+        self.last_sync = None
+        self.dirty = False  # spoolman_filaments.txt is behind
+        self.listeners = []
+
+    def AddChangeListener(self, func):
+        """func(updated_ids, removed_ids), called after every change to the index."""
+        self.listeners.append(func)
+
+    def _Commit(self, spools, keys, updated, removed):
+        """Called with the lock held: publish the new state and note whether the file changed."""
+        current = self.state
+        old = current.spools
+        if removed or any(spool_id not in old or str(old[spool_id]) != str(spools[spool_id])
+                          for spool_id in updated):
+            self.dirty = True
+
+        # Only the filaments these spools belonged to or now belong to need a new pick
+        affected = set()
+        for spool_id in list(updated) + list(removed):
+            if spool_id in old:
+                affected.add(old[spool_id].filament_id)
+            if spool_id in spools:
+                affected.add(spools[spool_id].filament_id)
+        by_filament = dict(current.by_filament)
+        active = dict(current.active)
+        changed = set(updated) | set(removed)
+        for filament_id in affected:
+            members = {s for s in by_filament.get(filament_id, ()) if s not in changed}
+            members.update(s for s in updated if spools[s].filament_id == filament_id)
+            if members:
+                by_filament[filament_id] = frozenset(members)
+                active[filament_id] = min(members, key=lambda s: _ActiveOrder(spools[s]))
+            else:
+                by_filament.pop(filament_id, None)
+                active.pop(filament_id, None)
+
+        self.state = InventoryState(spools, keys, by_filament, active)
+
+    def _Touch(self, spool_ids):
+        """Called with the lock held: keep a running sync from overwriting these spools."""
+        if self.touched is not None:
+            self.touched.update(spool_ids)
+
+    def _Notify(self, updated, removed):
+        if not updated and not removed:
+            return
+        for func in self.listeners:
+            try:
+                func(list(updated), list(removed))
+            except Exception as e:
+                logger.log_exception(e)
+
+    def Sync(self, page_size=None):
+        """Fetch every page and apply what changed. Returns False (index untouched) on errors.
+
+        Pages are fetched without holding the lock: change events and lookups go on
+        meanwhile, and spools they touch keep the newer data when the sync lands.
+        """
+        base_url = SpoolmanURL()
+        if base_url is None:
+            return False
+        with self.sync_lock:
+            with self.lock:
+                self.touched = set()
+            try:
+                fetched = self._FetchSpools(base_url, page_size)
+                if fetched is None:
+                    return False
+                with self.lock:
+                    spools = dict(self.state.spools)
+                    keys = dict(self.state.keys)
+                    updated = []
+                    for spool_id, (key, spool) in fetched.items():
+                        if spool_id in self.touched or keys.get(spool_id) == key:
+                            continue
+                        spools[spool_id] = spool
+                        keys[spool_id] = key
+                        updated.append(spool_id)
+                    # Deleted or archived since the last sync
+                    removed = [spool_id for spool_id in spools
+                               if spool_id not in fetched and spool_id not in self.touched]
+                    for spool_id in removed:
+                        del spools[spool_id]
+                        del keys[spool_id]
+                    self._Commit(spools, keys, updated, removed)
+                    self.last_sync = time.time()
+            finally:
+                with self.lock:
+                    self.touched = None
+
+        logger.log_info(f"Spoolman sync: {len(fetched)} spools, {len(updated)} updated, {len(removed)} removed")
+        self._Notify(updated, removed)
+        self.SaveIfDirty()
+        return True
+
+    def _FetchSpools(self, base_url, page_size):
+        """{spool id: (change key, SpoolmanFilament)} of every active spool, or None on
+        errors. Spools whose key matches the current state are not rebuilt (None)."""
+        keys = self.state.keys
+        fetched = {}
+        try:
+            for page in IterSpoolPages(base_url, page_size):
+                for spool in page:
+                    spool_id = spool.get("id")
+                    if spool_id is None or spool_id in fetched:
+                        # Offsets shift when spools are added mid-sync
+                        continue
+                    key = _ChangeKey(spool)
+                    fetched[spool_id] = (key, None if keys.get(spool_id) == key else BuildSpoolmanFilament(spool))
+        except requests.exceptions.ConnectTimeout:
+            logger.log_error("Spoolman connection timed out.")
+            return None
+        except requests.exceptions.ConnectionError:
+            logger.log_error("Could not connect to Spoolman server.")
+            return None
+        except requests.exceptions.HTTPError as e:
+            logger.log_error(str(e))
+            return None
+        except requests.exceptions.RequestException as e:
+            logger.log_exception(e)
+            return None
+        return fetched
+
+    def ApplySpool(self, spool):
+        """Add or update one spool as sent in a change event. Archived spools leave the index."""
+        spool_id = spool.get("id")
+        if spool_id is None:
+            return
+        if spool.get("archived"):
+            self.RemoveSpool(spool_id)
+            return
+        key = _ChangeKey(spool)
+        with self.lock:
+            if self.state.keys.get(spool_id) == key:
+                return
+            spools = dict(self.state.spools)
+            keys = dict(self.state.keys)
+            spools[spool_id] = BuildSpoolmanFilament(spool)
+            keys[spool_id] = key
+            self._Touch([spool_id])
+            self._Commit(spools, keys, [spool_id], [])
+        self._Notify([spool_id], [])
+
+    def RemoveSpool(self, spool_id):
+        with self.lock:
+            self._Touch([spool_id])
+            if spool_id not in self.state.spools:
+                return
+            spools = dict(self.state.spools)
+            keys = dict(self.state.keys)
+            del spools[spool_id]
+            del keys[spool_id]
+            self._Commit(spools, keys, [], [spool_id])
+        self._Notify([], [spool_id])
+
+    def ApplyFilament(self, filament):
+        """A filament was edited: refresh the spools made of it."""
+        filament_id = filament.get("id")
+        vendor = filament.get("vendor") or {}
+        with self.lock:
+            spools = dict(self.state.spools)
+            keys = dict(self.state.keys)
+            updated = []
+            for spool_id, spool in self.state.spools.items():
+                if spool.filament_id != filament_id:
+                    continue
+                changed = copy.copy(spool)
+                changed.filament_name = filament.get("name")
+                changed.filament_vendor_name = vendor.get("name")
+                changed.filament_type = filament.get("material")
+                changed.color = filament.get("color_hex")
+                spools[spool_id] = changed
+                # The next full sync rebuilds these from the spool itself
+                keys[spool_id] = None
+                updated.append(spool_id)
+            if updated:
+                self._Touch(updated)
+                self._Commit(spools, keys, updated, [])
+        self._Notify(updated, [])
+
+    def SaveIfDirty(self):
+        """Rewrite spoolman_filaments.txt if a name, type or vendor changed since the last write."""
+        with self.lock:
+            if not self.dirty and os.path.exists(SPOOLMAN_FILE):
+                return
+            self.dirty = False
+            filaments = self.All()
+        SaveFilamentsToFile(filaments)
+
+    def All(self):
+        spools = self.state.spools
+        return [spools[spool_id] for spool_id in sorted(spools)]
+
+    def Get(self, spool_id):
+        return self.state.spools.get(spool_id)
+
+    def ActiveSpool(self, filament_id):
+        """Spool to charge for a Spoolman filament, or None when it has no active spools."""
+        return self.state.active.get(filament_id)
+
+    def IsUsable(self, spool_id, filament_id):
+        """spool_id is an active spool of filament_id with something left on it."""
+        spool = self.state.spools.get(spool_id)
+        return (spool is not None and spool.filament_id == filament_id
+                and (spool.remaining_weight is None or spool.remaining_weight > 0))
+
+    def Filaments(self):
+        """Spoolman filaments with their spools and the one currently picked."""
+        state = self.state
+        spools, active = state.spools, state.active
+        filaments = []
+        for filament_id, members in state.by_filament.items():
+            first = spools[active[filament_id]]
+            filaments.append({
+                "id": filament_id,
+                "name": first.filament_name,
+                "vendor": first.filament_vendor_name,
+                "type": first.filament_type,
+                "spools": sorted(members),
+                "activeSpool": active[filament_id],
+            })
+        return filaments
+
+    def Status(self):
+        return {"spools": len(self.state.spools), "last_sync": self.last_sync}
+
+spool_inventory = SpoolInventory()
         
-def LoadFilamentMapping():
-    with open(os.path.join(DATA_DIR, "filament_mapping.json"), "r") as file:
-        return json.load(file)    
-      
-def GetSpoolmanID(filament_mapping, slicer_filamentID):
-    return filament_mapping.get(slicer_filamentID)     
-  
-def RegisterFilament(slicer_filamentID, weight):
-    filament_mapping = LoadFilamentMapping()
-    spoolman_filamentID = GetSpoolmanID(filament_mapping, slicer_filamentID)
+def ResolveSpool(slicer_filamentID, loaded_spool=None):
+    """Spoolman spool mapped to a slicer filament, or None.
+
+    For a mapping to a Spoolman filament the active spool is picked from the
+    inventory; loaded_spool, the spool already feeding the tray, is kept while
+    it belongs to that filament and is not empty.
+    """
+    spoolman_filamentID = mapping_store.get_spool(slicer_filamentID)
     
     if spoolman_filamentID is None:
         logger.log_error(f"No corresponding spoolman filament for {slicer_filamentID}")
-        return False
-      
-    # Load credentials from the file
-    credentials = ReadCredentials()
-    spoolman_ip = credentials.get('DEFAULT',"spoolman_ip", fallback = None)
-    spoolman_port = credentials.get('DEFAULT',"spoolman_port", fallback = None)
-    url = f"http://{spoolman_ip}:{spoolman_port}/api/v1/spool/{spoolman_filamentID}/use"
-    payload = {"use_weight": weight}
+        return None
 
-    try:
-        response = requests.put(url, json=payload)
-        if response.status_code == 200:
-            return True
-        else:
-            logger.log_error(f"Failed to get spoolman filaments with status code {response.status_code}: {response.text}")  
-    except Exception as e:
-        logger.log_exception(e)    
-    return False
\ No newline at end of file
+    filament_id = target_filament(spoolman_filamentID)
+    if filament_id is None:
+        return spoolman_filamentID
+    if spool_inventory.last_sync is None:
+        # Nothing fetched yet (e.g. right after start)
+        spool_inventory.Sync()
+    if loaded_spool is not None and spool_inventory.IsUsable(loaded_spool, filament_id):
+        return loaded_spool
+    spool_id = spool_inventory.ActiveSpool(filament_id)
+    if spool_id is None:
+        logger.log_error(f"No active spool of Spoolman filament {filament_id} for {slicer_filamentID}")
+    return spool_id
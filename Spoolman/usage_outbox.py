@@ -0,0 +1,238 @@
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from helper_logs import logger
+from tools import DATA_DIR, ReadCredentials
+from Metrics.metrics import registry, track_call
+from Spoolman.spoolman_filament import SpoolmanURL
+
+OUTBOX_FILE = os.path.join(DATA_DIR, "spoolman_outbox.json")
+# Reports Spoolman refused (deleted spool, bad request), one JSON object per line
+REJECTED_FILE = os.path.join(DATA_DIR, "spoolman_outbox_rejected.jsonl")
+WORKERS = 4
+SEND_TIMEOUT = 10
+# Retry delays grow 5s, 10s, 20s ... up to BACKOFF_MAX, each shortened by up to half at random
+BACKOFF_BASE = 5.0
+BACKOFF_MAX = 300.0
+IDLE_WAIT = 60.0
+# 4xx answers are final, except these
+RETRY_STATUS = (408, 429)
+
+outbox_pending = registry.gauge(
+    "bambu_spoolman_outbox_pending", "Usage reports waiting to reach Spoolman")
+outbox_oldest_age = registry.gauge(
+    "bambu_spoolman_outbox_oldest_age_seconds", "Age of the oldest usage report not yet in Spoolman")
+outbox_sent = registry.counter(
+    "bambu_spoolman_outbox_sent_total", "Usage reports accepted by Spoolman")
+outbox_retries = registry.counter(
+    "bambu_spoolman_outbox_retries_total", "Usage report attempts that failed and were rescheduled")
+outbox_rejected = registry.counter(
+    "bambu_spoolman_outbox_rejected_total", "Usage reports Spoolman refused and that were set aside")
+
+def Backoff(attempts):
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** max(attempts - 1, 0))
+    return random.uniform(delay / 2, delay)
+
+def _Workers():
+    try:
+        return max(1, int(ReadCredentials().get('DEFAULT', 'spoolman_workers', fallback=WORKERS)))
+    except ValueError:
+        return WORKERS
+
+class UsageOutbox:
+    """Usage reports are written to disk before anything is sent, and a drainer
+    thread delivers them to Spoolman, retrying with backoff until it accepts them.
+
+    Reports for the same (task, spool) are merged while they wait, so a spool gets
+    one PUT with the summed grams instead of one per progress step.
+    """
+
+    def __init__(self, path=OUTBOX_FILE, workers=None, rejected_path=REJECTED_FILE):
+        self.path = path
+        self.rejected_path = rejected_path
+        self.workers = workers or _Workers()
+        self.cond = threading.Condition()
+        self.entries = self._Load()  # "task|spool" -> entry
+        self.in_flight = set()
+        self.thread = None
+        self.session = requests.Session()
+        # One kept-alive connection per worker
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="spoolman-outbox")
+        outbox_pending.set_function(lambda: len(self.entries))
+        outbox_oldest_age.set_function(self.OldestAge)
+
+    def _Load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.log_error(f"Ignoring unreadable Spoolman outbox {self.path}: {e}")
+            return {}
+        if entries:
+            logger.log_info(f"{len(entries)} usage reports still waiting for Spoolman")
+        return entries
+
+    def _Save(self):
+        """Called with the lock held. Replaces the file in one step."""
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, separators=(",", ":"))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+            return True
+        except OSError as e:
+            logger.log_error(f"Could not write Spoolman outbox {self.path}: {e}")
+            return False
+
+    def Start(self):
+        with self.cond:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.Run, name="spoolman-outbox", daemon=True)
+                self.thread.start()
+
+    def Add(self, task, spool_id, weight):
+        """Record grams used from a spool. Returns True once the report is on disk."""
+        if spool_id is None or weight <= 0:
+            return False
+        key = f"{task}|{spool_id}"
+        now = time.time()
+        with self.cond:
+            entry = self.entries.get(key)
+            created = entry is None
+            if created:
+                entry = {"task": task, "spool": spool_id, "weight": 0.0, "created": now,
+                         "attempts": 0, "next_attempt": now, "last_error": None}
+                self.entries[key] = entry
+            entry["weight"] += weight
+            if not self._Save():
+                # The caller keeps these grams and offers them again; queuing them too would charge twice
+                if created:
+                    del self.entries[key]
+                else:
+                    entry["weight"] -= weight
+                return False
+            self.cond.notify_all()
+        self.Start()
+        return True
+
+    def Run(self):
+        while True:
+            with self.cond:
+                now = time.time()
+                due = [key for key, entry in self.entries.items()
+                       if key not in self.in_flight and entry["next_attempt"] <= now]
+                if not due:
+                    upcoming = [e["next_attempt"] for k, e in self.entries.items() if k not in self.in_flight]
+                    self.cond.wait(max(min(upcoming, default=now + IDLE_WAIT) - now, 0.05))
+                    continue
+                base_url = SpoolmanURL()
+                if base_url is None:
+                    # Not configured (yet); look again later without counting attempts
+                    for key in due:
+                        self.entries[key]["next_attempt"] = now + IDLE_WAIT
+                    continue
+                sends = []
+                for key in due:
+                    self.in_flight.add(key)
+                    entry = self.entries[key]
+                    sends.append((key, entry["spool"], entry["weight"]))
+            for key, spool_id, weight in sends:
+                self.executor.submit(self._Deliver, base_url, key, spool_id, weight)
+
+    def _SetAside(self, entry, error):
+        """Called with the lock held. Keeps a refused report out of the retry loop."""
+        logger.log_error(f"Spoolman refused {entry['weight']:.2f} g for spool {entry['spool']} "
+                         f"(task {entry['task']}), not retrying: {error}")
+        try:
+            with open(self.rejected_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(dict(entry, last_error=error, rejected=time.time())) + "\n")
+        except OSError as e:
+            logger.log_error(f"Could not write {self.rejected_path}: {e}")
+        outbox_rejected.inc()
+
+    def _Deliver(self, base_url, key, spool_id, weight):
+        error = None
+        permanent = False
+        try:
+            with track_call("spoolman", "spool_use") as call:
+                response = self.session.put(f"{base_url}/spool/{spool_id}/use",
+                                            json={"use_weight": weight}, timeout=SEND_TIMEOUT)
+                if response.status_code != 200:
+                    call.fail()
+            if response.status_code != 200:
+                error = f"Spoolman error {response.status_code}: {response.text[:200]}"
+                permanent = 400 <= response.status_code < 500 and response.status_code not in RETRY_STATUS
+        except requests.exceptions.RequestException as e:
+            error = str(e) or e.__class__.__name__
+        except Exception as e:
+            logger.log_exception(e)
+            error = str(e)
+        if error is None:
+            logger.log_info(f"Reported {weight:.2f} g to Spoolman spool {spool_id}")
+        elif not permanent:
+            logger.log_error(f"Spoolman spool {spool_id} usage not delivered, will retry: {error}")
+
+        with self.cond:
+            self.in_flight.discard(key)
+            entry = self.entries.get(key)
+            if entry is not None:
+                if error is None:
+                    # More may have been added to this entry while the PUT was out
+                    entry["weight"] -= weight
+                    if entry["weight"] <= 1e-9:
+                        del self.entries[key]
+                    outbox_sent.inc()
+                elif permanent:
+                    self._SetAside(entry, error)
+                    del self.entries[key]
+                else:
+                    entry["attempts"] += 1
+                    entry["next_attempt"] = time.time() + Backoff(entry["attempts"])
+                    entry["last_error"] = error
+                    outbox_retries.inc()
+                self._Save()
+            self.cond.notify_all()
+
+    def Pending(self):
+        return len(self.entries)
+
+    def OldestAge(self):
+        with self.cond:
+            oldest = min((e["created"] for e in self.entries.values()), default=None)
+        return 0.0 if oldest is None else time.time() - oldest
+
+    def Flush(self, timeout=None):
+        """Wait until everything was delivered. Returns False on timeout."""
+        deadline = None if timeout is None else time.time() + timeout
+        with self.cond:
+            while self.entries:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.cond.wait(remaining)
+        return True
+
+    def Status(self):
+        with self.cond:
+            entries = list(self.entries.values())
+        return {
+            "pending": len(entries),
+            "pending_grams": round(sum(e["weight"] for e in entries), 2),
+            "oldest_age_s": round(self.OldestAge(), 1),
+            "in_flight": len(self.in_flight),
+            "last_error": max(entries, key=lambda e: e["attempts"])["last_error"] if entries else None,
+        }
+
+usage_outbox = UsageOutbox()
@@ -5,6 +5,7 @@ import threading
 import traceback
 
 from tools import DATA_DIR
+from Metrics.metrics import log_buffer_lines
 
 class Logger:
     def __init__(self, log_file_path=None, max_lines=1000):
@@ -57,3 +58,4 @@ class Logger:
 
 # Create a global singleton instance of Logger
 logger = Logger()
+log_buffer_lines.set_function(lambda: len(logger.logs))
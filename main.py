@@ -1,52 +1,63 @@
-import os
-import sys
-import time
-from Gui.WebServer.auto_discover import start_broadcast_thread
+import threading
+from startup_profile import startup_profile
 from helper_logs import logger
-from Filament import filament
-import BambuCloud.login
-import BambuCloud.slicer_filament
-from BambuPrinter.bambu_printer import *
-import Spoolman.spoolman_filament
-import Spoolman.login
-import Local_MQTT.local_mqtt as MQTT
-import BambuPrinter as BambuPrinter
-import Gui.WebServer.flutter_web_server as flutter_web_server
-import Gui.WebServer.websockets_service as websocket_service
-
-# Start GUI and websockets connection
-logger.log_info("Starting GUI")
-flutter_web_server.start_thread()
-logger.log_info("GUI started")
-logger.log_info("Starting autodiscover")
-start_broadcast_thread()
-logger.log_info("Autodiscover started")
-logger.log_info("Starting WebSockets")
-websocket_service.start_websocket_server()
-logger.log_info("Websocket started")
-
-# Start and connect to the local MQTT broker
-MQTT.StartMQTT()
-logger.log_info("FSM Started. Type 'exit' to exit.")
-
-# Main loop (Checks new filaments)
-while True:
-    try: 
-        # Save Filaments From Bambu Studio
-        filaments = BambuCloud.slicer_filament.GetSlicerFilaments()
-        filaments = BambuCloud.slicer_filament.ProcessSlicerFilament(filaments)
-        if filaments:
-            BambuCloud.slicer_filament.SaveFilamentsToFile(filaments)
-
-        # Save Filaments From Spoolman
-        filaments = Spoolman.spoolman_filament.GetSpoolmanFilaments()
-        filaments = Spoolman.spoolman_filament.ProcessSpoolmanFilament(filaments)
-        if filaments:
-            Spoolman.spoolman_filament.SaveFilamentsToFile(filaments)
-        
-        # Check every 24 hours (gui can force the check sooner)
-        time.sleep(24 * 60 * 60)
-
-    except Exception as e:
-        logger.log_exception(e)
 
+# Every service is imported and started in its own thread, so a slow one
+# (TLS connect to the printer, a heavy import) does not hold up the others
+
+def StartGui():
+    flutter_web_server = startup_profile.timed_import("Gui.WebServer.flutter_web_server")
+    flutter_web_server.start_thread()
+    logger.log_info("GUI started")
+
+def StartAutodiscover():
+    auto_discover = startup_profile.timed_import("Gui.WebServer.auto_discover")
+    auto_discover.start_broadcast_thread()
+    logger.log_info("Autodiscover started")
+
+def StartWebSockets():
+    websocket_service = startup_profile.timed_import("Gui.WebServer.websockets_service")
+    websocket_service.start_websocket_server()
+    logger.log_info("Websocket started")
+
+def StartPrinter():
+    # Start and connect to the local MQTT broker
+    MQTT = startup_profile.timed_import("Local_MQTT.local_mqtt")
+    MQTT.StartMQTT()
+    logger.log_info("FSM Started.")
+
+def StartSpoolmanFeed():
+    spoolman_feed = startup_profile.timed_import("Spoolman.spoolman_feed")
+    if spoolman_feed.LiveUpdatesEnabled():
+        spoolman_feed.spoolman_feed.Start()
+        logger.log_info("Spoolman change feed started")
+
+def RunPhase(name, func):
+    with startup_profile.phase(name):
+        try:
+            func()
+        except Exception as e:
+            logger.log_exception(e)
+
+logger.log_info("Starting services")
+threads = []
+for name, func in (("gui", StartGui), ("autodiscover", StartAutodiscover),
+                   ("websockets", StartWebSockets), ("mqtt", StartPrinter),
+                   ("spoolman", StartSpoolmanFeed)):
+    t = threading.Thread(target=RunPhase, args=(name, func), name=f"startup-{name}", daemon=True)
+    t.start()
+    threads.append(t)
+
+with startup_profile.phase("scheduler"):
+    sync_scheduler = startup_profile.timed_import("Scheduler.sync_scheduler").sync_scheduler
+
+def ReportStartup():
+    for t in threads:
+        t.join()
+    logger.log_info(startup_profile.report())
+
+threading.Thread(target=ReportStartup, name="startup-report", daemon=True).start()
+
+# Main loop (Syncs filaments from Bambu Cloud and Spoolman). The GUI and
+# finished prints wake it up through sync_scheduler.RequestSync()
+sync_scheduler.Run()
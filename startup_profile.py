@@ -0,0 +1,55 @@
+import importlib
+import threading
+import time
+from contextlib import contextmanager
+
+class StartupProfile:
+    """Records how long each startup phase and top-level import takes."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+        self.phases = []
+        self.imports = []
+
+    def _record(self, bucket, name, start, end):
+        with self.lock:
+            bucket.append({
+                "name": name,
+                "thread": threading.current_thread().name,
+                "start_ms": round((start - self.started) * 1000, 1),
+                "duration_ms": round((end - start) * 1000, 1),
+            })
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record(self.phases, name, start, time.perf_counter())
+
+    def timed_import(self, module_name):
+        """Import a module and record the time. Modules already loaded cost ~0."""
+        start = time.perf_counter()
+        module = importlib.import_module(module_name)
+        self._record(self.imports, module_name, start, time.perf_counter())
+        return module
+
+    def total_ms(self):
+        return round((time.perf_counter() - self.started) * 1000, 1)
+
+    def as_dict(self):
+        with self.lock:
+            return {"phases": list(self.phases), "imports": list(self.imports)}
+
+    def report(self):
+        lines = ["Startup profile (ms since process start):"]
+        for title, entries in (("phase", self.phases), ("import", self.imports)):
+            for entry in sorted(entries, key=lambda e: e["start_ms"]):
+                lines.append(f"  {title:<6} {entry['name']:<40} start {entry['start_ms']:>8.1f}"
+                             f"  took {entry['duration_ms']:>8.1f}  [{entry['thread']}]")
+        lines.append(f"  ready after {self.total_ms():.1f} ms")
+        return "\n".join(lines)
+
+startup_profile = StartupProfile()
@@ -23,6 +23,49 @@ def SaveNewToken(name, token):
     with open(CONFIG_FILE, 'w') as configfile:
         config.write(configfile)
 
+PRINTER_SECTION = "printer:"
+
+def _ReadRawConfig():
+    # No default section: printer sections must not inherit the legacy DEFAULT printer keys
+    config = configparser.ConfigParser(default_section="__no_default__")
+    ReadCredentials()  # Creates the file if needed
+    config.read(CONFIG_FILE)
+    return config
+
+def ReadPrinters():
+    """Configured printers keyed by dev_id.
+
+    Each printer lives in a [printer:<dev_id>] section. The single-printer keys
+    in DEFAULT (dev_id, printer_ip, dev_acces_code) still describe one printer.
+    """
+    config = _ReadRawConfig()
+    printers = {}
+    legacy = dict(config["DEFAULT"]) if config.has_section("DEFAULT") else {}
+    if legacy.get("dev_id"):
+        dev_id = legacy["dev_id"]
+        printers[dev_id] = {
+            "dev_id": dev_id,
+            "name": dev_id,
+            "printer_ip": legacy.get("printer_ip", ""),
+            "dev_acces_code": legacy.get("dev_acces_code", ""),
+        }
+    for section in config.sections():
+        if section.startswith(PRINTER_SECTION):
+            dev_id = section[len(PRINTER_SECTION):]
+            printer = printers.setdefault(dev_id, {"dev_id": dev_id, "name": dev_id,
+                                                   "printer_ip": "", "dev_acces_code": ""})
+            printer.update(config[section])
+    return printers
+
+def SavePrinterSetting(dev_id, name, value):
+    config = _ReadRawConfig()
+    section = PRINTER_SECTION + dev_id
+    if not config.has_section(section):
+        config.add_section(section)
+    config[section][name] = str(value)
+    with open(CONFIG_FILE, 'w') as configfile:
+        config.write(configfile)
+
 def IsValidIp(host: str) -> bool:
     try:
         socket.inet_aton(host)